@@ -0,0 +1,90 @@
+"""
+Election latency benchmark.
+
+Measures how long a candidate needs to decide an election in 5 and 7 node
+clusters when one, two or three of its peers are down. Live peers answer
+after a small network delay, dead peers only fail once the RPC deadline
+expires, which is what a dead TCP/TLS endpoint costs.
+
+Usage (from the root directory of the project):
+    python3 -m benchmarks.election_latency [--rounds 5] [--rpc_delay 0.002] [--dead_peer_delay 2.0]
+"""
+import argparse
+import statistics
+import time
+from unittest import mock
+
+from src.raft_node.compression import Compressor
+from src.raft_node.entry_cache import EntryCache
+from src.raft_node.log import Log
+from src.raft_node.log_storage import MemoryLogStorage
+from src.raft_node.log_writer import LogWriter
+from src.raft_node.raft_server import RaftServer, RaftState
+
+
+class InMemoryLog(Log):
+    def __init__(self, *args, **kwargs):
+        self.storage = MemoryLogStorage()
+        self.window_entries = 10000
+        self.cache = EntryCache(67108864)
+        self.writer = LogWriter(self.storage)
+        self.compressor = Compressor()
+        self.snapshot_index = 0
+        self.snapshot_term = 0
+        self.snapshot_membership = None
+        self.load_entries()
+        self.load_hard_state()
+        self.last_applied = 0
+
+
+class SimulatedPeer:
+    def __init__(self, alive, rpc_delay, dead_peer_delay):
+        self.alive = alive
+        self.rpc_delay = rpc_delay
+        self.dead_peer_delay = dead_peer_delay
+
+    def call(self, method, candidate_id, term, last_log_index, last_log_term):
+        if not self.alive:
+            time.sleep(self.dead_peer_delay)
+            return None
+        time.sleep(self.rpc_delay)
+        return {'term': term, 'vote_granted': True}
+
+
+def run_election(number_of_nodes, peers_down, rpc_delay, dead_peer_delay):
+    raft_servers = {i: {'host': 'localhost', 'port': 5000 + i} for i in range(1, number_of_nodes + 1)}
+    with mock.patch('src.raft_node.raft_server.Log', InMemoryLog):
+        server = RaftServer(1, raft_servers, None, None, None)
+    # Dead peers are the first to be asked, which was the worst case for the sequential loop
+    server.clients = {_id: SimulatedPeer(_id - 1 > peers_down, rpc_delay, dead_peer_delay)
+                      for _id in raft_servers if _id != 1}
+    server.election_timeout = dead_peer_delay
+    server.current_term = 1
+    server.state = RaftState.CANDIDATE
+
+    start = time.perf_counter()
+    server.start_election()
+    return time.perf_counter() - start, server.state
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--rpc_delay', type=float, default=0.002)
+    parser.add_argument('--dead_peer_delay', type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f"{'nodes':>5} {'down':>4} {'outcome':>9} {'median ms':>10} {'max ms':>9}")
+    for number_of_nodes in (5, 7):
+        for peers_down in (1, 2, 3):
+            timings = []
+            outcome = None
+            for _ in range(args.rounds):
+                elapsed, outcome = run_election(number_of_nodes, peers_down, args.rpc_delay, args.dead_peer_delay)
+                timings.append(elapsed * 1000)
+            print(f"{number_of_nodes:>5} {peers_down:>4} {outcome.name:>9} "
+                  f"{statistics.median(timings):>10.1f} {max(timings):>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+In-memory log footprint benchmark.
+
+Measures the memory the entries of the in-memory log take, with 1 and 10
+million entries of a small PUT command:
+    - objects: a list of LogEntry objects with an attribute dict, as the log
+      kept them before the EntryArray
+    - array: the EntryArray of the log, terms and command offsets in integer
+      arrays and the commands in a single bytearray
+
+The sizes are the sum of sys.getsizeof over the containers, objects and
+command strings, so they do not depend on the allocator.
+
+Usage (from the root directory of the project):
+    python3 -m benchmarks.log_memory [--entries 1000000 10000000]
+"""
+import argparse
+import sys
+import time
+
+from src.raft_node.log import EntryArray
+
+
+class DictLogEntry:
+    def __init__(self, index, term, command, is_committed=False):
+        self.index = index
+        self.term = term
+        self.command = command
+        self.is_committed = is_committed
+
+
+def command(index):
+    return f'PUT "key{index}": "value"'
+
+
+def measure_objects(number_of_entries):
+    entries = [DictLogEntry(index, 1, command(index)) for index in range(1, number_of_entries + 1)]
+    size = sys.getsizeof(entries)
+    for entry in entries:
+        size += sys.getsizeof(entry) + sys.getsizeof(entry.__dict__) + sys.getsizeof(entry.command)
+    return size
+
+
+def measure_array(number_of_entries):
+    entries = EntryArray()
+    entries.extend((1, command(index)) for index in range(1, number_of_entries + 1))
+    return sys.getsizeof(entries.terms) + sys.getsizeof(entries.command_ends) + sys.getsizeof(entries.commands)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, nargs='+', default=[1000000, 10000000])
+    args = parser.parse_args()
+
+    print(f"{'entries':>10} {'layout':>8} {'MB':>9} {'bytes/entry':>12} {'build s':>8}")
+    for number_of_entries in args.entries:
+        for label, measure in (('objects', measure_objects), ('array', measure_array)):
+            start = time.perf_counter()
+            size = measure(number_of_entries)
+            elapsed = time.perf_counter() - start
+            print(f"{number_of_entries:>10} {label:>8} {size / 1e6:>9.1f} {size / number_of_entries:>12.1f} "
+                  f"{elapsed:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
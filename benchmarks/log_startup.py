@@ -0,0 +1,62 @@
+"""
+Log startup benchmark.
+
+Measures the time to open a log written to the segmented write-ahead log, with
+100 thousand and 1 million entries, and the memory its entries then take:
+    - full: every entry after the snapshot is read into memory, as the log
+      loaded them before the window
+    - window: only the last log_window_entries entries are read, the older ones
+      are read back on demand
+
+Usage (from the root directory of the project):
+    python3 -m benchmarks.log_startup [--entries 100000 1000000] [--window 10000]
+"""
+import argparse
+import sys
+import tempfile
+import time
+
+from src.raft_node.log import EntryArray, LogEntry
+from src.raft_node.wal import SegmentedWAL
+
+BATCH_SIZE = 1000
+
+
+def write_log(directory, number_of_entries):
+    wal = SegmentedWAL(directory, fsync=False)
+    for first_index in range(1, number_of_entries + 1, BATCH_SIZE):
+        last_index = min(first_index + BATCH_SIZE - 1, number_of_entries)
+        wal.append([LogEntry(index, 1, f'PUT "key{index}": "value"') for index in range(first_index, last_index + 1)])
+    wal.commit(0, number_of_entries)
+    wal.close()
+
+
+def open_log(directory, load):
+    start = time.perf_counter()
+    wal = SegmentedWAL(directory, fsync=False)
+    loaded = load(wal)
+    entries = EntryArray(loaded[0]['index'] if loaded else 1)
+    entries.extend((entry['term'], entry['command']) for entry in loaded)
+    elapsed = time.perf_counter() - start
+    wal.close()
+    return elapsed, sys.getsizeof(entries.terms) + sys.getsizeof(entries.command_ends) + sys.getsizeof(entries.commands)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--window', type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{'entries':>10} {'load':>7} {'startup ms':>11} {'MB':>7}")
+    for number_of_entries in args.entries:
+        with tempfile.TemporaryDirectory() as directory:
+            write_log(directory, number_of_entries)
+            for label, load in (('full', lambda wal: wal.load_entries(0)),
+                                ('window', lambda wal: wal.load_last_entries(0, args.window))):
+                elapsed, size = open_log(directory, load)
+                print(f"{number_of_entries:>10} {label:>7} {elapsed * 1000:>11.1f} {size / 1e6:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+MongoDB log storage benchmark.
+
+Measures, against a running MongoDB server, the operations per second of the
+MongoDB log storage for the writes of a follower: appending the batches of
+entries received from the leader and committing them, and the time to load
+the log on restart. It compares:
+    - per-entry: one insert_one per entry, one update_one per committed entry
+      to set its commit flag and a backwards scan for the commit index, the
+      pattern of the log before the storage wrote in bulk
+    - bulk: one bulk write of upserts per batch and one update of the watermark
+      document per commit, with a unique index on the index of the entries
+
+Usage (from the root directory of the project):
+    python3 -m benchmarks.mongo_log_throughput [--mongo_uri mongodb://localhost:27017] [--entries 20000]
+        [--batch_size 64] [--entry_size 200]
+"""
+import argparse
+import time
+
+from pymongo import MongoClient
+
+from src.raft_node.log import LogEntry
+from src.raft_node.log_storage import MongoLogStorage
+
+DATABASE_NAME = 'raft_benchmark'
+
+
+class PerEntryMongoLogStorage(MongoLogStorage):
+    def append(self, entries):
+        for entry in entries:
+            self.collection.insert_one(entry.to_dict())
+
+    def commit(self, commit_index, new_commit_index):
+        for index in range(commit_index + 1, new_commit_index + 1):
+            self.collection.update_one({'index': index}, {'$set': {'is_committed': True}})
+
+    def load_commit_index(self):
+        entries = list(self.collection.find({}))
+        for entry in reversed(entries):
+            if entry['is_committed']:
+                return entry['index']
+        return 0
+
+
+def make_storage(storage_class, mongo_uri):
+    db = MongoClient(mongo_uri)[DATABASE_NAME]
+    if storage_class is MongoLogStorage:
+        db['log'].create_index('index', unique=True)
+    return storage_class(db['log'], db['log_snapshot'], db['log_state'], 1048576)
+
+
+def run(label, storage_class, mongo_uri, number_of_entries, batch_size, entry_size):
+    MongoClient(mongo_uri).drop_database(DATABASE_NAME)
+    storage = make_storage(storage_class, mongo_uri)
+    command = 'x' * entry_size
+
+    start = time.perf_counter()
+    for first_index in range(1, number_of_entries + 1, batch_size):
+        last_index = min(first_index + batch_size - 1, number_of_entries)
+        storage.append([LogEntry(index, 1, command) for index in range(first_index, last_index + 1)])
+        storage.commit(first_index - 1, last_index)
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    storage = make_storage(storage_class, mongo_uri)
+    storage.load_entries(storage.load_commit_index() // 2)
+    restart = time.perf_counter() - start
+
+    print(f"{label:>10} {number_of_entries / elapsed:>16.0f} {restart * 1000:>11.1f}")
+    MongoClient(mongo_uri).drop_database(DATABASE_NAME)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mongo_uri', default='mongodb://localhost:27017')
+    parser.add_argument('--entries', type=int, default=20000)
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--entry_size', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'storage':>10} {'entries/s (a+c)':>16} {'restart ms':>11}")
+    run('per-entry', PerEntryMongoLogStorage, args.mongo_uri, args.entries, args.batch_size, args.entry_size)
+    run('bulk', MongoLogStorage, args.mongo_uri, args.entries, args.batch_size, args.entry_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+Multi-Raft throughput benchmark.
+
+Runs a 3 node cluster in one process with 1, 2, 4 and 8 raft groups per node
+and measures the writes per second committed and applied while clients write
+to every group. Each write waits for its commit and apply, like a sync write of
+the key-value store.
+
+The nodes are real MultiRaft hosts. The network is replaced by in-process RPCs
+that marshal the requests with xmlrpc and wait rpc_delay, MongoDB by a log
+storage that waits storage_delay per write and the key-value servers by a state
+machine that keeps nothing. The info logs are turned off. Since the waits
+release the GIL, the groups overlap their network and storage round trips and
+the throughput grows with the number of groups until the CPU of the process is
+saturated. Real nodes are separate processes, each with its own cores.
+The logs write their entries with the given durability mode (sync, group or
+async, see durability in config.ini).
+
+Usage (from the root directory of the project):
+    python3 -m benchmarks.multi_raft_throughput [--groups 1 2 4 8] [--duration 5] [--clients_per_group 4]
+        [--rpc_delay 0.001] [--storage_delay 0.002] [--durability sync]
+"""
+import argparse
+import itertools
+import threading
+import time
+import xmlrpc.client
+from unittest import mock
+
+from src.logger import MyLogger
+from src.raft_node.compression import Compressor
+from src.raft_node.entry_cache import EntryCache
+from src.raft_node.log import Log
+from src.raft_node.log_storage import MemoryLogStorage
+from src.raft_node.log_writer import DURABILITY_MODES, LogWriter
+from src.raft_node.multi_raft import MultiRaft
+from src.raft_node.raft_server import RaftState
+
+STORAGE_DELAY = 0.002
+RPC_DELAY = 0.001
+DURABILITY = 'sync'
+# every run listens on new ports, the hosts of the previous run may still be winding down
+ports = itertools.count(20000, 10)
+rpc_servers = {}
+
+
+class SlowStorage(MemoryLogStorage):
+    """
+    An in-memory log storage that takes storage_delay per write.
+    """
+    def append(self, entries):
+        time.sleep(STORAGE_DELAY)
+        super().append(entries)
+
+    def commit(self, commit_index, new_commit_index):
+        time.sleep(STORAGE_DELAY)
+        super().commit(commit_index, new_commit_index)
+
+    def save_hard_state(self, term, voted_for):
+        time.sleep(STORAGE_DELAY)
+        super().save_hard_state(term, voted_for)
+
+    def save_last_applied(self, index):
+        time.sleep(STORAGE_DELAY)
+        super().save_last_applied(index)
+
+
+class InMemoryLog(Log):
+    def __init__(self, database_uri, database_name, collection_name, server_id, group_id=0):
+        self.server_id = server_id
+        self.group_id = group_id
+        self.storage = SlowStorage()
+        self.snapshot_chunk_size = 1048576
+        self.window_entries = 10000
+        self.prefetch_entries = 1000
+        self.cache = EntryCache(67108864)
+        self.writer = LogWriter(self.storage, DURABILITY)
+        self.compressor = Compressor()
+        self.snapshot_index = 0
+        self.snapshot_term = 0
+        self.snapshot_membership = None
+        self.entries = []
+        self.term_starts_terms = []
+        self.term_starts_indexes = []
+        self.load_entries()
+        self.load_hard_state()
+        self.last_applied = 0
+        self.applied_bytes_since_snapshot = 0
+
+    def apply_to_state_machine(self, entries):
+        return entries[-1].index
+
+    def create_state_machine_snapshot(self):
+        return '[]'
+
+    def restore_state_machine_snapshot(self, data):
+        pass
+
+
+class LocalRPCServer:
+    def __init__(self, host, port, threaded=False):
+        self.functions = {}
+        rpc_servers[port] = self
+
+    def register_function(self, function, name):
+        self.functions[name] = function
+
+    def run(self):
+        pass
+
+
+class LocalRPCClient:
+    def __init__(self, host, port, timeout=None):
+        self.port = port
+
+    def call(self, method, *args):
+        time.sleep(RPC_DELAY)
+        server = rpc_servers.get(self.port)
+        if server is None or method not in server.functions:
+            return None
+        request, _ = xmlrpc.client.loads(xmlrpc.client.dumps(args, allow_none=True))
+        try:
+            response = server.functions[method](*request)
+        except Exception:
+            return None
+        (response,), _ = xmlrpc.client.loads(xmlrpc.client.dumps((response,), allow_none=True))
+        return response
+
+
+def start_cluster(number_of_groups):
+    base_port = next(ports)
+    raft_servers = {i: {'host': 'localhost', 'port': base_port + i} for i in range(1, 4)}
+    with mock.patch('src.raft_node.raft_server.Log', InMemoryLog), \
+            mock.patch('src.raft_node.raft_server.RPCClient', LocalRPCClient), \
+            mock.patch('src.raft_node.multi_raft.RPCClient', LocalRPCClient), \
+            mock.patch('src.raft_node.multi_raft.RPCServer', LocalRPCServer):
+        hosts = [MultiRaft(server_id, raft_servers, None, None, 'log', number_of_groups)
+                 for server_id in raft_servers]
+        for host in hosts:
+            host.start()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and any(leader_of(hosts, group_id) is None
+                                                  for group_id in range(number_of_groups)):
+            time.sleep(0.05)
+    return hosts
+
+
+def stop_cluster(hosts):
+    for host in hosts:
+        host.stop_event.set()
+        host.coalescer.stop()
+        for group in host.groups:
+            group.is_running = False
+            group.applier.stop()
+            for replicator in group.replicators.values():
+                replicator.stop()
+
+
+def leader_of(hosts, group_id):
+    for host in hosts:
+        group = host.groups[group_id]
+        if group.state == RaftState.LEADER and group.is_running:
+            return group
+    return None
+
+
+def write(hosts, group_id, deadline, written):
+    payload = {'commands': ['PUT "key": "value"'], 'rep_ids': []}
+    while time.monotonic() < deadline:
+        leader = leader_of(hosts, group_id)
+        position = leader.append_entries_to_leader(payload) if leader is not None else False
+        if position is False:
+            time.sleep(0.01)
+            continue
+        if leader.wait_for_index(*position) == 'APPLIED':
+            written[group_id] += 1
+
+
+def run(number_of_groups, duration, clients_per_group):
+    hosts = start_cluster(number_of_groups)
+    written = [0] * number_of_groups
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=write, args=(hosts, group_id, deadline, written))
+               for group_id in range(number_of_groups) for _ in range(clients_per_group)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    leaders = sorted({leader_of(hosts, group_id).server_id for group_id in range(number_of_groups)
+                      if leader_of(hosts, group_id) is not None})
+    stop_cluster(hosts)
+    return sum(written) / duration, leaders
+
+
+def main():
+    global RPC_DELAY, STORAGE_DELAY, DURABILITY
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--groups', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--clients_per_group', type=int, default=4)
+    parser.add_argument('--rpc_delay', type=float, default=RPC_DELAY)
+    parser.add_argument('--storage_delay', type=float, default=STORAGE_DELAY)
+    parser.add_argument('--durability', choices=DURABILITY_MODES, default=DURABILITY)
+    args = parser.parse_args()
+    RPC_DELAY = args.rpc_delay
+    STORAGE_DELAY = args.storage_delay
+    DURABILITY = args.durability
+    # the info logs look up their caller on every call, they would be most of the CPU time
+    MyLogger.info = lambda self, message: None
+
+    print(f"{'groups':>6} {'writes/s':>10} {'speed-up':>9}  leaders on nodes")
+    baseline = None
+    for number_of_groups in args.groups:
+        throughput, leaders = run(number_of_groups, args.duration, args.clients_per_group)
+        baseline = baseline or throughput
+        print(f"{number_of_groups:>6} {throughput:>10.0f} {throughput / baseline:>8.1f}x  {leaders}")
+
+
+if __name__ == '__main__':
+    main()
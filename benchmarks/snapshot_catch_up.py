@@ -0,0 +1,117 @@
+"""
+Snapshot benchmark.
+
+Measures, with and without log compaction:
+    - restart: the time to load the log of a node from MongoDB
+    - catch-up: the time for an empty follower to reach the leader's last index
+
+The benchmark needs a running MongoDB server. The key-value servers are
+replaced by an in-process state machine that keeps the applied commands.
+
+Usage (from the root directory of the project):
+    python3 -m benchmarks.snapshot_catch_up [--mongo_uri mongodb://localhost:27017] [--entries 100000]
+"""
+import argparse
+import json
+import time
+from unittest import mock
+
+from pymongo import MongoClient
+
+from src.raft_node.log import Log, LogEntry
+from src.raft_node.raft_server import RaftServer, RaftState
+
+DATABASE_NAME = 'raft_benchmark'
+
+
+class InProcessStateMachine:
+    def __init__(self, *args, **kwargs):
+        self.applied = []
+
+    def call(self, method, *args):
+        if method == 'raft_request':
+            self.applied.append(args[0])
+        elif method == 'create_snapshot':
+            return json.dumps(self.applied)
+        elif method == 'restore_snapshot':
+            self.applied = json.loads(args[0])
+        return "OK"
+
+
+class LoopbackClient:
+    def __init__(self, server):
+        self.server = server
+
+    def call(self, method, *args):
+        if method == 'append_entries':
+            term, leader_id, prev_log_index, prev_log_term, entries, leader_commit = args
+            return self.server.append_entries_rpc(term, leader_id, prev_log_index, prev_log_term,
+                                                  [entry.to_dict() for entry in entries], leader_commit)
+        elif method == 'install_snapshot':
+            return self.server.install_snapshot_rpc(*args)
+
+
+def fill_collection(mongo_uri, collection_name, number_of_entries, entry_size):
+    collection = MongoClient(mongo_uri)[DATABASE_NAME][collection_name]
+    command = 'x' * entry_size
+    batch = []
+    for index in range(1, number_of_entries + 1):
+        batch.append(LogEntry(index, 1, command, True).to_dict())
+        if len(batch) == 10000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+
+
+def make_server(server_id, mongo_uri, collection_name):
+    raft_servers = {1: {'host': 'localhost', 'port': 5001}, 2: {'host': 'localhost', 'port': 5002}}
+    with mock.patch('src.raft_node.log.RPCClient', InProcessStateMachine):
+        return RaftServer(server_id, raft_servers, mongo_uri, DATABASE_NAME, collection_name)
+
+
+def run(mongo_uri, number_of_entries, entry_size, compact):
+    label = 'with snapshot' if compact else 'without snapshot'
+    MongoClient(mongo_uri).drop_database(DATABASE_NAME)
+    fill_collection(mongo_uri, 'leader', number_of_entries, entry_size)
+
+    leader = make_server(1, mongo_uri, 'leader')
+    leader.log.last_applied = leader.log.get_last_index()
+    if compact:
+        leader.log.compact(leader.log.get_last_index(), 1, json.dumps(['x' * entry_size] * number_of_entries))
+
+    start = time.perf_counter()
+    with mock.patch('src.raft_node.log.RPCClient', InProcessStateMachine):
+        Log(mongo_uri, DATABASE_NAME, 'leader', 1)
+    restart = time.perf_counter() - start
+
+    follower = make_server(2, mongo_uri, 'follower')
+    leader.clients = {2: LoopbackClient(follower)}
+    leader.current_term = 1
+    leader.state = RaftState.LEADER
+    leader.commit_index = leader.log.get_last_index()
+    leader.reset_progress()
+    leader.catch_up_threshold = 0
+    start = time.perf_counter()
+    while follower.log.get_last_index() < leader.log.get_last_index():
+        leader.send_append_entries_to_servers_multicast()
+    catch_up = time.perf_counter() - start
+
+    print(f"{label:>18} {number_of_entries:>9} {restart * 1000:>11.1f} {catch_up * 1000:>12.1f}")
+    MongoClient(mongo_uri).drop_database(DATABASE_NAME)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mongo_uri', default='mongodb://localhost:27017')
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--entry_size', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'':>18} {'entries':>9} {'restart ms':>11} {'catch-up ms':>12}")
+    for compact in (False, True):
+        run(args.mongo_uri, args.entries, args.entry_size, compact)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,10 @@ from src.kv_store.server import ServerJSON, ServerJSONEncoder
 
 basic_commands = WordCompleter(["PUT", "SEARCH", "DELETE", "clear", "login", "exit", "help"])
 raft_config = IniConfig('src/configurations/config.ini')
+LINEARIZABLE_FLAG = " --linearizable"
+ASYNC_FLAG = " --async"
+# bounded staleness read, e.g. SEARCH key --max_staleness=500 --max_lag=100
+STALENESS_FLAGS = re.compile(r' --(max_staleness|max_lag)=(\d+)$')
 
 
 def show_wellcome_screen():
@@ -57,11 +61,26 @@ def message_formatter(message: str) -> str:
     if message.lower() == 'exit':
         return message
 
+    consistency = None
+    write_mode = None
+    bounds = {}
+    if message.lower().startswith(('put', 'delete')) and message.endswith(ASYNC_FLAG):
+        message = message[:-len(ASYNC_FLAG)]
+        write_mode = 'async'
     if message.lower().startswith('put'):
         if not put_format_checker(message):
             return_msg = "Invalid format. Please use the following format: PUT \"key\": \"valid_json\""
             return return_msg
     elif message.lower().startswith('search'):
+        if message.endswith(LINEARIZABLE_FLAG):
+            message = message[:-len(LINEARIZABLE_FLAG)]
+            consistency = 'linearizable'
+        match = STALENESS_FLAGS.search(message)
+        while match is not None:
+            bounds[match.group(1)] = int(match.group(2))
+            message = message[:match.start()]
+            consistency = 'bounded'
+            match = STALENESS_FLAGS.search(message)
         if not search_format_checker(message):
             return_msg = "Invalid format. Please use the following format: SEARCH \"key.path1.field1\""
             return return_msg
@@ -71,7 +90,8 @@ def message_formatter(message: str) -> str:
             return return_msg
 
     # message = self.escape_quotes(message)
-    server_obj = ServerJSON(message)
+    server_obj = ServerJSON(message, consistency=consistency, write_mode=write_mode,
+                            max_staleness_ms=bounds.get('max_staleness'), max_lag=bounds.get('max_lag'))
     server_json = json.dumps(server_obj, cls=ServerJSONEncoder)
     return server_json
 
@@ -155,9 +175,10 @@ def show_help() -> None:
 
     # Define commands and their descriptions
     commands = {
-        'PUT': 'Inserts a new key (usage: PUT "key": "valid_json")',
-        'SEARCH': 'Searches for a key (usage: SEARCH key.path.to.field1)',
-        'DELETE': 'Deletes a key (usage: DELETE key)',
+        'PUT': 'Inserts a new key (usage: PUT "key": "valid_json" [--async])',
+        'SEARCH': 'Searches for a key (usage: SEARCH key.path.to.field1 [--linearizable | '
+                  '--max_staleness=<ms> --max_lag=<entries>])',
+        'DELETE': 'Deletes a key (usage: DELETE key [--async])',
         'exit': 'Quit the client'
     }
 
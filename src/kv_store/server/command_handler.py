@@ -50,7 +50,7 @@ def search_top_lvl_key(current_server_id: int, server_list: dict, _request: str,
 
 
 def search(current_server_id: int, server_list: dict, _request: 'ServerJSON',
-           query_handler: 'RequestHandler', client_handlers: dict) -> str:
+           query_handler: 'RequestHandler', client_handlers: dict, local: bool = True) -> str:
     """
     Search for a key in the server list.
 
@@ -64,15 +64,17 @@ def search(current_server_id: int, server_list: dict, _request: 'ServerJSON',
         _request (str): The request containing the key to search.
         query_handler: The query handler object.
         client_handlers (dict): The dictionary containing the client sockets for each server.
+        local (bool): Whether the current server may answer, False if its state is too stale.
 
     Returns:
         str: The value corresponding to the key if it exists in any of the servers,
              "NOT FOUND" otherwise.
     """
     # check if the key is in the current server
-    response = query_handler.execute(_request)
-    if response != "NOT FOUND" and response is not None:
-        return response
+    if local:
+        response = query_handler.execute(_request)
+        if response != "NOT FOUND" and response is not None:
+            return response
 
     dump_request = json.dumps(_request, cls=ServerJSONEncoder)
 
@@ -1,6 +1,7 @@
 import json
 import random
 import threading
+import time
 from typing import List
 
 from src.configuration_reader import IniConfig, JsonConfig
@@ -10,7 +11,10 @@ from src.kv_store.server.query_handler import RequestHandler
 from src.kv_store.server.raft_json import RaftJSON
 from src.kv_store.server.server_json import ServerJSON
 from src.logger import MyLogger
-from src.raft_node.api_helper import api_post_request
+from src.metrics import LATENCY_BUCKETS, Metrics
+from src.raft_node.api_helper import api_post_request, api_get_request
+from src.raft_node.membership import Membership
+from src.raft_node.sharding import KeyRouter
 from src.rpc import RPCServer, RPCClient
 
 logger = MyLogger()
@@ -37,15 +41,40 @@ class KVServer:
         self.api_server_host = servers.get_property(str(self.server_id))['host']
         self.api_server_port = servers.get_property(str(self.server_id))['api_port']
 
+        # The cluster configuration, in the format of servers.json. It is read from the file once
+        # and then kept up to date by the configuration entries of the Raft log.
+        self.membership = dict(servers.config)
+        self.membership_version = 0
+
         # Create a RequestHandler instance to handle all queries
         self.query_handler = RequestHandler()
 
+        # The latest Raft request that put each top-level key, also for keys stored on other
+        # servers. Together they make up the snapshot of the replicated state.
+        self.applied_requests = {}
+        # Index of the last Raft log entry applied by every Raft group, entries delivered again are skipped
+        self.last_applied_indexes = {}
+        # The top-level keys are sharded over the Raft groups by hash range, a write goes to the group of its key
+        self.router = KeyRouter(int(raft_config.get_property('raft', 'raft_groups')))
+        self.apply_lock = threading.Lock()
+
+        # "sync" answers a write once Raft has committed and applied it, "async" once it is appended
+        self.write_mode = raft_config.get_property('kv_store', 'write_mode')
+        # How long a bounded staleness SEARCH waits for the local state to be fresh enough
+        self.bounded_read_timeout = float(raft_config.get_property('kv_store', 'bounded_read_timeout'))
+        self.metrics = Metrics()
+
         # Create RPC server and register functions
-        self.rpc_server = RPCServer(host=self.kv_server_host, port=self.kv_server_port)
+        # Threaded, so that a write waiting for Raft does not hold up the entries Raft applies meanwhile
+        self.rpc_server = RPCServer(host=self.kv_server_host, port=self.kv_server_port, threaded=True)
         self.rpc_server.register_function(self.client_request_rpc, 'client_request')
         self.rpc_server.register_function(self.kv_request_rpc, 'kv_request')
         self.rpc_server.register_function(self.raft_request_rpc, 'raft_request')
-        self.rpc_server.register_function(self.update_raft_config, 'update_raft_config')
+        self.rpc_server.register_function(self.raft_batch_request_rpc, 'raft_batch_request')
+        self.rpc_server.register_function(self.create_snapshot_rpc, 'create_snapshot')
+        self.rpc_server.register_function(self.restore_snapshot_rpc, 'restore_snapshot')
+        self.rpc_server.register_function(self.wait_for_index_rpc, 'wait_for_index')
+        self.rpc_server.register_function(self.get_metrics_rpc, 'get_metrics')
 
         # Create RPC clients for all other servers
         self.client_handlers = {}
@@ -63,7 +92,7 @@ class KVServer:
 
         This method creates RPC clients for all other servers and stores them in the client_handlers dictionary.
         """
-        for server_id, server in servers.config.items():
+        for server_id, server in self.membership.items():
             if int(server_id) != self.server_id:
                 self.client_handlers[server_id] = RPCClient(host=server['host'], port=server['kv_port'])
 
@@ -84,75 +113,104 @@ class KVServer:
         Firstly send SEARCH to KV-servers to avoid sending messages over Raft
         for better performance and network usage.
 
-        **SEARCH**: Send SEARCH request to KV-servers without passing the message over Raft
+        **SEARCH**: Send SEARCH request to KV-servers without passing the message over Raft.
+        A linearizable SEARCH first waits on the Raft read barrier, so that every
+        write committed before the request is visible. A bounded SEARCH is only
+        answered by KV-servers whose state is within its staleness bounds, if none
+        of them holds the key it is read as a linearizable SEARCH.
 
 
         Args:
             request (str): Request received from the client.
         """
         logger.info(f"Received client request: {request}")
+        started_at = time.monotonic()
         shuffled_rep_ids = self.replication_ids_shuffled()
 
         decoded_json = json.loads(request)
         server_instance = ServerJSON.from_json(decoded_json)
         command_type = server_instance.get_command_type()
+        write_mode = server_instance.write_mode or self.write_mode
+
+        if command_type in ('PUT', 'DELETE', 'SEARCH'):
+            group_id = self.router.group_of(server_instance.get_command_key())
 
         if command_type == 'PUT':
             # self.refresh_client_handlers_if_needed()
-            if search_top_lvl_key(current_server_id=self.server_id, server_list=servers.config,
+            if search_top_lvl_key(current_server_id=self.server_id, server_list=self.membership,
                                   _request=request, query_handler=self.query_handler,
                                   client_handlers=self.client_handlers):
                 # stage 1 --> DELETE FIRST
                 try:
                     self.send_to_raft(["DELETE " + server_instance.get_command_value()],
-                                      self.all_replication_ids_for_deletion())
+                                      self.all_replication_ids_for_deletion(), group_id)
                 except Exception as e:
                     logger.error(f"Failed to send request to Raft: {e}")
                     return f"Failed to send request to Raft: {e}"
 
                 # stage 2 --> PUT after deletion
                 try:
-                    self.send_to_raft([server_instance.commands], shuffled_rep_ids)
+                    position = self.send_to_raft([server_instance.commands], shuffled_rep_ids, group_id)
                 except Exception as e:
                     logger.error(f"Failed to send request to Raft: {e}")
                     return f"Failed to send request to Raft: {e}"
 
                 response = f"Top level key \"{server_instance.get_command_key()}\" already exists. " \
                            f"Send deletion message and then insert."
-                return response
+                return self.acknowledge_write(response, position, write_mode, started_at)
             else:
                 # do not exist so PUT directly
                 try:
-                    self.send_to_raft([server_instance.commands], shuffled_rep_ids)
+                    position = self.send_to_raft([server_instance.commands], shuffled_rep_ids, group_id)
                 except Exception as e:
                     logger.error(f"Failed to send request to Raft: {e}")
                     return f"Failed to send request to Raft: {e}"
                 response = f"server id {self.server_id}: Send insertion message for " \
                            f"command {json.loads(request)['commands']}"
                 logger.info(f"Response: {response}")
-                return "KEY INSERTED"
+                return self.acknowledge_write("KEY INSERTED", position, write_mode, started_at)
         elif command_type == 'DELETE':
             # self.refresh_client_handlers_if_needed()
-            if search_top_lvl_key(current_server_id=self.server_id, server_list=servers.config,
+            if search_top_lvl_key(current_server_id=self.server_id, server_list=self.membership,
                                   _request=request, query_handler=self.query_handler,
                                   client_handlers=self.client_handlers):
                 # key exists so DELETE directly
                 try:
-                    self.send_to_raft(["DELETE " + server_instance.get_command_value()],
-                                      self.all_replication_ids_for_deletion())
+                    position = self.send_to_raft(["DELETE " + server_instance.get_command_value()],
+                                                 self.all_replication_ids_for_deletion(), group_id)
                 except Exception as e:
                     logger.error(f"Failed to send request to Raft: {e}")
                     return f"Failed to send request to Raft: {e}"
                 response = f"Send deletion message for top level key \"{get_key(request)}\""
                 logger.info(f"Response: {response}")
-                return "KEY DELETED"
+                return self.acknowledge_write("KEY DELETED", position, write_mode, started_at)
             else:
                 # key does not exist so send error message
                 response = f"Top level key {get_key(request)} not found to delete it"
                 logger.info(f"Response: {response}")
                 return response
         elif command_type == 'SEARCH':
-            response = search(current_server_id=self.server_id, server_list=servers.config, _request=server_instance,
+            if server_instance.consistency == 'bounded':
+                response = search(current_server_id=self.server_id, server_list=self.membership,
+                                  _request=server_instance, query_handler=self.query_handler,
+                                  client_handlers=self.client_handlers,
+                                  local=self.is_fresh_enough(server_instance, group_id))
+                if response != "NOT FOUND":
+                    self.metrics.counter('bounded_reads').inc()
+                    logger.info(f"Response: {response}")
+                    return response
+                # the fresh replicas do not hold the key, the stale ones may
+                self.metrics.counter('bounded_reads_forwarded').inc()
+                server_instance.consistency = 'linearizable'
+            if server_instance.consistency == 'linearizable':
+                read_index = self.read_barrier(group_id=group_id)
+                if read_index is None:
+                    response = "Failed to confirm a linearizable read with Raft"
+                    logger.error(response)
+                    return response
+                # the other KV-servers must also have applied the read index before they answer
+                server_instance.read_index = read_index
+            response = search(current_server_id=self.server_id, server_list=self.membership, _request=server_instance,
                               query_handler=self.query_handler, client_handlers=self.client_handlers)
             logger.info(f"Response: {response}")
             return response
@@ -162,17 +220,145 @@ class KVServer:
             logger.info(f"Response: {response}")
             return response
 
-    def send_to_raft(self, commands: List[str], shuffled_rep_ids: List[int]) -> None:
+    def send_to_raft(self, commands: List[str], shuffled_rep_ids: List[int], group_id: int = 0) -> dict:
         """
         Sends a payload to the Raft server for processing.
 
         Args:
            commands (List[str]): The commands to send, represented as a list of strings.
            shuffled_rep_ids (List[int]): The shuffled list of replica IDs to determine the order of processing.
+           group_id (int): The Raft group that owns the top-level key of the commands.
+
+        Returns:
+            dict: The "index" and "term" of the Raft log entry of the payload, and its "group".
+
+        Raises:
+            RuntimeError: If the Raft leader did not append the payload.
         """
-        # TODO: catch the exception and send back to client.
         raft_obj = RaftJSON(commands, shuffled_rep_ids)
-        api_post_request(f"https://{self.api_server_host}:{self.api_server_port}/append_entries", raft_obj.to_json())
+        response = api_post_request(
+            f"https://{self.api_server_host}:{self.api_server_port}/append_entries?group={group_id}",
+            raft_obj.to_json()).json()
+        if 'index' not in response:
+            raise RuntimeError(response.get('message', 'the Raft leader did not append the entry'))
+        return response
+
+    def acknowledge_write(self, response: str, position: dict, write_mode: str, started_at: float) -> str:
+        """
+        Answer a write sent to Raft. In "sync" mode the answer waits until the
+        write is committed and applied, so it is durable and visible to every
+        read that follows, and its end-to-end latency is recorded. In "async"
+        mode the answer is immediate and holds the index and term of the write,
+        which the client can pass to wait_for_index later.
+
+        Args:
+            response (str): The answer for an acknowledged write.
+            position (dict): The "index", "term" and "group" of the write returned by send_to_raft.
+            write_mode (str): "sync" or "async".
+            started_at (float): The time.monotonic() at which the request was received.
+
+        Returns:
+            str: The answer to the client.
+        """
+        group_id = position.get('group', 0)
+        if write_mode == 'async':
+            if self.router.number_of_groups > 1:
+                return f"{response} (group {group_id}, index {position['index']}, term {position['term']})"
+            return f"{response} (index {position['index']}, term {position['term']})"
+        write_status = self.wait_for_index_rpc(position['index'], position['term'], group_id=group_id)
+        if write_status != 'APPLIED':
+            self.metrics.counter('writes_not_acknowledged').inc()
+            logger.error(f"Write at index {position['index']} was not acknowledged: {write_status}")
+            return f"Write not acknowledged by Raft: {write_status}"
+        self.metrics.histogram('write_latency', LATENCY_BUCKETS).observe(time.monotonic() - started_at)
+        return response
+
+    def wait_for_index_rpc(self, index: int, term: int, timeout: float = None, group_id: int = 0) -> str:
+        """
+        Long-poll the local Raft server until the write with the given index and
+        term is committed and applied.
+
+        Args:
+            index (int): The Raft log index of the write.
+            term (int): The Raft term of the write.
+            timeout (float): The maximum time to wait in seconds, by default the one of the Raft server.
+            group_id (int): The Raft group of the write.
+
+        Returns:
+            str: "APPLIED", "LOST", "TIMEOUT" or "UNKNOWN", see RaftServer.write_status,
+                 or "UNREACHABLE" if the Raft server could not be asked.
+        """
+        url = f"https://{self.api_server_host}:{self.api_server_port}/wait_for_index" \
+              f"?index={index}&term={term}&group={group_id}"
+        if timeout is not None:
+            url += f"&timeout={timeout}"
+        try:
+            return api_get_request(url).json()['write_status']
+        except Exception as e:
+            logger.error(f"Failed to wait for index {index}: {e}")
+            return "UNREACHABLE"
+
+    def get_metrics_rpc(self) -> dict:
+        """
+        Returns:
+            dict: The metrics of the server, e.g. the write_latency percentiles of the sync writes.
+        """
+        return self.metrics.to_dict()
+
+    def read_barrier(self, read_index: int = None, group_id: int = 0) -> int | None:
+        """
+        Wait on the read barrier of the local Raft server. When it returns, every
+        entry up to the read index has been applied to the local trie.
+
+        Args:
+            read_index (int): A read index obtained by another KV-server. If None,
+                a new read index is obtained from the Raft leader.
+            group_id (int): The Raft group that owns the key to read.
+
+        Returns:
+            int | None: The read index, or None if the read could not be confirmed.
+        """
+        url = f"https://{self.api_server_host}:{self.api_server_port}/read_barrier?group={group_id}"
+        if read_index is not None:
+            url += f"&read_index={read_index}"
+        try:
+            response = api_get_request(url).json()
+        except Exception as e:
+            logger.error(f"Failed to reach the Raft read barrier: {e}")
+            return None
+        if response['status'] != 'OK':
+            logger.info(f"Read barrier failed: {response['message']}")
+            return None
+        return response['read_index']
+
+    def is_fresh_enough(self, server_instance: ServerJSON, group_id: int) -> bool:
+        """
+        Check that the local state is within the staleness bounds of a bounded
+        SEARCH, waiting up to bounded_read_timeout for the local Raft server to
+        catch up.
+
+        Args:
+            server_instance (ServerJSON): A SEARCH with a "bounded" consistency.
+            group_id (int): The Raft group that owns the key to read.
+
+        Returns:
+            bool: True if the search can be answered from the local state.
+        """
+        url = f"https://{self.api_server_host}:{self.api_server_port}/bounded_read" \
+              f"?group={group_id}&timeout={self.bounded_read_timeout}"
+        if server_instance.max_lag is not None:
+            url += f"&max_entries={server_instance.max_lag}"
+        if server_instance.max_staleness_ms is not None:
+            url += f"&max_seconds={server_instance.max_staleness_ms / 1000}"
+        try:
+            response = api_get_request(url).json()
+        except Exception as e:
+            logger.error(f"Failed to check the staleness of the local state: {e}")
+            return False
+        if response['status'] != 'OK':
+            logger.info(f"Local state too stale for a bounded read: {response['staleness']}")
+            return False
+        return True
 
     def raft_request_rpc(self, request: str) -> str:
         """
@@ -183,59 +369,166 @@ class KVServer:
 
         Args:
             request (str): Request received from the Raft server.
+
+        Returns:
+            str: The response of the last command of the request.
         """
         logger.info(f"Received raft request: {request}")
         decoded_raft = json.loads(request)
+        if Membership.COMMAND_KEY in decoded_raft:
+            return self.apply_membership(Membership.from_dict(decoded_raft[Membership.COMMAND_KEY]))
         raft_request_instance = RaftJSON.from_json(decoded_raft)
         requests_list = raft_request_instance.commands
+        self.track_applied_requests(raft_request_instance)
 
         if not check_id_exist(request, self.server_id):
             logger.info(f"Node ID {self.server_id} not found in request. Ignore it.")
-        else:
-            for request in requests_list:
-                temp_request = ServerJSON(request)
-                command_type = temp_request.get_command_type()
-                if command_type == 'PUT':
-                    response = self.query_handler.execute(temp_request)
-                    logger.info(f"Response: {response}")
-                    return response
-                elif command_type == 'DELETE':
-                    response = self.query_handler.execute(temp_request)
-                    logger.info(f"Response: {response}")
-                    return response
-                else:
-                    response = f"\"{command_type}\" is invalid command from a RaftServer"
-                    logger.error(response)
-                    return response
+            return None
+        response = None
+        for command in requests_list:
+            temp_request = ServerJSON(command)
+            command_type = temp_request.get_command_type()
+            if command_type in ('PUT', 'DELETE'):
+                response = self.query_handler.execute(temp_request)
+                logger.info(f"Response: {response}")
+            else:
+                response = f"\"{command_type}\" is invalid command from a RaftServer"
+                logger.error(response)
+        return response
+
+    def raft_batch_request_rpc(self, entries: List[list], group_id: int = 0) -> int:
+        """
+        Apply a contiguous range of committed Raft log entries with one call. The
+        entries are applied in log order, each as a raft_request. The Raft server
+        delivers a batch again if the call failed, so the entries up to the last
+        applied index of the group are skipped.
+
+        Every group changes its membership along with the others, the configuration
+        entries of group 0 are the ones applied.
+
+        Args:
+            entries (List[list]): The [index, command] pairs of the entries, in log order.
+            group_id (int): The Raft group of the entries.
+
+        Returns:
+            int: The highest applied index of the group.
+        """
+        logger.info(f"Received raft batch of {len(entries)} entries of group {group_id}")
+        with self.apply_lock:
+            last_applied_index = self.last_applied_indexes.get(group_id, 0)
+            for index, command in entries:
+                if index <= last_applied_index:
+                    continue
+                if group_id == 0 or not command.startswith(Membership.COMMAND_PREFIX):
+                    self.raft_request_rpc(command)
+                last_applied_index = index
+                self.last_applied_indexes[group_id] = index
+            return last_applied_index
+
+    def track_applied_requests(self, raft_request: RaftJSON) -> None:
+        """
+        Keep the latest PUT request of every top-level key and forget the deleted
+        keys, so that a snapshot can be created at any applied index.
+
+        Args:
+            raft_request (RaftJSON): A request received from the Raft server.
+        """
+        for command in raft_request.commands:
+            server_instance = ServerJSON(command)
+            command_type = server_instance.get_command_type()
+            if command_type == 'PUT':
+                self.applied_requests[server_instance.get_command_key()] = \
+                    json.dumps(RaftJSON([command], raft_request.rep_ids).to_json())
+            elif command_type == 'DELETE':
+                self.applied_requests.pop(server_instance.get_command_key(), None)
+
+    def group_keys(self, group_id: int) -> List[str]:
+        """
+        Returns:
+            List[str]: The applied top-level keys owned by the Raft group.
+        """
+        return [key for key in self.applied_requests if self.router.group_of(key) == group_id]
 
-    def update_raft_config(self, _request: str) -> str:
+    def create_snapshot_rpc(self, group_id: int = 0) -> str:
         """
-        Update the Raft configuration. This method is called when a new node
-        is added to the cluster via the RPC call from the raft server.
+        Create a snapshot of the replicated state of a Raft group, the keys it owns.
+        It is called by the Raft server before it compacts the log of the group.
 
         Args:
-            _request (str): The request to update the Raft configuration.
+            group_id (int): The Raft group to snapshot.
 
         Returns:
-            str: The response from the Raft server.
+            str: The snapshot, the list of the Raft requests that rebuild the state.
         """
-        global servers
+        with self.apply_lock:
+            requests_list = [self.applied_requests[key] for key in self.group_keys(group_id)]
+        logger.info(f"Creating snapshot of {len(requests_list)} keys of group {group_id}")
+        return json.dumps(requests_list)
 
-        servers = JsonConfig('src/configurations/servers.json')
+    def restore_snapshot_rpc(self, snapshot: str, group_id: int = 0) -> str:
+        """
+        Replace the state of a Raft group with a snapshot received from its leader,
+        the keys of the other groups are kept. Every request of the snapshot is
+        applied as if it came from the log, so the server only stores the keys it
+        is a replica of.
 
-        logger.info(f"Received raft config update request: {_request}")
-        request = json.loads(_request)
-        command = request['command']
-        payload = request['payload']
+        Args:
+            snapshot (str): A snapshot created by create_snapshot_rpc.
+            group_id (int): The Raft group of the snapshot.
 
-        if command == "add_node":
-            self.client_handlers[payload['id']] = RPCClient(host=payload['host'], port=payload['kv_port'])
-        elif command == "delete_node":
-            del self.client_handlers[payload]
-        elif command == "update_node":
-            del self.client_handlers[payload['id']]
-            self.client_handlers[payload['id']] = RPCClient(host=payload['host'], port=payload['kv_port'])
+        Returns:
+            str: "OK" when the snapshot is restored.
+        """
+        requests_list = json.loads(snapshot)
+        logger.info(f"Restoring snapshot of {len(requests_list)} keys of group {group_id}")
+        with self.apply_lock:
+            if self.router.number_of_groups == 1:
+                self.query_handler = RequestHandler()
+                self.applied_requests = {}
+            else:
+                for key in self.group_keys(group_id):
+                    self.query_handler.execute(ServerJSON(f"DELETE {key}"))
+                    del self.applied_requests[key]
+            # the Raft server applies the entries after the snapshot next
+            self.last_applied_indexes[group_id] = 0
+            for request in requests_list:
+                self.raft_request_rpc(request)
+        return "OK"
+
+    def apply_membership(self, membership: Membership) -> str:
+        """
+        Switch to a cluster configuration committed in the Raft log. Configurations
+        are applied in log order, between the requests committed before and after
+        them, and saved to servers.json so that a restarted server starts from the
+        latest one.
+
+        Args:
+            membership (Membership): The configuration of a committed configuration entry.
+
+        Returns:
+            str: "OK" when the configuration is applied.
+        """
+        logger.info(f"Applying raft configuration: {membership}")
+        new_membership = {}
+        for server_id, info in membership.servers.items():
+            if 'kv_port' in info:
+                new_membership[str(server_id)] = {'host': info['host'], 'raft_port': info['port'],
+                                                  'api_port': info['api_port'], 'kv_port': info['kv_port']}
+            elif str(server_id) in self.membership:
+                new_membership[str(server_id)] = self.membership[str(server_id)]
+            else:
+                logger.error(f"The configuration holds no KV port for server {server_id}")
+
+        for server_id, server in new_membership.items():
+            if int(server_id) != self.server_id and self.membership.get(server_id) != server:
+                self.client_handlers[server_id] = RPCClient(host=server['host'], port=server['kv_port'])
+        for server_id in self.membership.keys() - new_membership.keys():
+            self.client_handlers.pop(server_id, None)
+        self.membership = new_membership
+        self.membership_version += 1
 
+        servers.config = dict(new_membership)
+        servers.save()
         return "OK"
 
     def kv_request_rpc(self, request: str) -> str:
@@ -255,6 +548,14 @@ class KVServer:
         server_instance = ServerJSON.from_json(decoded_json)
         command_type = server_instance.get_command_type()
         if command_type == 'SEARCH':
+            group_id = self.router.group_of(server_instance.get_command_key())
+            if server_instance.read_index is not None and \
+                    self.read_barrier(server_instance.read_index, group_id) is None:
+                logger.info(f"Index {server_instance.read_index} has not been applied. Not answering.")
+                return None
+            if server_instance.consistency == 'bounded' and not self.is_fresh_enough(server_instance, group_id):
+                logger.info("Local state is too stale for the bounded read. Not answering.")
+                return None
             answer = self.query_handler.execute(server_instance)
             logger.info(f"Response: {answer}")
             return answer
@@ -273,12 +574,10 @@ class KVServer:
         Returns:
             list: A random list of replication IDs.
         """
-        _servers = JsonConfig('src/configurations/servers.json')
-        server_ids = [server_id for server_id in _servers.config.keys() if server_id != self.server_id]
-        return random.sample(server_ids, min(self.replication_factor, len(_servers.config.keys())))
+        server_ids = [server_id for server_id in self.membership.keys() if server_id != self.server_id]
+        return random.sample(server_ids, min(self.replication_factor, len(self.membership)))
 
-    @staticmethod
-    def all_replication_ids_for_deletion() -> List[int]:
+    def all_replication_ids_for_deletion(self) -> List[int]:
         """
         Get the list of Key-Value store IDs.
 
@@ -288,7 +587,6 @@ class KVServer:
         Returns:
             list: A random list of all IDs.
         """
-        _servers = JsonConfig('src/configurations/servers.json')
-        server_ids = [server_id for server_id in _servers.config.keys()]
+        server_ids = list(self.membership.keys())
         random.shuffle(server_ids)
         return server_ids
@@ -1,4 +1,5 @@
 import json
+import threading
 
 from src.kv_store.server.server_json import ServerJSON
 from src.kv_store.server.raft_json import RaftJSON
@@ -11,6 +12,8 @@ logger = MyLogger()
 class RequestHandler:
     """
     Handles the execution of different types of requests on a data tree.
+    Requests are executed one at a time, so that searches of concurrent
+    clients do not see a half-applied write.
 
     Attributes:
         trie (Trie): The data tree used for storing key-value pairs.
@@ -21,6 +24,7 @@ class RequestHandler:
         Initializes an instance of RequestHandler.
         """
         self.trie = Trie()
+        self._lock = threading.Lock()
 
     def execute(self, query: 'ServerJSON' or 'RaftJSON') -> str | None:
         """
@@ -36,12 +40,15 @@ class RequestHandler:
         command = query.get_command_type()
 
         if command == "PUT":
-            return self._execute_put_request(query_payload)
+            with self._lock:
+                return self._execute_put_request(query_payload)
         elif command == "DELETE":
-            return self._execute_delete_request(query_payload)
+            with self._lock:
+                return self._execute_delete_request(query_payload)
         elif command == "SEARCH":
             key_search = query_payload.replace("\"", "")
-            return self._execute_search_request(key_search)
+            with self._lock:
+                return self._execute_search_request(key_search)
         else:
             logger.info(f"Wrong query: {query}")
             logger.info("Wrong type of query. Request must be: PUT, DELETE, SEARCH.")
@@ -7,16 +7,34 @@ class ServerJSON:
 
     Attributes:
         commands (str): The commands to be executed.
+        consistency (str): Optional read consistency of a SEARCH command ("linearizable" or "bounded").
+        read_index (int): Optional Raft index that must be applied before a SEARCH is answered.
+        write_mode (str): Optional write mode of a PUT or DELETE command ("sync" or "async").
+        max_staleness_ms (int): Optional bound of a "bounded" SEARCH, on the time since the answering
+            replica was up to date with the Raft leader.
+        max_lag (int): Optional bound of a "bounded" SEARCH, on the committed entries the answering
+            replica has not applied.
     """
 
-    def __init__(self, commands: str):
+    def __init__(self, commands: str, consistency: str = None, read_index: int = None, write_mode: str = None,
+                 max_staleness_ms: int = None, max_lag: int = None):
         """
         Initializes a ServerJSON object.
 
         Args:
             commands (str): The commands to be executed.
+            consistency (str): Optional read consistency of a SEARCH command ("linearizable" or "bounded").
+            read_index (int): Optional Raft index that must be applied before a SEARCH is answered.
+            write_mode (str): Optional write mode of a PUT or DELETE command ("sync" or "async").
+            max_staleness_ms (int): Optional staleness bound of a "bounded" SEARCH, in milliseconds.
+            max_lag (int): Optional staleness bound of a "bounded" SEARCH, in Raft log entries.
         """
         self.commands = commands
+        self.consistency = consistency
+        self.read_index = read_index
+        self.write_mode = write_mode
+        self.max_staleness_ms = max_staleness_ms
+        self.max_lag = max_lag
 
     def get_command_type(self) -> str:
         """
@@ -67,9 +85,20 @@ class ServerJSON:
         Returns:
             The ServerJSON object in JSON format.
         """
-        return {
+        json_data = {
             "commands": self.commands
         }
+        if self.consistency is not None:
+            json_data["consistency"] = self.consistency
+        if self.read_index is not None:
+            json_data["read_index"] = self.read_index
+        if self.write_mode is not None:
+            json_data["write_mode"] = self.write_mode
+        if self.max_staleness_ms is not None:
+            json_data["max_staleness_ms"] = self.max_staleness_ms
+        if self.max_lag is not None:
+            json_data["max_lag"] = self.max_lag
+        return json_data
 
 
 class ServerJSONEncoder(json.JSONEncoder):
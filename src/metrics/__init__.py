@@ -0,0 +1,3 @@
+from .metrics import DEFAULT_BUCKETS, LATENCY_BUCKETS, Counter, Gauge, Histogram, Metrics
+
+__all__ = ['DEFAULT_BUCKETS', 'LATENCY_BUCKETS', 'Counter', 'Gauge', 'Histogram', 'Metrics']
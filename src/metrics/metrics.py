@@ -0,0 +1,190 @@
+import bisect
+import math
+import threading
+
+DEFAULT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+# upper bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)
+
+
+class Counter:
+    """
+    A thread safe monotonically increasing counter.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """
+        Increase the counter.
+
+        Args:
+            amount (int): The amount to add to the counter.
+        """
+        with self._lock:
+            self.value += amount
+
+    def to_dict(self):
+        return self.value
+
+
+class Gauge:
+    """
+    A thread safe value that can go up and down, e.g. the length of a queue.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        """
+        Set the gauge to a new value.
+
+        Args:
+            value (float): The current value.
+        """
+        with self._lock:
+            self.value = value
+
+    def to_dict(self):
+        return self.value
+
+
+class Histogram:
+    """
+    A thread safe distribution of observed values over fixed buckets. Each bucket
+    counts the observations less than or equal to its upper bound that did not
+    fit a smaller bucket, observations above the last bound are counted as 'inf'.
+    Percentiles are estimated as the upper bound of the bucket they fall in, so
+    they are as precise as the buckets.
+
+    Args:
+        buckets (tuple): Sorted upper bounds of the buckets.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Add an observation to the distribution.
+
+        Args:
+            value (float): The observed value.
+        """
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[position] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """
+        Estimate a percentile of the observations.
+
+        Args:
+            percent (float): The percentile, between 0 and 100.
+
+        Returns:
+            float: The upper bound of the bucket holding the percentile, the largest
+            observation for the last bucket, or None if nothing was observed.
+        """
+        with self._lock:
+            return self._percentile(percent)
+
+    def _percentile(self, percent):
+        if self.count == 0:
+            return None
+        rank = max(1, math.ceil(percent / 100 * self.count))
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        with self._lock:
+            buckets = {str(bound): count for bound, count in zip(self.buckets, self.counts)}
+            buckets['inf'] = self.counts[-1]
+            return {'count': self.count, 'sum': self.sum, 'buckets': buckets,
+                    'p50': self._percentile(50), 'p90': self._percentile(90), 'p99': self._percentile(99)}
+
+
+class Metrics:
+    """
+    A registry of named metrics that can be exported as a dictionary.
+
+    Usage:
+        metrics = Metrics()
+        metrics.counter('elections_avoided').inc()
+        metrics.histogram('batch_size').observe(3)
+        metrics.to_dict()  # {'elections_avoided': 1, 'batch_size': {'count': 1, 'sum': 3, 'buckets': {...}}}
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name, metric_factory):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_factory()
+            return self._metrics[name]
+
+    def counter(self, name):
+        """
+        Get the counter registered with the given name, creating it if needed.
+
+        Args:
+            name (str): The name of the counter.
+
+        Returns:
+            Counter: The counter.
+        """
+        return self._get_or_create(name, Counter)
+
+    def gauge(self, name):
+        """
+        Get the gauge registered with the given name, creating it if needed.
+
+        Args:
+            name (str): The name of the gauge.
+
+        Returns:
+            Gauge: The gauge.
+        """
+        return self._get_or_create(name, Gauge)
+
+    def histogram(self, name, buckets=DEFAULT_BUCKETS):
+        """
+        Get the histogram registered with the given name, creating it if needed.
+
+        Args:
+            name (str): The name of the histogram.
+            buckets (tuple): Sorted upper bounds of the buckets, used only when the histogram is created.
+
+        Returns:
+            Histogram: The histogram.
+        """
+        return self._get_or_create(name, lambda: Histogram(buckets))
+
+    def to_dict(self):
+        """
+        Export the current value of all metrics.
+
+        Returns:
+            dict: The metric names mapped to their values.
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {name: metric.to_dict() for name, metric in metrics.items()}
@@ -0,0 +1,140 @@
+import threading
+
+from src.logger import MyLogger
+
+logger = MyLogger()
+
+
+class Applier:
+    """
+    Apply stage of a raft node. Committing an entry only marks it as committed,
+    a dedicated thread then applies the committed entries to the state machine
+    in log order, a batch per call, and persists the last_applied watermark of
+    the log after each batch. Replication and commit never wait for the state machine.
+
+    The queue of the stage is the committed part of the log after last_applied,
+    so submitting a new commit index never blocks and copies nothing. The queue
+    is bounded by max_pending entries: once it is full, is_full() tells the
+    leader to refuse new writes until the state machine catches up. A failed
+    batch is retried with exponential backoff, the entries after it wait, so
+    the state machine sees every entry at least once and in order.
+
+    Compacting the log or restoring a snapshot of the state machine must hold
+    the lock of the applier, so that no batch is applied meanwhile.
+
+    Usage:
+        applier = Applier(log, log.apply_to_state_machine, on_applied, max_batch_size=256,
+                          max_pending=10000, retry_interval=0.05, max_retry_interval=2.0)
+        applier.start()
+        applier.submit(commit_index)
+
+    Args:
+        log (Log): the log holding the committed entries and the last_applied watermark
+        apply_function: called with a batch of consecutive entries, returns the highest index
+            the state machine applied and raises if it failed
+        on_applied: called with the first and last index of every applied batch
+        max_batch_size (int): maximum number of entries sent to the state machine in one call
+        max_pending (int): number of committed entries not yet applied above which the queue is full
+        retry_interval (float): delay in seconds before the first retry of a failed apply
+        max_retry_interval (float): maximum delay in seconds between two retries
+        metrics (Metrics): optional registry to record the queue length and the retries in
+    """
+
+    def __init__(self, log, apply_function, on_applied, max_batch_size, max_pending, retry_interval,
+                 max_retry_interval, metrics=None):
+        self.log = log
+        self.apply_function = apply_function
+        self.on_applied = on_applied
+        self.max_batch_size = max_batch_size
+        self.max_pending = max_pending
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.metrics = metrics
+        self.commit_index = log.last_applied
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.is_running = False
+        self.thread = None
+
+    def start(self):
+        self.is_running = True
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.is_running = False
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def submit(self, commit_index):
+        """
+        Queue the committed entries up to commit_index. Never blocks.
+
+        :param commit_index: the new commit index
+        """
+        self.commit_index = max(self.commit_index, commit_index)
+        self.record_pending()
+        self.wake_event.set()
+
+    def pending(self):
+        """
+        :return: the number of committed entries that are not applied yet
+        """
+        return max(0, self.commit_index - self.log.last_applied)
+
+    def is_full(self):
+        return self.pending() >= self.max_pending
+
+    def record_pending(self):
+        if self.metrics is not None:
+            self.metrics.gauge('apply_queue_length').set(self.pending())
+
+    def run(self):
+        while self.is_running:
+            self.wake_event.wait()
+            self.wake_event.clear()
+            delay = self.retry_interval
+            while self.is_running and not self.apply_committed():
+                self.stop_event.wait(delay)
+                delay = min(self.max_retry_interval, delay * 2)
+
+    def apply_committed(self):
+        """
+        Apply the queued entries, one batch at a time.
+
+        :return: True if the queue is empty, False if the state machine failed and the rest has to be retried
+        """
+        while self.log.last_applied < self.commit_index:
+            failed = False
+            with self.lock:
+                first_index = self.log.last_applied + 1
+                count = min(self.max_batch_size, self.commit_index - self.log.last_applied)
+                entries = self.log.get_entries(first_index, count, float('inf'))
+                if not entries:
+                    return True
+                try:
+                    applied_index = self.apply_function(entries)
+                except Exception as e:
+                    logger.error(f"Failed to apply entries {first_index} to {entries[-1].index} "
+                                 f"to the state machine: {e}")
+                    applied_index = None
+                if applied_index is None or applied_index < entries[-1].index:
+                    failed = True
+                for entry in entries:
+                    if applied_index is None or entry.index > applied_index:
+                        break
+                    self.log.last_applied = entry.index
+                    self.log.applied_bytes_since_snapshot += len(entry.command)
+                last_index = self.log.last_applied
+                if last_index >= first_index:
+                    self.log.save_last_applied()
+            if last_index >= first_index:
+                self.on_applied(first_index, last_index)
+            self.record_pending()
+            if failed:
+                if self.metrics is not None:
+                    self.metrics.counter('apply_retries').inc()
+                return False
+        return True
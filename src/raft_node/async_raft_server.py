@@ -0,0 +1,776 @@
+import asyncio
+import contextlib
+import json
+import random
+import time
+
+from src.configuration_reader import IniConfig
+from src.logger import MyLogger
+from src.metrics import Metrics
+from src.raft_node.applier import Applier
+from src.raft_node.log import Log
+from src.raft_node.match_index import MatchIndex
+from src.raft_node.membership import Membership
+from src.raft_node.progress import Progress
+from src.raft_node.raft_server import RaftServer, RaftState
+from src.raft_node.staleness import StalenessTracker
+from src.raft_node.timer_wheel import TimerWheel
+from src.rpc.async_rpc import AsyncRPCClient, AsyncRPCServer
+
+logger = MyLogger()
+raft_config = IniConfig('src/configurations/config.ini')
+
+
+class AsyncRaftServer:
+    """
+    A raft node that runs on an asyncio event loop instead of threads.
+
+    The event loop owns all the state of the node: RPC handlers, timers and
+    replication run as callbacks and tasks of the loop, so nothing is mutated
+    concurrently and no locks are needed. Election and heartbeat deadlines are
+    timers on a TimerWheel, which can be shared by all the nodes of a process,
+    so hundreds of nodes need one task for their timers and no threads.
+    The calls to the state machine that can block, and waiting for the applier
+    to pause, run in the default executor of the loop, so a slow KV server
+    does not hold up the timers and the RPCs of the node.
+
+    The receiving side of the RPCs is the one of RaftServer, the RPC names and
+    arguments are the same, so threaded and asyncio nodes can be mixed in one
+    cluster. The log is still accessed synchronously from the loop.
+
+    The methods shared with RaftServer lock with self.lock, which is a no-op
+    here. They stay safe only as long as each of them runs on the loop from
+    start to end, without an await or a wait on another thread in the middle.
+    A handler that has to await, like handle_install_snapshot waiting for the
+    applier, must split the shared code around the await and check again the
+    state it read before it. The callbacks of the log writer and the applier
+    come from their threads and are moved to the loop with call_soon_threadsafe.
+
+    Usage:
+        server = AsyncRaftServer(server_id, raft_servers, database_uri, database_name, collection_name)
+        await server.start()
+        index, term = await server.append_entries_to_leader({'commands': [...], 'rep_ids': [...]})
+    """
+
+    # Shared with RaftServer, they only read and update the state of the node
+    current_term = RaftServer.current_term
+    voted_for = RaftServer.voted_for
+    append_entries_rpc = RaftServer.append_entries_rpc
+    request_vote_rpc = RaftServer.request_vote_rpc
+    pre_vote_rpc = RaftServer.pre_vote_rpc
+    receive_snapshot_chunk = RaftServer.receive_snapshot_chunk
+    install_received_snapshot = RaftServer.install_received_snapshot
+    restore_state_machine = RaftServer.restore_state_machine
+    snapshot_installed = RaftServer.snapshot_installed
+    conflict_next_index = RaftServer.conflict_next_index
+    calculate_committed_index = RaftServer.calculate_committed_index
+    quorum_contact_time = RaftServer.quorum_contact_time
+    check_quorum = RaftServer.check_quorum
+    has_lease = RaftServer.has_lease
+    snapshot_due = RaftServer.snapshot_due
+    record_appended = RaftServer.record_appended
+    record_committed = RaftServer.record_committed
+    record_applied = RaftServer.record_applied
+    record_stored = RaftServer.record_stored
+    record_applied_batch = RaftServer.record_applied_batch
+    write_status = RaftServer.write_status
+    read_staleness = RaftServer.read_staleness
+    voters = RaftServer.voters
+    record_match = RaftServer.record_match
+    promote_learner = RaftServer.promote_learner
+    load_memberships = RaftServer.load_memberships
+    membership_at = RaftServer.membership_at
+    track_membership = RaftServer.track_membership
+    truncate_membership = RaftServer.truncate_membership
+    compact_memberships = RaftServer.compact_memberships
+    apply_membership = RaftServer.apply_membership
+    change_membership = RaftServer.change_membership
+    add_node = RaftServer.add_node
+    update_node = RaftServer.update_node
+    delete_node = RaftServer.delete_node
+    step_down_if_removed = RaftServer.step_down_if_removed
+
+    def __init__(self, server_id, raft_servers, database_uri, database_name, collection_name, timer_wheel=None):
+        self.server_id = server_id
+        self.raft_servers = raft_servers
+        self.hostname = raft_servers[server_id]['host']
+        self.port = raft_servers[server_id]['port']
+        self.leader_id = None
+        self.state = RaftState.FOLLOWER
+        self.min_val_for_timeout = float(raft_config.get_property('raft', 'min_val_for_timeout'))
+        self.max_val_for_timeout = float(raft_config.get_property('raft', 'max_val_for_timeout'))
+        self.heartbeat_interval = float(raft_config.get_property('raft', 'heartbeat_interval'))
+        self.rpc_timeout = float(raft_config.get_property('raft', 'rpc_timeout'))
+        self.pre_vote = raft_config.get_property('raft', 'pre_vote').lower() == 'true'
+        self.read_mode = raft_config.get_property('raft', 'read_mode')
+        self.wait_for_index_timeout = float(raft_config.get_property('raft', 'wait_for_index_timeout'))
+        self.max_entries_per_message = int(raft_config.get_property('raft', 'max_entries_per_message'))
+        self.max_bytes_per_message = int(raft_config.get_property('raft', 'max_bytes_per_message'))
+        self.catch_up_threshold = int(raft_config.get_property('raft', 'catch_up_threshold'))
+        self.learner_promotion_lag = int(raft_config.get_property('raft', 'learner_promotion_lag'))
+        self.snapshot_threshold_entries = int(raft_config.get_property('raft', 'snapshot_threshold_entries'))
+        self.snapshot_threshold_bytes = int(raft_config.get_property('raft', 'snapshot_threshold_bytes'))
+        self.log = Log(database_uri, database_name, collection_name, self.server_id)
+        self.memberships = self.load_memberships(Membership(raft_servers))
+        self.membership = self.memberships[-1]
+        self.raft_servers = self.membership.servers
+        self.learners = set(self.membership.learners)
+        self.commit_index = self.log.get_last_commit_index()
+        self.metrics = Metrics()
+        self.log.compressor.metrics = self.metrics
+        # applies the committed entries to the state machine on its own thread, off the event loop
+        self.applier = Applier(self.log, self.log.apply_to_state_machine, self.entries_applied,
+                               int(raft_config.get_property('raft', 'apply_batch_size')),
+                               int(raft_config.get_property('raft', 'apply_queue_size')),
+                               float(raft_config.get_property('raft', 'apply_retry_interval')),
+                               float(raft_config.get_property('raft', 'apply_max_retry_interval')),
+                               self.metrics)
+        self.applier.submit(self.commit_index)
+        self.loop = None
+
+        if timer_wheel is None:
+            timer_wheel = TimerWheel(float(raft_config.get_property('raft', 'timer_tick')),
+                                     int(raft_config.get_property('raft', 'timer_slots')))
+        self.timer_wheel = timer_wheel
+        self.election_timer = None
+        self.heartbeat_timers = {}
+        self.housekeeping_timer = None
+
+        self.rpc_server = None
+        self.clients = {}
+        self.progress = {}
+        self.match_index = MatchIndex([])
+        self.append_times = {}
+        self.last_ack = {}
+        self.last_leader_contact = 0
+        self.staleness = StalenessTracker()
+        self.incoming_snapshot = []
+        # followers with a replication task running, and those to which new data arrived meanwhile
+        self.sending = set()
+        self.pending = set()
+        self.apply_waiters = []
+        self.ack_waiters = []
+        self.ack_event = asyncio.Event()
+        self.transfer_target = None
+        self.tasks = set()
+        self.election_in_progress = False
+        self.snapshot_in_progress = False
+        self.is_running = False
+        # the methods shared with RaftServer run on the loop, see the class docstring
+        self.lock = contextlib.nullcontext()
+
+    def __str__(self):
+        return f"AsyncServer(id={self.server_id}, state={self.state.name}, " \
+               f"term={self.current_term}, votedFor={self.voted_for})"
+
+    async def start(self):
+        logger.info(f"Starting async RaftNode with ID: {self.server_id}")
+        if self.rpc_server is None:
+            self.rpc_server = AsyncRPCServer(host=self.hostname, port=self.port)
+            self.rpc_server.register_function(self.handle_append_entries, 'append_entries')
+            self.rpc_server.register_function(self.handle_request_vote, 'request_vote')
+            self.rpc_server.register_function(self.pre_vote_rpc, 'pre_vote')
+            self.rpc_server.register_function(self.read_index_rpc, 'read_index')
+            self.rpc_server.register_function(self.handle_install_snapshot, 'install_snapshot')
+            self.rpc_server.register_function(self.timeout_now_rpc, 'timeout_now')
+            self.rpc_server.register_function(self.wait_for_index, 'wait_for_index')
+            await self.rpc_server.start()
+        if not self.clients:
+            self.clients = {_server_id: AsyncRPCClient(host=server['host'], port=server['port'],
+                                                       timeout=self.rpc_timeout)
+                            for _server_id, server in self.raft_servers.items() if _server_id != self.server_id}
+        self.is_running = True
+        self.loop = asyncio.get_running_loop()
+        self.applier.start()
+        self.transition_to_follower()
+        self.schedule_housekeeping()
+
+    async def stop(self):
+        logger.info(f"Stopping async RaftNode with ID: {self.server_id}")
+        self.is_running = False
+        self.applier.stop()
+        self.cancel_timers()
+        for task in list(self.tasks):
+            task.cancel()
+        if self.rpc_server is not None:
+            await self.rpc_server.stop()
+            self.rpc_server = None
+        for client in self.clients.values():
+            await client.close()
+
+    def connect_peer(self, server_id, info):
+        previous = self.clients.get(server_id)
+        if previous is not None:
+            self.spawn(previous.close())
+        self.clients[server_id] = AsyncRPCClient(host=info['host'], port=info['port'], timeout=self.rpc_timeout)
+        if self.state == RaftState.LEADER and server_id not in self.progress:
+            self.progress[server_id] = Progress(self.log.get_last_index() + 1, 1)
+            self.last_ack[server_id] = time.time()
+            self.replicate_to(server_id)
+
+    def disconnect_peer(self, server_id):
+        client = self.clients.pop(server_id, None)
+        if client is not None:
+            self.spawn(client.close())
+        self.progress.pop(server_id, None)
+        timer = self.heartbeat_timers.pop(server_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def cancel_timers(self):
+        for timer in [self.election_timer, self.housekeeping_timer, *self.heartbeat_timers.values()]:
+            if timer is not None:
+                timer.cancel()
+        self.election_timer = None
+        self.housekeeping_timer = None
+        self.heartbeat_timers = {}
+
+    def reset_election_timeout(self):
+        if self.election_timer is not None:
+            self.election_timer.cancel()
+            self.election_timer = None
+        if self.is_running and self.state != RaftState.LEADER:
+            timeout = random.uniform(self.min_val_for_timeout, self.max_val_for_timeout)
+            self.election_timer = self.timer_wheel.schedule(timeout, self.on_election_timeout)
+
+    def on_election_timeout(self):
+        self.election_timer = None
+        if self.state != RaftState.LEADER and self.server_id in self.voters():
+            self.spawn(self.run_election())
+
+    def schedule_housekeeping(self):
+        self.housekeeping_timer = self.timer_wheel.schedule(self.heartbeat_interval, self.housekeeping)
+
+    def housekeeping(self):
+        """
+        Periodic work that is not tied to a follower: compaction, and CheckQuorum on the leader.
+        """
+        self.housekeeping_timer = None
+        if not self.is_running:
+            return
+        if not self.snapshot_in_progress and self.snapshot_due():
+            self.snapshot_in_progress = True
+            self.spawn(self.take_snapshot())
+        if self.state == RaftState.LEADER and not self.check_quorum():
+            logger.info(f"Leader has not heard from a majority within the election timeout. Stepping down.")
+            self.transition_to_follower()
+        self.schedule_housekeeping()
+
+    @contextlib.asynccontextmanager
+    async def applier_paused(self):
+        """
+        Hold the lock of the applier, waiting for it off the event loop while a batch is applied.
+        """
+        await self.loop.run_in_executor(None, self.applier.lock.acquire)
+        try:
+            yield
+        finally:
+            self.applier.lock.release()
+
+    async def take_snapshot(self):
+        """
+        Snapshot the state machine and compact the log, see RaftServer.take_snapshot_if_needed.
+        """
+        try:
+            async with self.applier_paused():
+                last_included_index = self.log.last_applied
+                last_included_term = self.log.get_term(last_included_index)
+                if last_included_index <= self.log.snapshot_index:
+                    return
+                data = await self.loop.run_in_executor(None, self.log.create_state_machine_snapshot)
+                if data is None or last_included_term is None:
+                    logger.error(f"Could not get a snapshot of the state machine at index {last_included_index}")
+                    return
+                # a snapshot installed meanwhile covers this one
+                if last_included_index <= self.log.snapshot_index:
+                    return
+                self.log.compact(last_included_index, last_included_term, data,
+                                 self.membership_at(last_included_index).to_dict())
+                self.compact_memberships(last_included_index)
+        except Exception as e:
+            logger.error(f"Failed to snapshot the state machine: {e}")
+        finally:
+            self.snapshot_in_progress = False
+
+    def transition_to_follower(self, verbose=True):
+        if verbose:
+            logger.info(f"Transitioning to follower state. Server state: {self}")
+        self.state = RaftState.FOLLOWER
+        self.append_times = {}
+        for timer in self.heartbeat_timers.values():
+            timer.cancel()
+        self.heartbeat_timers = {}
+        self.reset_election_timeout()
+
+    def transition_to_leader(self, verbose=True):
+        if verbose:
+            logger.info(f"Transitioning to leader state. Server state: {self}")
+        self.state = RaftState.LEADER
+        self.leader_id = self.server_id
+        self.reset_election_timeout()
+        self.commit_index = self.log.get_last_commit_index()
+        peers = [_server_id for _server_id in self.raft_servers.keys() if _server_id != self.server_id]
+        # one request at a time per follower, the next batch is built when the answer arrives
+        self.progress = {_server_id: Progress(self.log.get_last_index() + 1, 1) for _server_id in peers}
+        self.match_index = MatchIndex(self.voters(), self.commit_index)
+        self.append_times = {}
+        self.last_ack = {_server_id: time.time() for _server_id in peers}
+        # Commit a no-op entry of the new term, so that reads can be served once it is committed
+        self.record_appended([self.log.append_entry(self.current_term, json.dumps({'commands': [], 'rep_ids': []}))])
+        self.commit_leader_entries()
+        self.replicate()
+
+    async def run_election(self, skip_pre_vote=False):
+        if self.election_in_progress or not self.is_running:
+            return
+        self.election_in_progress = True
+        try:
+            # start over if no leader is found within the next timeout
+            self.reset_election_timeout()
+            if self.pre_vote and not skip_pre_vote:
+                logger.info(f"Starting pre-vote for RaftNode {self}")
+                pre_vote_started = time.time()
+                won = await self.collect_votes('pre_vote', self.current_term + 1)
+                if not won or self.last_leader_contact >= pre_vote_started or self.state != RaftState.FOLLOWER:
+                    logger.info(f"Pre-vote failed, staying follower. Server state: {self}")
+                    self.metrics.counter('elections_avoided').inc()
+                    return
+            self.state = RaftState.CANDIDATE
+            self.log.save_hard_state(self.current_term + 1, self.server_id)
+            election_term = self.current_term
+            logger.info(f"Starting election for RaftNode {self}")
+            won = await self.collect_votes('request_vote', election_term)
+            if self.state != RaftState.CANDIDATE or self.current_term != election_term:
+                # A leader was discovered or a newer term started while the votes were in flight
+                return
+            if won:
+                self.transition_to_leader()
+            else:
+                self.transition_to_follower()
+        finally:
+            self.election_in_progress = False
+
+    async def collect_votes(self, method, term):
+        """
+        Send a vote request to all other nodes concurrently and count the replies
+        as they arrive, see RaftServer.collect_votes.
+
+        :param method: name of the remote vote method to call
+        :param term: the term the vote is requested for
+        :return: True if a majority of the cluster granted the vote, False otherwise
+        """
+        voters = self.voters()
+        peers = [_server_id for _server_id in voters if _server_id != self.server_id]
+        majority = len(voters) // 2 + 1
+        votes_received = 1
+        votes_pending = len(peers)
+        if votes_received >= majority:
+            return True
+
+        last_log_index = self.log.get_last_index()
+        last_log_term = self.log.get_last_term()
+        tasks = [asyncio.ensure_future(self.clients[_server_id].call(method, self.server_id, term,
+                                                                     last_log_index, last_log_term))
+                 for _server_id in peers]
+        try:
+            for next_response in asyncio.as_completed(tasks, timeout=self.max_val_for_timeout):
+                response = await next_response
+                votes_pending -= 1
+                if response is None:
+                    pass
+                elif response['term'] > term:
+                    logger.info(f"RaftNode {self.server_id} discovered higher term. Transitioning to follower")
+                    self.current_term = response['term']
+                    self.transition_to_follower()
+                    return False
+                elif response['vote_granted']:
+                    votes_received += 1
+                    if votes_received >= majority:
+                        return True
+                if votes_received + votes_pending < majority:
+                    return False
+        except asyncio.TimeoutError:
+            logger.info(f"Vote requests of RaftNode {self.server_id} timed out "
+                        f"with {votes_received} of {majority} votes")
+        finally:
+            for task in tasks:
+                task.cancel()
+        return False
+
+    def replicate(self):
+        """
+        Make sure every follower is sent what it is missing, see replicate_to.
+        """
+        for _server_id in self.progress.keys():
+            self.replicate_to(_server_id)
+
+    def replicate_to(self, _server_id):
+        """
+        Start a replication task for a follower. If one is already running, it is
+        told to go on once its current request is answered, so requests to a
+        follower are coalesced and never overlap.
+
+        :param _server_id: id of the follower
+        """
+        if not self.is_running or self.state != RaftState.LEADER:
+            return
+        if _server_id in self.sending:
+            self.pending.add(_server_id)
+            return
+        timer = self.heartbeat_timers.pop(_server_id, None)
+        if timer is not None:
+            timer.cancel()
+        self.sending.add(_server_id)
+        self.spawn(self.replication_task(_server_id))
+
+    async def replication_task(self, _server_id):
+        try:
+            while self.is_running and self.state == RaftState.LEADER:
+                self.pending.discard(_server_id)
+                answered = await self.send_append_entries(_server_id)
+                progress = self.progress.get(_server_id)
+                if not answered or progress is None:
+                    break
+                if _server_id not in self.pending and progress.match_index >= self.log.get_last_index():
+                    break
+        except Exception as e:
+            logger.error(f"Replication to node {_server_id} failed: {e}")
+        finally:
+            self.sending.discard(_server_id)
+            if self.is_running and self.state == RaftState.LEADER and _server_id in self.progress:
+                # the next request to the follower is a heartbeat unless new entries come first
+                self.heartbeat_timers[_server_id] = self.timer_wheel.schedule(self.heartbeat_interval,
+                                                                              self.replicate_to, _server_id)
+
+    async def send_append_entries(self, _server_id):
+        """
+        Send the next batch to a follower, or the snapshot if the entries it needs
+        have been compacted, and update its progress with the answer.
+
+        :param _server_id: id of the follower
+        :return: True if the follower answered at the current term
+        """
+        progress = self.progress[_server_id]
+        if progress.next_index <= self.log.snapshot_index:
+            return await self.send_snapshot(_server_id)
+        term = self.current_term
+        prev_log_index = progress.next_index - 1
+        prev_log_term = self.log.get_term(prev_log_index)
+        entries = self.log.get_entries(progress.next_index, self.max_entries_per_message,
+                                       self.max_bytes_per_message)
+        epoch = progress.sent(len(entries))
+        payload = self.log.compressor.pack_entries(entries)
+        if payload is entries:
+            payload = [entry.to_dict() for entry in entries]
+        sent_at = time.time()
+        response = await self.clients[_server_id].call('append_entries', term, self.server_id, prev_log_index,
+                                                       prev_log_term, payload, self.commit_index)
+        if not self.handle_leader_response(_server_id, term, response, sent_at):
+            progress.unreachable(epoch)
+            return False
+        if response['success']:
+            last_index = prev_log_index + len(entries)
+            progress.acked(epoch, last_index, self.log.get_last_index(), self.catch_up_threshold)
+            self.record_match(_server_id, last_index)
+            self.commit_leader_entries()
+        else:
+            progress.rejected(epoch, self.conflict_next_index(response))
+        return True
+
+    async def send_snapshot(self, _server_id):
+        progress = self.progress[_server_id]
+        epoch = progress.become_snapshot()
+        term = self.current_term
+        last_included_index = self.log.snapshot_index
+        last_included_term = self.log.snapshot_term
+        data = self.log.compressor.pack_snapshot(self.log.load_snapshot())
+        membership = self.membership_at(last_included_index).to_dict()
+        logger.info(f"Sending snapshot up to index {last_included_index} to node {_server_id}")
+        chunk_size = self.log.snapshot_chunk_size
+        offset = 0
+        sent_at = time.time()
+        while True:
+            done = offset + chunk_size >= len(data)
+            response = await self.clients[_server_id].call('install_snapshot', term, self.server_id,
+                                                           last_included_index, last_included_term, offset,
+                                                           self.log.compressor.snapshot_chunk(data, offset,
+                                                                                              chunk_size),
+                                                           done, membership)
+            if response is None or not response['success'] or done:
+                break
+            offset += chunk_size
+        if not self.handle_leader_response(_server_id, term, response, sent_at) or not response['success']:
+            progress.unreachable(epoch)
+            return False
+        progress.acked(epoch, last_included_index, self.log.get_last_index(), self.catch_up_threshold)
+        self.record_match(_server_id, last_included_index)
+        return True
+
+    def handle_leader_response(self, _server_id, term, response, sent_at):
+        """
+        Check the answer of a follower to a request of the leader.
+
+        :return: True if the answer is valid for the term the request was sent in
+        """
+        if response is None:
+            logger.info(f"Node {_server_id} is unreachable")
+            return False
+        if response['term'] > self.current_term:
+            logger.info(f"Node {_server_id} has higher term")
+            self.current_term = response['term']
+            self.transition_to_follower()
+            return False
+        if self.state != RaftState.LEADER or self.current_term != term:
+            return False
+        # Any answer at our term acknowledges this node as the leader
+        self.last_ack[_server_id] = max(self.last_ack.get(_server_id, 0), sent_at)
+        self.notify_ack()
+        return True
+
+    def commit_leader_entries(self):
+        new_commit_index = self.calculate_committed_index()
+        if new_commit_index <= self.commit_index:
+            return
+        self.record_committed(self.commit_index, new_commit_index)
+        self.log.commit_entries(self.commit_index, new_commit_index)
+        self.commit_index = new_commit_index
+        self.applier.submit(new_commit_index)
+        self.step_down_if_removed()
+        # let the followers know about the new commit index without waiting for the next heartbeat
+        self.replicate()
+
+    async def append_entries_to_leader(self, _append_entries):
+        """
+        Append a client request to the log of the leader and replicate it.
+
+        :param _append_entries: the request
+        :return: the log index and the term assigned to the entry, or False if this node is not the leader
+        """
+        if self.state != RaftState.LEADER or self.transfer_target is not None:
+            return False
+        if Membership.COMMAND_KEY in _append_entries:
+            return False
+        if self.applier.is_full():
+            self.metrics.counter('apply_backpressure').inc()
+            logger.info(f"Refusing the write, {self.applier.pending()} committed entries are not applied yet")
+            return False
+        # stored in parallel with the replication, the leader counts itself toward the quorum once it is
+        term = self.current_term
+        index, = self.log.append_entries(term, [json.dumps(_append_entries)],
+                                         on_durable=lambda last_index: self.entries_stored(term, last_index))
+        self.record_appended([index], stored=False)
+        self.replicate()
+        return index, term
+
+    def entries_stored(self, term, index):
+        """
+        Called by the log writer on its thread, the write is recorded on the event loop.
+        """
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.record_stored, term, index)
+
+    def entries_applied(self, first_index, last_index):
+        """
+        Called by the applier on its thread, the batch is recorded on the event loop.
+        """
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.record_applied_batch, first_index, last_index)
+
+    def notify_applied(self):
+        waiting = []
+        for index, future in self.apply_waiters:
+            if future.done():
+                continue
+            if self.log.last_applied >= index:
+                future.set_result(True)
+            else:
+                waiting.append((index, future))
+        self.apply_waiters = waiting
+
+    async def wait_for_applied(self, index, timeout):
+        """
+        Wait until the entry with the given index has been applied to the state machine of this node.
+
+        :return: True if the entry was applied in time, False otherwise
+        """
+        if self.log.last_applied >= index:
+            return True
+        future = asyncio.get_running_loop().create_future()
+        self.apply_waiters.append((index, future))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def wait_for_index(self, index, term, timeout=None):
+        """
+        Wait until the write that was assigned the given index and term is committed and applied
+        to the state machine of this node, as RaftServer.wait_for_index.
+
+        :return: the status of the write, see RaftServer.write_status
+        """
+        if timeout is None:
+            timeout = self.wait_for_index_timeout
+        applied = await self.wait_for_applied(index, timeout)
+        return self.write_status(index, term, applied)
+
+    def notify_ack(self):
+        self.ack_event.set()
+        contact_time = self.quorum_contact_time()
+        waiting = []
+        for round_started, future in self.ack_waiters:
+            if future.done():
+                continue
+            if contact_time >= round_started:
+                future.set_result(True)
+            else:
+                waiting.append((round_started, future))
+        self.ack_waiters = waiting
+
+    async def transfer_leadership(self, target_id=None, timeout=None):
+        """
+        Hand the leadership over to another node, see RaftServer.transfer_leadership.
+
+        :return: the id of the target if it started an election, None otherwise
+        """
+        if self.state != RaftState.LEADER or not self.progress:
+            return None
+        if target_id is None:
+            target_id = max(self.progress.keys(), key=lambda _server_id: self.match_index.get(_server_id, -1))
+        if target_id not in self.progress or target_id in self.learners:
+            return None
+        if timeout is None:
+            timeout = self.max_val_for_timeout
+        logger.info(f"Transferring leadership from RaftNode {self.server_id} to RaftNode {target_id}")
+        self.transfer_target = target_id
+        try:
+            deadline = asyncio.get_running_loop().time() + timeout
+            while self.match_index.get(target_id) < self.log.get_last_index():
+                remaining = deadline - asyncio.get_running_loop().time()
+                if self.state != RaftState.LEADER or remaining <= 0:
+                    logger.info(f"RaftNode {target_id} could not be brought up to date, transfer aborted")
+                    return None
+                self.ack_event.clear()
+                self.replicate_to(target_id)
+                try:
+                    await asyncio.wait_for(self.ack_event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            response = await self.clients[target_id].call('timeout_now', self.current_term, self.server_id)
+            if response is None or not response['success']:
+                logger.info(f"RaftNode {target_id} refused timeout_now, transfer aborted")
+                return None
+            self.metrics.counter('leadership_transfers').inc()
+            self.transition_to_follower()
+            return target_id
+        finally:
+            self.transfer_target = None
+
+    def timeout_now_rpc(self, term, leader_id):
+        """
+        Invoked by the leader to hand its leadership over to this node, see RaftServer.timeout_now_rpc.
+        """
+        logger.info(f"RPC call received: timeout_now from RaftNode {leader_id} for RaftNode {self.server_id}")
+        response = {'term': self.current_term, 'success': False}
+        if term < self.current_term or self.state == RaftState.LEADER:
+            return response
+        response['success'] = True
+        self.spawn(self.run_election(skip_pre_vote=True))
+        return response
+
+    async def read_index(self):
+        """
+        Compute a read index on the leader, see RaftServer.read_index.
+
+        :return: the read index, or None if the leadership could not be confirmed
+        """
+        if self.state != RaftState.LEADER:
+            return None
+        if self.log.get_term(self.commit_index) != self.current_term:
+            return None
+        read_index = self.commit_index
+        if self.read_mode == 'lease' and self.has_lease():
+            return read_index
+        confirmed = asyncio.get_running_loop().create_future()
+        self.ack_waiters.append((time.time(), confirmed))
+        # a heartbeat now, or right after the request in flight, which was sent before the round started
+        self.replicate()
+        try:
+            await asyncio.wait_for(confirmed, self.max_val_for_timeout)
+        except asyncio.TimeoutError:
+            return None
+        return read_index if self.state == RaftState.LEADER else None
+
+    async def read_barrier(self, read_index=None, timeout=None):
+        """
+        Wait until a linearizable read can be served from the local state machine,
+        see RaftServer.read_barrier.
+
+        :return: the read index once it has been applied locally, or None on failure
+        """
+        if timeout is None:
+            timeout = self.max_val_for_timeout
+        if read_index is None:
+            if self.state == RaftState.LEADER:
+                read_index = await self.read_index()
+            elif self.leader_id is not None and self.leader_id in self.clients:
+                response = await self.clients[self.leader_id].call('read_index')
+                if response is not None and response['success']:
+                    read_index = response['read_index']
+        if read_index is None:
+            return None
+        if not await self.wait_for_applied(read_index, timeout):
+            return None
+        return read_index
+
+    async def read_index_rpc(self):
+        logger.info(f"RPC call received: read_index for RaftNode {self.server_id}")
+        read_index = await self.read_index()
+        return {'term': self.current_term, 'success': read_index is not None, 'read_index': read_index}
+
+    def handle_append_entries(self, term, leader_id, prev_log_index, prev_log_term, entries, leader_commit):
+        response = self.append_entries_rpc(term, leader_id, prev_log_index, prev_log_term, entries, leader_commit)
+        self.follow_leader(term)
+        return response
+
+    async def handle_install_snapshot(self, term, leader_id, last_included_index, last_included_term, offset, data,
+                                      done, membership=None):
+        """
+        install_snapshot as RaftServer.install_snapshot_rpc, the state machine is restored off the event loop.
+        """
+        response, snapshot = self.receive_snapshot_chunk(term, leader_id, last_included_index, offset, data, done)
+        self.follow_leader(term)
+        if snapshot is None:
+            return response
+        if membership is not None:
+            membership = Membership.from_dict(membership, last_included_index)
+        async with self.applier_paused():
+            # another install may have completed while the applier was finishing its batch
+            if last_included_index <= self.log.snapshot_index:
+                return response
+            if self.install_received_snapshot(last_included_index, last_included_term, snapshot, membership):
+                await self.loop.run_in_executor(None, self.restore_state_machine, snapshot,
+                                                self.membership_at(last_included_index).to_command())
+        self.snapshot_installed(last_included_index)
+        return response
+
+    def handle_request_vote(self, candidate_id, term, last_log_index, last_log_term):
+        previous_term = self.current_term
+        response = self.request_vote_rpc(candidate_id, term, last_log_index, last_log_term)
+        if self.current_term > previous_term and self.state != RaftState.FOLLOWER:
+            self.transition_to_follower()
+        return response
+
+    def follow_leader(self, term):
+        """
+        A candidate or a stale leader that hears from the leader of its term or
+        of a newer one becomes a follower.
+        """
+        if term >= self.current_term and self.state != RaftState.FOLLOWER:
+            self.transition_to_follower()
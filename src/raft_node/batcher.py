@@ -0,0 +1,85 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from src.logger import MyLogger
+
+logger = MyLogger()
+
+
+class WriteBatcher:
+    """
+    Merges concurrent client writes into batches. A batch is flushed when it
+    reaches max_batch_size commands or when linger seconds have passed since
+    its first command arrived, whatever happens first. Every batch is handed to
+    the flush function as a whole, which returns the log position assigned to
+    each command.
+
+    Usage:
+        batcher = WriteBatcher(flush_function, max_batch_size=256, linger=0.002)
+        index, term = batcher.submit(command).result()
+
+    Args:
+        flush_function: called with a list of commands, returns the list of their positions in the log
+        max_batch_size (int): maximum number of commands in a batch
+        linger (float): maximum time in seconds a command waits for the batch to fill
+        metrics (Metrics): optional registry to record the batch size distribution in
+    """
+
+    def __init__(self, flush_function, max_batch_size, linger, metrics=None):
+        self.flush_function = flush_function
+        self.max_batch_size = max_batch_size
+        self.linger = linger
+        self.metrics = metrics
+        self.pending = []
+        self.first_pending_at = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, command):
+        """
+        Add a command to the current batch.
+
+        :param command: the command to append to the log
+        :return: a Future that resolves to the log index of the command
+        """
+        future = Future()
+        with self.condition:
+            if not self.pending:
+                self.first_pending_at = time.monotonic()
+            self.pending.append((command, future))
+            self.condition.notify()
+        return future
+
+    def next_batch(self):
+        """
+        Wait until a batch is due and take it from the pending commands.
+        """
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            deadline = self.first_pending_at + self.linger
+            while len(self.pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = self.pending[:self.max_batch_size]
+            self.pending = self.pending[self.max_batch_size:]
+            self.first_pending_at = time.monotonic() if self.pending else None
+            return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if self.metrics is not None:
+                self.metrics.histogram('write_batch_size').observe(len(batch))
+            try:
+                indexes = self.flush_function([command for command, _ in batch])
+                for (_, future), index in zip(batch, indexes):
+                    future.set_result(index)
+            except Exception as e:
+                logger.error(f"Failed to flush a batch of {len(batch)} commands: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
@@ -74,8 +74,9 @@ class RaftCli:
     def process_user_input(self, user_input):
         # only allow login and exit commands if self.is_connected is False
         allowed_commands = ["login", "exit", "clear", "help"]
+        command, _, argument = user_input.strip().partition(' ')
         if not self.is_connected:
-            if user_input not in allowed_commands:
+            if command not in allowed_commands:
                 print("You must first login to the cluster. Type 'login' to continue.")
                 return
         switcher = {
@@ -88,13 +89,14 @@ class RaftCli:
             "get_state": lambda: get_cluster_state(self.api_helper),
             "start_cl": lambda: start_cl(self.api_helper),
             "stop_cl": lambda: stop_cl(self.api_helper),
+            "transfer_leader": lambda: transfer_leader(self.api_helper, argument.strip() or None),
             "edit_config": lambda: self.config_editor.edit_json_file(
                 raft_config.get_property('servers', 'raft_servers_path'), self.api_helper
             ),
             "": lambda: None
         }
 
-        func = switcher.get(user_input, lambda: print("Unknown command:", user_input))
+        func = switcher.get(command, lambda: print("Unknown command:", user_input))
         func()
 
     def run(self):
@@ -6,7 +6,8 @@ from prompt_toolkit.completion import WordCompleter
 
 from src.raft_node.api_helper import get_server_state
 
-basic_commands = WordCompleter(["start_cl", "stop_cl", "get_state", "edit_config", "login", "exit", "help", "clear"])
+basic_commands = WordCompleter(["start_cl", "stop_cl", "get_state", "transfer_leader", "edit_config", "login", "exit",
+                                "help", "clear"])
 
 
 def show_wellcome_screen():
@@ -59,6 +60,27 @@ def stop_cl(api_helper):
             print(f"Server {server_id} failed to stop.")
 
 
+def transfer_leader(api_helper, target_id=None):
+    """
+    Hands the leadership over to another node. The request is forwarded to the leader
+    by the node the cli is connected to.
+
+    Args:
+        api_helper (ApiHelper): The ApiHelper instance to send requests to raft nodes.
+        target_id (str): The id of the new leader, by default the most up-to-date follower.
+    """
+    payload = {} if target_id is None else {'target_id': target_id}
+    response = api_helper.make_api_post_request('transfer_leadership', payload)
+    if response is None:
+        print("Leadership transfer failed: could not connect to the API server.")
+        return
+    result = response.json()
+    if result['status'] == 'OK':
+        print(f"Leadership transferred to server {result['leader_id']}.")
+    else:
+        print(f"Leadership transfer failed: {result['message']}")
+
+
 def get_cluster_state(api_helper):
     """
     Gets the state of the cluster by sending a get_servers request to all raft nodes.
@@ -100,6 +122,7 @@ def show_help():
         'start-cl': 'Start the cluster',
         'stop-cl': 'Stop the cluster',
         'get_state': 'Get the state of the cluster',
+        'transfer_leader [id]': 'Hand the leadership over to a node, by default the most up-to-date follower',
         'edit_config': 'Edit the configuration file. Add, remove and update nodes.',
         'login': 'Login to the cluster',
         'exit': 'Exit the CLI',
@@ -4,11 +4,6 @@ from prompt_toolkit.shortcuts import PromptSession
 from prompt_toolkit.styles import Style
 from tabulate import tabulate
 
-from src.configuration_reader import JsonConfig
-from src.rpc import RPCClient
-
-servers = JsonConfig('src/configurations/servers.json')
-
 
 def save_json_file(file_path, data):
     with open(file_path, 'w') as file:
@@ -19,8 +14,6 @@ class NodeEditor:
 
     def __init__(self):
         print("Initializing Node Editor...")
-        self.kv_store_rpc_clients = {server_id: RPCClient(host=server['host'], port=server['kv_port'])
-                                     for server_id, server in servers.config.items()}
 
     def edit_json_file(self, file_path, api_helper):
         """
@@ -80,7 +73,6 @@ class NodeEditor:
                     'kv_port': new_kv_port
                 }
                 self.push_update(api_helper, payload, 'add_node')
-                self.kv_store_rpc_clients[node_id] = RPCClient(host=new_host, port=new_kv_port)
                 print(f"\nNode {node_id} has been added.")
                 save_json_file(file_path, data)
             elif user_input == '2':
@@ -117,7 +109,6 @@ class NodeEditor:
                 node_id = session.prompt('Enter the node ID to delete: ', style=style)
                 if node_id in data:
                     del data[node_id]
-                    del self.kv_store_rpc_clients[node_id]
                     self.push_update(api_helper, node_id, 'delete_node')
                     print(f"\nNode {node_id} has been deleted.")
                     save_json_file(file_path, data)
@@ -130,22 +121,13 @@ class NodeEditor:
 
     def push_update(self, api_helper, payload, action):
         """
-        Pushes an update to the raft servers and kv store servers
+        Pushes a membership change to the cluster. The connected node forwards it to
+        the leader, which appends it to the log, and every raft and kv store server
+        applies it from there.
 
         Args:
             api_helper (ApiHelper): ApiHelper object for making API calls
             payload (dict): Payload to send to the servers
             action (str): Action to perform on the servers (add_node, update_node, delete_node)
         """
-        response = api_helper.get_servers()
-
-        # Update raft server
-        for server_id, info in response['api_servers'].items():
-            api_helper.node_actions(info['host'], info['port'], payload, action)
-
-        # Update kv store servers
-        for key, rpc_client in self.kv_store_rpc_clients.items():
-            print(f"Sending {action} to server {key}")
-            _payload = {"command": action,
-                        "payload": payload}
-            rpc_client.call('update_raft_config', json.dumps(_payload))
+        api_helper.node_actions(api_helper.host, api_helper.port, payload, action)
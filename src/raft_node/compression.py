@@ -0,0 +1,136 @@
+import json
+import time
+import xmlrpc.client
+import zlib
+
+
+class Compressor:
+    """
+    Compresses the payloads of the log with zlib: the stored entries, the
+    batches of entries sent with append_entries and the snapshots sent with
+    install_snapshot. The commands are JSON and repeat their keys, so they
+    compress several times over. Payloads smaller than threshold bytes are left
+    as they are, compressing them would cost more CPU than it saves bytes, and
+    so are the payloads that do not shrink.
+
+    A disabled compressor compresses nothing but still reads compressed
+    payloads, so nodes with and without compression can be mixed in a cluster
+    and a log keeps being readable once compression is turned off.
+
+    The compressed payloads are sent as XML-RPC binaries, a plain list of
+    entries or snapshot string is sent as before.
+
+    Usage:
+        compressor = Compressor(enabled=True, threshold=512, level=1)
+        compressed = compressor.compress(payload)  # None if it is not worth compressing
+        payload = compressor.decompress(compressed)
+
+    Args:
+        enabled (bool): whether payloads are compressed
+        threshold (int): size in bytes from which a payload is compressed
+        level (int): the zlib compression level, from 1 (fastest) to 9 (smallest)
+        metrics (Metrics): optional registry to record the sizes before and after
+            compression, their ratio and the CPU time spent in
+    """
+
+    def __init__(self, enabled=False, threshold=512, level=1, metrics=None):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.level = level
+        self.metrics = metrics
+
+    def compress(self, data):
+        """
+        :param data: the payload, as bytes
+        :return: the compressed payload, or None if it is too small or does not shrink
+        """
+        if not self.enabled or len(data) < self.threshold:
+            return None
+        start = time.thread_time()
+        compressed = zlib.compress(data, self.level)
+        if self.metrics is not None:
+            self.metrics.counter('compression_seconds').inc(time.thread_time() - start)
+        if len(compressed) >= len(data):
+            return None
+        if self.metrics is not None:
+            input_bytes = self.metrics.counter('compression_input_bytes')
+            output_bytes = self.metrics.counter('compression_output_bytes')
+            input_bytes.inc(len(data))
+            output_bytes.inc(len(compressed))
+            self.metrics.gauge('compression_ratio').set(round(input_bytes.value / output_bytes.value, 2))
+        return compressed
+
+    def decompress(self, data):
+        start = time.thread_time()
+        payload = zlib.decompress(data)
+        if self.metrics is not None:
+            self.metrics.counter('decompression_seconds').inc(time.thread_time() - start)
+        return payload
+
+    def pack_entries(self, entries):
+        """
+        :param entries: the LogEntry objects of an append_entries request
+        :return: the entries, or a binary of the compressed batch
+        """
+        if not self.enabled or sum(len(entry.command) for entry in entries) < self.threshold:
+            return entries
+        data = json.dumps([[entry.index, entry.term, entry.command] for entry in entries],
+                          separators=(',', ':')).encode()
+        compressed = self.compress(data)
+        return entries if compressed is None else xmlrpc.client.Binary(compressed)
+
+    def unpack_entries(self, entries):
+        """
+        :param entries: the entries of an append_entries request, as sent by pack_entries
+        :return: the entries, as dicts
+        """
+        data = binary_data(entries)
+        if data is None:
+            return entries
+        return [{'index': index, 'term': term, 'command': command}
+                for index, term, command in json.loads(self.decompress(data))]
+
+    def pack_snapshot(self, data):
+        """
+        :param data: the serialized state machine
+        :return: the snapshot, or its compressed bytes
+        """
+        compressed = self.compress(data.encode())
+        return data if compressed is None else compressed
+
+    @staticmethod
+    def snapshot_chunk(data, offset, chunk_size):
+        """
+        :param data: the snapshot, as returned by pack_snapshot
+        :return: the chunk of the snapshot at offset, as sent with install_snapshot
+        """
+        chunk = data[offset:offset + chunk_size]
+        return xmlrpc.client.Binary(chunk) if isinstance(chunk, bytes) else chunk
+
+    def unpack_snapshot(self, chunks):
+        """
+        :param chunks: the chunks received with install_snapshot, see chunk_data
+        :return: the serialized state machine
+        """
+        if chunks and isinstance(chunks[0], bytes):
+            return self.decompress(b''.join(chunks)).decode()
+        return ''.join(chunks)
+
+
+def binary_data(value):
+    """
+    :return: the bytes of an XML-RPC binary, or None if the value is not one
+    """
+    if isinstance(value, xmlrpc.client.Binary):
+        return value.data
+    if isinstance(value, bytes):
+        return value
+    return None
+
+
+def chunk_data(chunk):
+    """
+    :return: a snapshot chunk received with install_snapshot, as bytes if it is compressed
+    """
+    data = binary_data(chunk)
+    return chunk if data is None else data
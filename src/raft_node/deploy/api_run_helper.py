@@ -6,6 +6,7 @@ from starlette.responses import RedirectResponse
 
 from src.configuration_reader import JsonConfig, IniConfig
 from src.raft_node.api_helper import api_post_request
+from src.raft_node.multi_raft import MultiRaft
 from src.raft_node.raft_server import RaftServer, RaftState
 from fastapi import FastAPI, Depends, HTTPException, status, Request
 
@@ -20,7 +21,8 @@ def split_dictionary(original_dict):
         new_key = int(key)
         host = value['host']
 
-        raft_dict = {'host': host, 'port': value['raft_port']}
+        raft_dict = {'host': host, 'port': value['raft_port'], 'api_port': value['api_port'],
+                     'kv_port': value['kv_port']}
         result_dict_raft[new_key] = raft_dict
 
         api_dict = {'host': host, 'port': value['api_port']}
@@ -58,7 +60,10 @@ class RaftServerApp:
     def __init__(self, raft_server_id, uvicorn_host, uvicorn_port, database_uri, database_name, collection_name,
                  ssl_cert_file, ssl_key_file):
         self.kv_server = None
-        self.server = None
+        # the raft groups hosted by the node, a MultiRaft hosts them if there are several
+        self.groups = []
+        self.multi_raft = None
+        self.number_of_groups = int(raft_config.get_property('raft', 'raft_groups'))
         self.raft_server_id = raft_server_id
         self.uvicorn_host = uvicorn_host
         self.uvicorn_port = uvicorn_port
@@ -66,11 +71,96 @@ class RaftServerApp:
         self.database_name = database_name
         self.collection_name = collection_name
         self.raft_config = JsonConfig('src/configurations/servers.json')
-        self.servers, self.api_servers = split_dictionary(self.raft_config.config)
+        self.servers, _ = split_dictionary(self.raft_config.config)
         self.server_executor = concurrent.futures.ThreadPoolExecutor()
         self.ssl_cert_file = ssl_cert_file
         self.ssl_key_file = ssl_key_file
 
+    @property
+    def api_servers(self):
+        """
+        The API servers of the members, from the configuration the raft node uses.
+        """
+        return {server_id: {'host': info['host'], 'port': info['api_port']}
+                for server_id, info in self.groups[0].raft_servers.items() if 'api_port' in info}
+
+    def group(self, group_id):
+        """
+        Args:
+            group_id (int): The id of a raft group of the node.
+
+        Returns:
+            RaftServer: The raft node of the group.
+
+        Raises:
+            HTTPException with status code 404 if the node does not host the group.
+        """
+        if not 0 <= group_id < len(self.groups):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown raft group {group_id}")
+        return self.groups[group_id]
+
+    def leader_url(self, server, endpoint):
+        """
+        Args:
+            server (RaftServer): The raft node of a group.
+            endpoint (str): An endpoint of the API, with its query string if any.
+
+        Returns:
+            str: The URL of the endpoint on the leader of the group, for the same group.
+        """
+        separator = '&' if '?' in endpoint else '?'
+        return f"https://127.0.0.1:{self.api_servers[server.leader_id]['port']}/{endpoint}" \
+               f"{separator}group={server.group_id or 0}"
+
+    @staticmethod
+    def staleness_json(entries, seconds):
+        """
+        Args:
+            entries: The number of committed entries the node has not applied.
+            seconds: The seconds since the state of the node was known to be up to date.
+
+        Returns:
+            dict: The staleness, None for an unknown bound since JSON has no infinity.
+        """
+        return {"entries": None if entries == float('inf') else entries,
+                "seconds": None if seconds == float('inf') else seconds}
+
+    def change_membership(self, endpoint, payload, change, group_id=None):
+        """
+        Run a membership change on the leader, which appends it to the log. A
+        follower forwards the request to the leader. Every group of the node
+        is changed unless a group is given.
+
+        Args:
+            endpoint (str): The endpoint of the request, to forward it.
+            payload (dict): The payload of the request.
+            change: Makes the change on the leader of a group, called with its
+                RaftServer, and returns the index of the configuration entry.
+            group_id (int): The group to change, None for all of them.
+
+        Returns:
+            dict: The status of the change, and the one of every group if there are several.
+        """
+        if group_id is not None:
+            return self.change_group_membership(self.group(group_id), endpoint, payload, change)
+        results = [self.change_group_membership(server, endpoint, payload, change) for server in self.groups]
+        if len(results) == 1:
+            return results[0]
+        return {"status": "OK" if all(result.get("status") == "OK" for result in results) else "ERROR",
+                "groups": results}
+
+    def change_group_membership(self, server, endpoint, payload, change):
+        if server.state != RaftState.LEADER:
+            if server.leader_id is None or server.leader_id not in self.api_servers:
+                return {"status": "ERROR", "message": "There is no leader to change the membership"}
+            response = api_post_request(self.leader_url(server, endpoint), payload)
+            return response.json()
+        try:
+            index = change(server)
+        except RuntimeError as e:
+            return {"status": "ERROR", "message": str(e)}
+        return {"status": "OK", "index": index}
+
     def create_app(self):
         app = FastAPI()
 
@@ -84,96 +174,150 @@ class RaftServerApp:
             return await call_next(request)
 
         @app.post("/append_entries")
-        def append_entries(_append_entries: dict, _: str = Depends(get_current_username)):
-            if self.server.server_id != self.server.leader_id:
-                api_post_request(f"https://127.0.0.1:{self.api_servers[self.server.leader_id]['port']}/append_entries",
-                                 _append_entries)
-                return {"message": f"Forwarded to leader server {self.server.leader_id}"}
+        def append_entries(_append_entries: dict, group: int = 0, _: str = Depends(get_current_username)):
+            server = self.group(group)
+            if server.server_id != server.leader_id:
+                # the answer of the leader holds the index and term of the entry
+                response = api_post_request(self.leader_url(server, 'append_entries'), _append_entries)
+                return response.json()
             else:
                 # commands = _append_entries.get("commands", [])
-                self.server.append_entries_to_leader(_append_entries)
-                return {"message": "Log entries appended"}
+                position = server.append_entries_to_leader(_append_entries)
+                if position is False:
+                    return {"message": "Log entries not appended, the server is not the leader"}
+                index, term = position
+                return {"message": "Log entries appended", "index": index, "term": term, "group": group}
+
+        @app.get("/wait_for_index")
+        def wait_for_index(index: int, term: int, timeout: float | None = None, group: int = 0,
+                           _: str = Depends(get_current_username)):
+            server = self.group(group)
+            write_status = server.wait_for_index(index, term, timeout)
+            return {"status": "OK" if write_status == 'APPLIED' else "ERROR",
+                    "write_status": write_status,
+                    "last_applied": server.log.last_applied}
+
+        @app.get("/read_barrier")
+        def read_barrier(read_index: int | None = None, group: int = 0, _: str = Depends(get_current_username)):
+            read_index = self.group(group).read_barrier(read_index)
+            if read_index is None:
+                return {"status": "ERROR", "message": "Could not confirm a linearizable read"}
+            return {"status": "OK", "read_index": read_index}
+
+        @app.get("/bounded_read")
+        def bounded_read(max_entries: int | None = None, max_seconds: float | None = None,
+                         timeout: float | None = None, group: int = 0, _: str = Depends(get_current_username)):
+            server = self.group(group)
+            staleness = server.wait_for_bounded_staleness(max_entries, max_seconds, timeout)
+            if staleness is None:
+                return {"status": "ERROR", "message": "The local state is not fresh enough",
+                        "staleness": self.staleness_json(*server.read_staleness())}
+            return {"status": "OK", "staleness": self.staleness_json(*staleness),
+                    "last_applied": server.log.last_applied}
 
         @app.get("/get_log")
-        def get_log(_: str = Depends(get_current_username)):
-            return self.server.log.entries
+        def get_log(group: int = 0, _: str = Depends(get_current_username)):
+            return [entry.to_dict() for entry in self.group(group).log.entries]
 
         @app.get("/authenticate")
         async def read_protected_endpoint(_: str = Depends(get_current_username)):
             return {'status': 'OK'}
 
         @app.post("/add_node")
-        async def _add_node(server: dict, _: str = Depends(get_current_username)):
-            self.server.add_node(int(server['id']), server['host'], server['raft_port'])
-            entry = {
-                'host': server['host'],
-                'raft_port': server['raft_port'],
-                'api_port': server['api_port'],
-                'kv_port': server['kv_port']
-            }
-            self.raft_config.config[server['id']] = entry
-            self.raft_config.save()
-            self.api_servers[int(server['id'])] = {'host': server['host'], 'port': server['api_port']}
-            return {'status': 'OK'}
+        def _add_node(server: dict, group: int | None = None, _: str = Depends(get_current_username)):
+            return self.change_membership('add_node', server, lambda raft_server: raft_server.add_node(
+                int(server['id']), server['host'], server['raft_port'], learner=server.get('learner', True),
+                api_port=server['api_port'], kv_port=server['kv_port']), group)
 
         @app.post("/update_node")
-        async def _update_node(server: dict, _: str = Depends(get_current_username)):
-            self.server.update_node(int(server['id']), server['host'], server['raft_port'])
-            entry = {
-                'host': server['host'],
-                'raft_port': server['raft_port'],
-                'api_port': server['api_port'],
-                'kv_port': server['kv_port']
-            }
-            self.raft_config.config[server['id']] = entry
-            self.raft_config.save()
-            self.api_servers[int(server['id'])] = {'host': server['host'], 'port': server['api_port']}
-            return {'status': 'OK'}
+        def _update_node(server: dict, group: int | None = None, _: str = Depends(get_current_username)):
+            return self.change_membership('update_node', server, lambda raft_server: raft_server.update_node(
+                int(server['id']), server['host'], server['raft_port'],
+                api_port=server['api_port'], kv_port=server['kv_port']), group)
 
         @app.post("/delete_node/{server_id}")
-        async def _delete_node(server_id: int, _: str = Depends(get_current_username)):
-            if server_id == self.server.server_id:
-                self.server.is_running = False
-                self.server.rpc_server.stop()
-            self.server.delete_node(int(server_id))
-            del self.raft_config.config[str(server_id)]
-            self.raft_config.save()
-            del self.api_servers[int(server_id)]
-            return {'status': 'OK'}
+        def _delete_node(server_id: int, group: int | None = None, _: str = Depends(get_current_username)):
+            return self.change_membership(f'delete_node/{server_id}', {},
+                                          lambda raft_server: raft_server.delete_node(int(server_id)), group)
 
         @app.get("/get_servers")
         def get_state(_: str = Depends(get_current_username)):
-            return {"status": 'OK', "api_servers": self.api_servers, "raft_servers": self.servers}
+            return {"status": 'OK', "api_servers": self.api_servers, "raft_servers": self.groups[0].raft_servers,
+                    "membership_version": self.groups[0].membership.version}
 
         @app.get("/get_state")
-        def get_state(_: str = Depends(get_current_username)):
-            return {"status": "OK",
-                    "leader_id": str(self.server.leader_id),
-                    "is_running": self.server.is_running,
-                    "state": self.server.state.name,
-                    "message": 'All OK'}
+        def get_state(group: int = 0, _: str = Depends(get_current_username)):
+            server = self.group(group)
+            response = {"status": "OK",
+                        "leader_id": str(server.leader_id),
+                        "is_running": server.is_running,
+                        "state": server.state.name,
+                        "learners": sorted(server.learners),
+                        "durability": server.log.writer.durability,
+                        "persisted_index": server.log.get_persisted_index(),
+                        "staleness": self.staleness_json(*server.read_staleness()),
+                        "message": 'All OK'}
+            if len(self.groups) > 1:
+                response["groups"] = [{"group": group_id, "leader_id": str(raft_server.leader_id),
+                                       "state": raft_server.state.name}
+                                      for group_id, raft_server in enumerate(self.groups)]
+            return response
+
+        @app.get("/get_metrics")
+        def get_metrics(group: int = 0, _: str = Depends(get_current_username)):
+            return {"status": "OK", "metrics": self.group(group).metrics.to_dict()}
 
         @app.post("/start_server")
         def get_state(_: str = Depends(get_current_username)):
-            if self.server.is_running:
+            if all(server.is_running for server in self.groups):
                 return {"status": 'OK', "message": "Server already running"}
-            self.server.is_running = True
-            self.server_executor.submit(self.server.run)
+            if self.multi_raft is not None:
+                self.multi_raft.start()
+                return {"status": 'OK'}
+            server = self.groups[0]
+            server.is_running = True
+            self.server_executor.submit(server.run)
             return {"status": 'OK'}
 
+        @app.post("/transfer_leadership")
+        def transfer_leadership(request: dict, group: int = 0, _: str = Depends(get_current_username)):
+            server = self.group(group)
+            target_id = request.get('target_id')
+            if server.state != RaftState.LEADER:
+                if server.leader_id is None or server.leader_id not in self.api_servers:
+                    return {"status": "ERROR", "message": "There is no leader to transfer from"}
+                response = api_post_request(self.leader_url(server, 'transfer_leadership'), request)
+                return response.json()
+            new_leader_id = server.transfer_leadership(None if target_id is None else int(target_id))
+            if new_leader_id is None:
+                return {"status": "ERROR", "message": "Leadership transfer failed, the leader is unchanged"}
+            return {"status": "OK", "leader_id": str(new_leader_id)}
+
         @app.post("/stop_server")
         def get_state(_: str = Depends(get_current_username)):
-            if not self.server.is_running:
+            if not any(server.is_running for server in self.groups):
                 return {"status": 'OK', "message": "Server already stopped"}
-            self.server.is_running = False
-            self.server.state = RaftState.FOLLOWER
+            if self.multi_raft is not None:
+                self.multi_raft.stop()
+                return {"status": 'OK'}
+            server = self.groups[0]
+            if server.state == RaftState.LEADER:
+                # hand over first, so that the cluster does not wait for an election timeout
+                server.transfer_leadership()
+            server.is_running = False
+            server.state = RaftState.FOLLOWER
             return {"status": 'OK'}
 
         return app
 
     def start(self):
-        self.server = RaftServer(self.raft_server_id, self.servers, self.database_uri,
-                                 self.database_name, self.collection_name)
+        if self.number_of_groups > 1:
+            self.multi_raft = MultiRaft(self.raft_server_id, self.servers, self.database_uri,
+                                        self.database_name, self.collection_name, self.number_of_groups)
+            self.groups = self.multi_raft.groups
+        else:
+            self.groups = [RaftServer(self.raft_server_id, self.servers, self.database_uri,
+                                      self.database_name, self.collection_name)]
 
         app = self.create_app()
         uvicorn.run(app, host=self.uvicorn_host, port=int(self.uvicorn_port),
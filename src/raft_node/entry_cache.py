@@ -0,0 +1,62 @@
+import collections
+import threading
+
+# the memory a cached entry takes besides its command: the LogEntry and the slot of the cache
+ENTRY_OVERHEAD = 120
+
+
+class EntryCache:
+    """
+    A least recently used cache of log entries, bounded by the size of their
+    commands. It holds the entries the log reads back from its storage.
+
+    Usage:
+        cache = EntryCache(max_bytes=64 * 1024 * 1024)
+        cache.put(entry)
+        entry = cache.get(index)  # None if it is not cached
+
+    Args:
+        max_bytes (int): the size of the cached entries, the least recently used
+            ones are evicted beyond it
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def entry_size(entry):
+        return len(entry.command) + ENTRY_OVERHEAD
+
+    def get(self, index):
+        with self.lock:
+            entry = self.entries.get(index)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(index)
+            self.hits += 1
+            return entry
+
+    def put(self, entry):
+        with self.lock:
+            previous = self.entries.pop(entry.index, None)
+            if previous is not None:
+                self.size -= self.entry_size(previous)
+            self.entries[entry.index] = entry
+            self.size += self.entry_size(entry)
+            while self.size > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= self.entry_size(evicted)
+
+    def discard(self, keep):
+        """
+        Drop the entries for which keep(index) is false, when the log deletes them.
+        """
+        with self.lock:
+            for index in [index for index in self.entries if not keep(index)]:
+                self.size -= self.entry_size(self.entries.pop(index))
@@ -1,7 +1,12 @@
-from pymongo import MongoClient
+import bisect
+from array import array
 
 from src.configuration_reader import IniConfig, JsonConfig
 from src.logger import MyLogger
+from src.raft_node.compression import Compressor
+from src.raft_node.entry_cache import EntryCache
+from src.raft_node.log_storage import create_log_storage
+from src.raft_node.log_writer import LogWriter
 from src.rpc import RPCClient
 
 logger = MyLogger()
@@ -10,6 +15,7 @@ servers = JsonConfig('src/configurations/servers.json').get_all_properties()
 
 
 class LogEntry:
+
     def __init__(self, index, term, command, is_committed=False):
         self.index = index
         self.term = term
@@ -33,85 +39,466 @@ class LogEntry:
         return LogEntry(d['index'], d['term'], d['command'], d['is_committed'])
 
 
+class EntryArray:
+    """
+    The entries of the in-memory log, stored in flat arrays instead of one
+    object per entry: the terms in an array of 64-bit integers and the commands,
+    UTF-8 encoded, one after the other in a single bytearray, with the offset
+    at which each command ends in a second integer array. An entry costs 16
+    bytes plus its command, where a LogEntry object with its attribute dict and
+    command string costs a few hundred.
+
+    The index of an entry is implied by its position, and whether it is
+    committed by the commit index of the log, so neither is stored. Reading an
+    entry builds a LogEntry on the fly; changing it has no effect on the log.
+
+    :param first_index: the index of the first entry
+    """
+
+    def __init__(self, first_index=1):
+        self.first_index = first_index
+        # the entries up to commit_index are committed
+        self.commit_index = 0
+        self.terms = array('q')
+        self.command_ends = array('q')
+        self.commands = bytearray()
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __iter__(self):
+        for position in range(len(self.terms)):
+            yield self.entry(position)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.entry(position) for position in range(*key.indices(len(self.terms)))]
+        if key < 0:
+            key += len(self.terms)
+        if not 0 <= key < len(self.terms):
+            raise IndexError('entry position out of range')
+        return self.entry(key)
+
+    def entry(self, position):
+        index = self.first_index + position
+        return LogEntry(index, self.terms[position], self.command(position), index <= self.commit_index)
+
+    def term(self, position):
+        return self.terms[position]
+
+    def command(self, position):
+        start = self.command_ends[position - 1] if position > 0 else 0
+        return self.commands[start:self.command_ends[position]].decode()
+
+    def command_size(self, position):
+        """
+        :return: the size of the encoded command at position, without decoding it
+        """
+        start = self.command_ends[position - 1] if position > 0 else 0
+        return self.command_ends[position] - start
+
+    def append(self, term, command):
+        self.commands += command.encode()
+        self.terms.append(term)
+        self.command_ends.append(len(self.commands))
+
+    def extend(self, entries):
+        """
+        :param entries: (term, command) pairs
+        """
+        for term, command in entries:
+            self.append(term, command)
+
+    def truncate(self, length):
+        """
+        Keep the first length entries.
+        """
+        if length >= len(self.terms):
+            return
+        end = self.command_ends[length - 1] if length > 0 else 0
+        del self.terms[length:]
+        del self.command_ends[length:]
+        del self.commands[end:]
+
+    def drop(self, count):
+        """
+        Remove the first count entries, the entry after them becomes the first one.
+        """
+        count = min(count, len(self.terms))
+        if count <= 0:
+            return
+        start = self.command_ends[count - 1]
+        del self.terms[:count]
+        del self.commands[:start]
+        self.command_ends = array('q', (end - start for end in self.command_ends[count:]))
+        self.first_index += count
+
+
 class Log:
-    def __init__(self, database_uri, database_name, collection_name, server_id):
+    """
+    The replicated log of a raft node. The entries after the snapshot are kept in
+    memory and persisted by a LogStorage, a MongoDB collection or a segmented
+    write-ahead log on the local disk (see log_storage in config.ini), through
+    a LogWriter that writes them with the durability of the deployment (see
+    durability in config.ini). The log also persists the hard state of the
+    node, its current term and vote, always before it returns.
+
+    The log can be compacted: the entries up to snapshot_index are replaced by a
+    snapshot of the state machine. Indexes keep counting from the start of the
+    log.
+
+    Only a window of the last entries is kept in memory, in an EntryArray which
+    builds a LogEntry when one is read: entries[0] holds the entry with index
+    entries.first_index. The window holds between log_window_entries and twice
+    as many entries, it slides forward over the applied entries as the log
+    grows. The older entries are read back from the storage when a lagging
+    follower needs them, through an LRU cache bounded in bytes, a batch of
+    log_prefetch_entries at a time since such a follower reads them in order.
+
+    Since terms only grow along the log, the log also keeps the index at which
+    each of its terms starts (term_starts_terms/term_starts_indexes), so that the
+    first and last index of a term are found with a binary search.
+    """
+    def __init__(self, database_uri, database_name, collection_name, server_id, group_id=0, storage=None):
         self.server_id = server_id
+        # the raft group of the log, the state machine keeps the applied index of every group
+        self.group_id = group_id
         self.kv_server_host = servers[str(self.server_id)]['host']
         self.kv_server_port = servers[str(self.server_id)]['kv_port']
         self.kv_store_rpc_client = RPCClient(host=self.kv_server_host, port=self.kv_server_port)
 
-        self.client = MongoClient(database_uri)
-        self.db = self.client[database_name]
-        self.collection = self.db[collection_name]
+        # compresses the stored entries and the entries and snapshots sent to followers
+        self.compressor = Compressor(raft_config.get_property('raft', 'compression').lower() == 'zlib',
+                                     int(raft_config.get_property('raft', 'compression_threshold')),
+                                     int(raft_config.get_property('raft', 'compression_level')))
+        self.storage = storage or create_log_storage(database_uri, database_name, collection_name, self.compressor)
+        # the size of the chunks of a snapshot sent to a follower
+        self.snapshot_chunk_size = int(raft_config.get_property('raft', 'snapshot_chunk_size'))
+        # the number of last entries kept in memory, and the cache of the entries read back before them
+        self.window_entries = max(1, int(raft_config.get_property('raft', 'log_window_entries')))
+        self.prefetch_entries = int(raft_config.get_property('raft', 'log_prefetch_entries'))
+        self.cache = EntryCache(int(raft_config.get_property('raft', 'log_cache_bytes')))
+        self.writer = LogWriter(self.storage, raft_config.get_property('raft', 'durability'),
+                                float(raft_config.get_property('raft', 'durability_group_interval')),
+                                int(raft_config.get_property('raft', 'durability_group_entries')),
+                                int(raft_config.get_property('raft', 'durability_queue_entries')))
 
-        self.entries = []
+        self.snapshot_index = 0
+        self.snapshot_term = 0
+        # the cluster configuration at snapshot_index, the log no longer holds its entry
+        self.snapshot_membership = None
+        self.entries = EntryArray()
+        self.term_starts_terms = []
+        self.term_starts_indexes = []
         self.load_entries()
+        self.current_term = 0
+        self.voted_for = None
+        self.load_hard_state()
+        # index of the last entry applied to the state machine, advanced by the Applier of the node
+        self.last_applied = self.load_last_applied()
+        self.applied_bytes_since_snapshot = 0
 
     def load_entries(self):
-        cursor = self.collection.find({})
-        self.entries = [LogEntry.from_dict(entry) for entry in cursor]
+        snapshot = self.storage.load_snapshot_meta()
+        if snapshot is not None:
+            self.snapshot_index = snapshot['last_included_index']
+            self.snapshot_term = snapshot['last_included_term']
+            self.snapshot_membership = snapshot['membership']
+        # only the last entries are loaded, the time and memory the log takes to start do not grow with it
+        tail = self.storage.load_last_entries(self.snapshot_index, self.window_entries)
+        self.entries = EntryArray(tail[0]['index'] if tail else self.snapshot_index + 1)
+        self.entries.extend((entry['term'], entry['command']) for entry in tail)
+        # the entries up to the commit index are committed, with write-behind the
+        # commit index may have been stored before the last entries were
+        self.entries.commit_index = min(self.storage.load_commit_index(), self.get_last_index())
+        self.rebuild_term_starts()
+        self.cache.discard(lambda index: False)
+        self.writer.persisted_index = self.get_last_index()
+
+    def load_hard_state(self):
+        """
+        Load the current term and vote of the node. A log stored before the hard state
+        was persisted starts at the term of its last entry, with no vote.
+        """
+        hard_state = self.storage.load_hard_state()
+        self.current_term = max(hard_state['term'], self.get_last_term())
+        self.voted_for = hard_state['voted_for'] if hard_state['term'] == self.current_term else None
+
+    def save_hard_state(self, term, voted_for):
+        """
+        Persist the current term and vote of the node, before it answers or sends a
+        request with them. Nothing is written if they did not change.
+
+        :param term: the current term
+        :param voted_for: the candidate voted for in the term, or None
+        """
+        if term == self.current_term and voted_for == self.voted_for:
+            return
+        self.storage.save_hard_state(term, voted_for)
+        self.current_term = term
+        self.voted_for = voted_for
+
+    def load_last_applied(self):
+        last_applied = self.storage.load_last_applied()
+        if last_applied is None:
+            # the entries of a log written before the watermark was stored were applied when committed
+            return self.get_last_commit_index()
+        return max(self.snapshot_index, last_applied)
+
+    def save_last_applied(self):
+        self.storage.save_last_applied(self.last_applied)
+
+    def rebuild_term_starts(self):
+        self.term_starts_terms = []
+        self.term_starts_indexes = []
+        for position, term in enumerate(self.entries.terms):
+            self.track_term_start(self.entries.first_index + position, term)
+
+    def track_term_start(self, index, term):
+        if not self.term_starts_terms or self.term_starts_terms[-1] != term:
+            self.term_starts_terms.append(term)
+            self.term_starts_indexes.append(index)
+
+    def first_index_of_term(self, term):
+        """
+        Get the index of the first entry of a term that is still in the log.
+
+        :param term: the term to look for
+        :return: the index, or None if the log holds no entry of the term
+        """
+        position = bisect.bisect_left(self.term_starts_terms, term)
+        if position == len(self.term_starts_terms) or self.term_starts_terms[position] != term:
+            return None
+        return self.term_starts_indexes[position]
+
+    def last_index_of_term(self, term):
+        """
+        Get the index of the last entry of a term, including the last entry
+        covered by the snapshot.
+
+        :param term: the term to look for
+        :return: the index, or None if the log holds no entry of the term
+        """
+        position = bisect.bisect_left(self.term_starts_terms, term)
+        if position == len(self.term_starts_terms) or self.term_starts_terms[position] != term:
+            if term == self.snapshot_term and self.snapshot_index > 0:
+                return self.snapshot_index
+            return None
+        if position + 1 < len(self.term_starts_indexes):
+            return self.term_starts_indexes[position + 1] - 1
+        return self.get_last_index()
+
+    def save_entries(self, entries, on_durable=None):
+        self.writer.append(entries, on_durable)
+        self.slide_window()
 
-    def save_entry(self, entry):
-        self.collection.insert_one(entry.to_dict())
+    def get_persisted_index(self):
+        """
+        :return: the index of the last entry the storage acknowledged
+        """
+        return self.writer.persisted_index
+
+    def slide_window(self):
+        """
+        Once the window holds twice log_window_entries entries, leave its oldest
+        applied and persisted entries to the storage so that it holds
+        log_window_entries again.
+        """
+        if len(self.entries) <= 2 * self.window_entries:
+            return
+        last_index = min(self.last_applied, self.writer.persisted_index)
+        count = min(len(self.entries) - self.window_entries, last_index - self.entries.first_index + 1)
+        if count > 0:
+            self.entries.drop(count)
+            self.rebuild_term_starts()
+
+    def read_stored_entries(self, first_index, last_index):
+        """
+        Read entries before the window through the cache. On a miss, the entries
+        from the missing one up to log_prefetch_entries after it are read from
+        the storage and cached, a follower that catches up asks for them next.
+
+        :param first_index: index of the first entry to read
+        :param last_index: index of the last entry to read, before the window
+        :return: a list of LogEntry objects
+        """
+        entries = []
+        index = first_index
+        while index <= last_index:
+            entry = self.cache.get(index)
+            if entry is not None:
+                entries.append(entry)
+                index += 1
+                continue
+            prefetch_index = min(self.entries.first_index - 1, index + max(self.prefetch_entries, 1) - 1)
+            fetched = [LogEntry.from_dict(entry)
+                       for entry in self.storage.read_entries(index, max(last_index, prefetch_index))]
+            if not fetched:
+                break
+            for entry in fetched:
+                self.cache.put(entry)
+            entries.extend(fetched[:last_index - index + 1])
+            index += len(fetched)
+        for entry in entries:
+            entry.is_committed = entry.index <= self.entries.commit_index
+        return entries
+
+    def find_entries(self, command_prefix):
+        """
+        Find the entries after the snapshot whose command starts with command_prefix,
+        without reading the others into memory.
+
+        :param command_prefix: the start of the commands to look for
+        :return: a list of LogEntry objects, in log order
+        """
+        return [LogEntry.from_dict(entry) for entry in self.storage.find_entries(self.snapshot_index, command_prefix)]
+
+    def append_entries(self, term, commands, on_durable=None):
+        """
+        Append a batch of commands with a single write to the storage.
+
+        :param term: the term of the new entries
+        :param commands: the commands to append
+        :param on_durable: if given, the entries are in the log when this returns but written in the
+            background, on_durable(last_index) is called once they reach the durability of the log
+        :return: the indexes of the new entries
+        """
+        first_index = self.get_last_index() + 1
+        entries = [LogEntry(first_index + i, term, command) for i, command in enumerate(commands)]
+        self.entries.extend((term, command) for command in commands)
+        if entries:
+            self.track_term_start(first_index, term)
+        last_index = first_index + len(entries) - 1
+        self.save_entries(entries, None if on_durable is None else lambda: on_durable(last_index))
+        return [entry.index for entry in entries]
+
+    def append_replicated_entries(self, entries):
+        """
+        Append the entries received from the leader with a single write to the storage.
+
+        :param entries: dicts with the term and command of the new entries, in log order
+        :return: the indexes of the new entries
+        """
+        first_index = self.get_last_index() + 1
+        new_entries = [LogEntry(first_index + i, entry['term'], entry['command']) for i, entry in enumerate(entries)]
+        for entry in new_entries:
+            self.entries.append(entry.term, entry.command)
+            self.track_term_start(entry.index, entry.term)
+        self.save_entries(new_entries)
+        return [entry.index for entry in new_entries]
 
     def append_entry(self, term, command):
-        index = len(self.entries) + 1
-        entry = LogEntry(index, term, command)
-        self.entries.append(entry)
-        self.save_entry(entry)
+        index = self.get_last_index() + 1
+        self.entries.append(term, command)
+        self.track_term_start(index, term)
+        self.save_entries([LogEntry(index, term, command)])
         return index
 
     def get_entry(self, index):
-        if len(self.entries) < index or index == 0:
+        if index <= self.snapshot_index or index > self.get_last_index():
             return None
-        return self.entries[index - 1]
+        if index < self.entries.first_index:
+            entries = self.read_stored_entries(index, index)
+            return entries[0] if entries else None
+        return self.entries[index - self.entries.first_index]
+
+    def get_term(self, index):
+        """
+        Get the term of the entry with the given index, including the last entry
+        covered by the snapshot.
+
+        :param index: the log index
+        :return: the term, or None if the entry is unknown or compacted
+        """
+        if index == self.snapshot_index:
+            return self.snapshot_term
+        if index < self.snapshot_index or index > self.get_last_index():
+            return None
+        if index < self.entries.first_index:
+            entry = self.get_entry(index)
+            return entry.term if entry is not None else None
+        return self.entries.term(index - self.entries.first_index)
 
     def get_last_index(self):
-        return len(self.entries)
+        return self.entries.first_index + len(self.entries) - 1
 
     def commit_entry(self, index):
-        entry = self.entries[index - 1]
-        entry.is_committed = True
-        self.collection.update_one({'index': index}, {'$set': entry.to_dict()})
-
-    def delete_entry_from_collection(self, entry):
-        self.collection.delete_one({'index': entry.index})
+        self.commit_entries(index - 1, index)
 
     def delete_entries_after(self, prev_log_index):
-        self.entries = self.entries[:prev_log_index]
-        result = self.collection.delete_many({'index': {'$gt': prev_log_index}})
-        logger.info(f"Deleted {result.deleted_count} entries from collection.")
+        if prev_log_index < self.entries.first_index - 1:
+            commit_index = self.entries.commit_index
+            self.entries = EntryArray(prev_log_index + 1)
+            self.entries.commit_index = commit_index
+        else:
+            self.entries.truncate(prev_log_index - self.entries.first_index + 1)
+        self.cache.discard(lambda index: index <= prev_log_index)
+        while self.term_starts_indexes and self.term_starts_indexes[-1] > prev_log_index:
+            self.term_starts_indexes.pop()
+            self.term_starts_terms.pop()
+        self.writer.flush()
+        deleted = self.storage.truncate_after(prev_log_index)
+        self.writer.truncated(prev_log_index)
+        logger.info(f"Deleted {deleted} entries from the log storage.")
 
     def get_last_term(self):
-        if len(self.entries) == 0:
-            return 0
-        return self.entries[-1].term
+        if len(self.entries) > 0:
+            return self.entries.term(len(self.entries) - 1)
+        return self.get_term(self.get_last_index())
 
     def commit_entries(self, commit_index, new_commit_index):
+        """
+        Mark the entries after commit_index up to new_commit_index as committed,
+        with a single write to the storage. They are applied to the state machine
+        later, by the Applier of the node.
+
+        :param commit_index: the previous commit index
+        :param new_commit_index: the new commit index
+        """
         logger.info(f"Committing entries from {commit_index} to {new_commit_index}")
-        for entry in self.entries[commit_index:new_commit_index]:
-            entry.is_committed = True
-            self.collection.update_one({'index': entry.index}, {'$set': entry.to_dict()})
-            # Send entry to state machine
-            try:
-                self.append_to_state_machine(entry.command)
-            except ConnectionError as e:
-                logger.error(f"ConnectionError: {e}")
+        self.entries.commit_index = max(self.entries.commit_index, new_commit_index)
+        self.storage.commit(commit_index, new_commit_index)
 
     def get_last_commit_index(self):
-        for i in range(len(self.entries) - 1, -1, -1):
-            if self.entries[i].is_committed:
-                return i + 1
+        return max(self.snapshot_index, self.entries.commit_index)
 
     def get_all_entries_from_index(self, index):
-        return self.entries[index - 1:]
+        stored = self.read_stored_entries(max(index, self.snapshot_index + 1), self.entries.first_index - 1)
+        return stored + self.entries[max(0, index - self.entries.first_index):]
 
-    def is_empty(self):
-        return len(self.entries) == 0
+    def get_entries(self, index, max_count, max_bytes):
+        """
+        Get a bounded batch of consecutive entries starting at the given index.
+        The batch holds at most max_count entries and stops before the size of the
+        commands exceeds max_bytes, but it always holds at least one entry if there is any.
 
-    def update_entry(self, index):
-        entry = self.entries[index - 1]
-        self.collection.update_one({'index': index}, {'$set': entry.to_dict()})
+        :param index: index of the first entry of the batch
+        :param max_count: maximum number of entries in the batch
+        :param max_bytes: maximum total size of the commands in the batch
+        :return: a list of LogEntry objects
+        """
+        batch = []
+        size = 0
+        if index < self.entries.first_index:
+            last_index = min(self.entries.first_index - 1, index + max_count - 1)
+            for entry in self.read_stored_entries(max(index, self.snapshot_index + 1), last_index):
+                size += len(entry.command.encode())
+                if batch and size > max_bytes:
+                    return batch
+                batch.append(entry)
+            index += len(batch)
+            max_count -= len(batch)
+        first = max(0, index - self.entries.first_index)
+        last = min(first + max_count, len(self.entries))
+        for position in range(first, last):
+            size += self.entries.command_size(position)
+            if (batch or position > first) and size > max_bytes:
+                last = position
+                break
+        return batch + self.entries[first:last]
+
+    def is_empty(self):
+        return self.get_last_index() == 0
 
     def is_up_to_date(self, last_log_index, last_log_term):
         if last_log_term > self.get_last_term():
@@ -121,5 +508,102 @@ class Log:
         else:
             return False
 
+    def save_snapshot(self, last_included_index, last_included_term, data, membership=None):
+        """
+        Store a snapshot in place of the previous one. A crash leaves the previous
+        snapshot intact.
+
+        :param last_included_index: index of the last entry covered by the snapshot
+        :param last_included_term: term of the last entry covered by the snapshot
+        :param data: the serialized state machine
+        :param membership: the cluster configuration at last_included_index
+        """
+        self.storage.save_snapshot(last_included_index, last_included_term, data, membership)
+        self.snapshot_membership = membership
+
+    def load_snapshot(self):
+        """
+        Read the stored snapshot.
+
+        :return: the serialized state machine, or None if there is no snapshot
+        """
+        if self.snapshot_index == 0:
+            return None
+        return self.storage.load_snapshot(self.snapshot_index)
+
+    def compact(self, last_included_index, last_included_term, data, membership=None):
+        """
+        Replace the applied entries up to last_included_index with a snapshot.
+
+        :param last_included_index: index of the last entry covered by the snapshot
+        :param last_included_term: term of the last entry covered by the snapshot
+        :param data: the serialized state machine at last_included_index
+        :param membership: the cluster configuration at last_included_index
+        """
+        self.save_snapshot(last_included_index, last_included_term, data, membership)
+        self.entries.drop(last_included_index - self.entries.first_index + 1)
+        self.cache.discard(lambda index: index > last_included_index)
+        self.snapshot_index = last_included_index
+        self.snapshot_term = last_included_term
+        self.applied_bytes_since_snapshot = 0
+        self.rebuild_term_starts()
+        self.writer.flush()
+        deleted = self.storage.discard_through(last_included_index)
+        logger.info(f"Compacted log up to index {last_included_index}, deleted {deleted} entries.")
+
+    def install_snapshot(self, last_included_index, last_included_term, data, membership=None):
+        """
+        Install a snapshot received from the leader. If the log holds the last
+        entry covered by the snapshot, the entries after it are kept, otherwise
+        the whole log is discarded.
+
+        :param last_included_index: index of the last entry covered by the snapshot
+        :param last_included_term: term of the last entry covered by the snapshot
+        :param data: the serialized state machine
+        :param membership: the cluster configuration at last_included_index
+        """
+        self.writer.flush()
+        if self.get_term(last_included_index) == last_included_term:
+            self.entries.drop(last_included_index - self.entries.first_index + 1)
+            self.cache.discard(lambda index: index > last_included_index)
+        else:
+            commit_index = self.entries.commit_index
+            self.entries = EntryArray(last_included_index + 1)
+            self.entries.commit_index = commit_index
+            self.cache.discard(lambda index: False)
+            self.storage.truncate_after(last_included_index)
+            self.writer.truncated(last_included_index)
+        self.save_snapshot(last_included_index, last_included_term, data, membership)
+        self.storage.discard_through(last_included_index)
+        self.rebuild_term_starts()
+        self.snapshot_index = last_included_index
+        self.snapshot_term = last_included_term
+        self.last_applied = max(self.last_applied, last_included_index)
+        self.applied_bytes_since_snapshot = 0
+        self.save_last_applied()
+
+    def create_state_machine_snapshot(self):
+        return self.kv_store_rpc_client.call('create_snapshot', self.group_id)
+
+    def restore_state_machine_snapshot(self, data):
+        self.kv_store_rpc_client.call('restore_snapshot', data, self.group_id)
+
+    def apply_to_state_machine(self, entries):
+        """
+        Apply a contiguous range of committed entries to the state machine with a
+        single call. A failure raises, so that the Applier can retry the range.
+
+        :param entries: the LogEntry objects to apply, in log order
+        :return: the highest index applied by the state machine
+        """
+        return self.kv_store_rpc_client.server_proxy.raft_batch_request(
+            [[entry.index, entry.command] for entry in entries], self.group_id)
+
     def append_to_state_machine(self, _append_entry):
-        self.kv_store_rpc_client.call('raft_request', _append_entry)
+        """
+        Apply a command to the state machine. Unlike the other calls to the KV
+        store, a failure raises, so that the Applier can retry the command.
+
+        :param _append_entry: the command of a committed entry
+        """
+        return self.kv_store_rpc_client.server_proxy.raft_request(_append_entry)
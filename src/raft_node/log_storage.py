@@ -0,0 +1,376 @@
+import re
+import uuid
+
+from src.configuration_reader import IniConfig
+from src.raft_node.compression import Compressor
+
+raft_config = IniConfig('src/configurations/config.ini')
+
+
+class LogStorage:
+    """
+    Where a Log persists its entries, its snapshot and the hard state of the node.
+
+    The Log keeps the entries after the snapshot in memory and calls the storage
+    for every change, so a storage only has to be durable and to read everything
+    back when the node restarts. The hard state is the current term and vote of
+    the node, which raft requires to survive a restart, and the commit index.
+    Entries are read back as dicts (see LogEntry.to_dict), the ones up to the
+    stored commit index marked as committed.
+    """
+
+    def load_entries(self, after_index):
+        """
+        :param after_index: the entries up to this index are covered by the snapshot
+        :return: the stored entries after after_index as dicts, in index order
+        """
+        raise NotImplementedError
+
+    def load_last_entries(self, after_index, count):
+        """
+        :param after_index: the entries up to this index are covered by the snapshot
+        :param count: the maximum number of entries to read
+        :return: the last count entries after after_index as dicts, in index order
+        """
+        raise NotImplementedError
+
+    def read_entries(self, first_index, last_index):
+        """
+        :return: the stored entries from first_index to last_index included as dicts, in index order
+        """
+        raise NotImplementedError
+
+    def find_entries(self, after_index, command_prefix):
+        """
+        :return: the stored entries after after_index whose command starts with command_prefix,
+            as dicts, in index order
+        """
+        raise NotImplementedError
+
+    def append(self, entries):
+        """
+        :param entries: LogEntry objects that follow the last stored entry
+        """
+        raise NotImplementedError
+
+    def commit(self, commit_index, new_commit_index):
+        """
+        :param commit_index: the previous commit index
+        :param new_commit_index: the entries up to this index are committed
+        """
+        raise NotImplementedError
+
+    def load_commit_index(self):
+        """
+        :return: the stored commit index, 0 if there is none
+        """
+        raise NotImplementedError
+
+    def truncate_after(self, index):
+        """
+        Delete the entries after index.
+
+        :return: the number of deleted entries
+        """
+        raise NotImplementedError
+
+    def discard_through(self, index):
+        """
+        Delete the entries up to index, which a snapshot covers. A storage may keep
+        some of them, load_entries skips them.
+
+        :return: the number of deleted entries
+        """
+        raise NotImplementedError
+
+    def load_hard_state(self):
+        """
+        :return: a dict with the stored 'term' and 'voted_for', 0 and None if there are none
+        """
+        raise NotImplementedError
+
+    def save_hard_state(self, term, voted_for):
+        raise NotImplementedError
+
+    def load_last_applied(self):
+        """
+        :return: the stored index of the last entry applied to the state machine, or None
+        """
+        raise NotImplementedError
+
+    def save_last_applied(self, index):
+        raise NotImplementedError
+
+    def load_snapshot_meta(self):
+        """
+        :return: a dict with 'last_included_index', 'last_included_term' and 'membership',
+            or None if there is no snapshot
+        """
+        raise NotImplementedError
+
+    def save_snapshot(self, last_included_index, last_included_term, data, membership=None):
+        """
+        Replace the stored snapshot. A crash while saving must leave the previous one intact.
+        """
+        raise NotImplementedError
+
+    def load_snapshot(self, last_included_index):
+        """
+        :return: the serialized state machine of the snapshot at last_included_index
+        """
+        raise NotImplementedError
+
+
+class MemoryLogStorage(LogStorage):
+    """
+    Keeps everything in memory, for tests and benchmarks. A Log built on the
+    same storage object sees the state of a restarted node.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.commit_index = 0
+        self.hard_state = {'term': 0, 'voted_for': None}
+        self.last_applied = None
+        self.snapshot_meta = None
+        self.snapshot_data = None
+
+    def load_entries(self, after_index):
+        return self.read_entries(after_index + 1, float('inf'))
+
+    def load_last_entries(self, after_index, count):
+        return self.load_entries(after_index)[-count:] if count > 0 else []
+
+    def read_entries(self, first_index, last_index):
+        return [dict(entry, is_committed=entry['index'] <= self.commit_index)
+                for entry in self.entries if first_index <= entry['index'] <= last_index]
+
+    def find_entries(self, after_index, command_prefix):
+        return [entry for entry in self.load_entries(after_index) if entry['command'].startswith(command_prefix)]
+
+    def append(self, entries):
+        self.entries.extend(entry.to_dict() for entry in entries)
+
+    def commit(self, commit_index, new_commit_index):
+        self.commit_index = max(self.commit_index, new_commit_index)
+
+    def load_commit_index(self):
+        return self.commit_index
+
+    def truncate_after(self, index):
+        kept = [entry for entry in self.entries if entry['index'] <= index]
+        deleted = len(self.entries) - len(kept)
+        self.entries = kept
+        return deleted
+
+    def discard_through(self, index):
+        kept = [entry for entry in self.entries if entry['index'] > index]
+        deleted = len(self.entries) - len(kept)
+        self.entries = kept
+        return deleted
+
+    def load_hard_state(self):
+        return dict(self.hard_state)
+
+    def save_hard_state(self, term, voted_for):
+        self.hard_state = {'term': term, 'voted_for': voted_for}
+
+    def load_last_applied(self):
+        return self.last_applied
+
+    def save_last_applied(self, index):
+        self.last_applied = index
+
+    def load_snapshot_meta(self):
+        return dict(self.snapshot_meta) if self.snapshot_meta is not None else None
+
+    def save_snapshot(self, last_included_index, last_included_term, data, membership=None):
+        self.snapshot_data = data
+        self.snapshot_meta = {'last_included_index': last_included_index, 'last_included_term': last_included_term,
+                              'membership': membership}
+
+    def load_snapshot(self, last_included_index):
+        if self.snapshot_meta is None or self.snapshot_meta['last_included_index'] != last_included_index:
+            return None
+        return self.snapshot_data
+
+
+class MongoLogStorage(LogStorage):
+    """
+    Stores the entries in a MongoDB collection, one document per entry, the
+    snapshot in chunks in the <collection>_snapshot collection and the hard state
+    in the <collection>_state collection.
+
+    A batch of entries is written with a single bulk write of upserts keyed on
+    the index, so a batch retried after it was partly written (see LogWriter)
+    replaces the entries already written instead of failing on the unique
+    index. The entries do not carry a commit flag: the commit and applied indexes are kept in a single
+    watermark document of the state collection, so a commit is one update,
+    whatever the number of entries it commits. The collection has a unique index
+    on the index of the entries, which the range reads and deletes use.
+
+    With compression, a command from the threshold of the compressor up is
+    stored compressed, as binary data in the zcommand field of its document.
+
+    :param collection: the collection of the entries
+    :param snapshot_collection: the collection of the snapshot chunks and metadata
+    :param state_collection: the collection of the hard state and applied index
+    :param snapshot_chunk_size: the size of the chunks of a snapshot, a document is limited to 16MB
+    :param compressor: the Compressor of the commands, by default they are stored as they are
+    """
+
+    def __init__(self, collection, snapshot_collection, state_collection, snapshot_chunk_size, compressor=None):
+        self.collection = collection
+        self.snapshot_collection = snapshot_collection
+        self.state_collection = state_collection
+        self.snapshot_chunk_size = snapshot_chunk_size
+        self.compressor = compressor or Compressor()
+
+    @staticmethod
+    def connect(database_uri, database_name, collection_name, snapshot_chunk_size, compressor=None):
+        from pymongo import MongoClient
+
+        db = MongoClient(database_uri)[database_name]
+        collection = db[collection_name]
+        collection.create_index('index', unique=True)
+        return MongoLogStorage(collection, db[f"{collection_name}_snapshot"], db[f"{collection_name}_state"],
+                               snapshot_chunk_size, compressor)
+
+    def load_entries(self, after_index):
+        return self.find({'index': {'$gt': after_index}})
+
+    def load_last_entries(self, after_index, count):
+        if count <= 0:
+            return []
+        cursor = self.collection.find({'index': {'$gt': after_index}}, {'_id': False}).sort('index', -1).limit(count)
+        return self.with_commit_flags(reversed(list(cursor)))
+
+    def read_entries(self, first_index, last_index):
+        return self.find({'index': {'$gte': first_index, '$lte': last_index}})
+
+    def find_entries(self, after_index, command_prefix):
+        # the compressed commands can only be matched once decompressed
+        entries = self.find({'index': {'$gt': after_index},
+                             '$or': [{'command': {'$regex': f"^{re.escape(command_prefix)}"}},
+                                     {'zcommand': {'$exists': True}}]})
+        return [entry for entry in entries if entry['command'].startswith(command_prefix)]
+
+    def find(self, query):
+        return self.with_commit_flags(self.collection.find(query, {'_id': False}).sort('index', 1))
+
+    def with_commit_flags(self, documents):
+        commit_index = self.load_commit_index()
+        return [self.decode(dict(entry, is_committed=entry['index'] <= commit_index)) for entry in documents]
+
+    def encode(self, entry):
+        compressed = self.compressor.compress(entry.command.encode())
+        if compressed is None:
+            return {'index': entry.index, 'term': entry.term, 'command': entry.command}
+        return {'index': entry.index, 'term': entry.term, 'zcommand': compressed}
+
+    def decode(self, document):
+        if 'zcommand' in document:
+            document['command'] = self.compressor.decompress(document.pop('zcommand')).decode()
+        return document
+
+    def append(self, entries):
+        from pymongo import ReplaceOne
+
+        requests = [ReplaceOne({'index': entry.index}, self.encode(entry), upsert=True) for entry in entries]
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+
+    def commit(self, commit_index, new_commit_index):
+        self.state_collection.update_one({'_id': 'watermarks'}, {'$max': {'commit_index': new_commit_index}},
+                                         upsert=True)
+
+    def load_commit_index(self):
+        document = self.state_collection.find_one({'_id': 'watermarks'})
+        if document is not None and 'commit_index' in document:
+            return document['commit_index']
+        # a log stored before the watermarks flagged its committed entries
+        committed = self.collection.find_one({'is_committed': True}, sort=[('index', -1)])
+        return committed['index'] if committed is not None else 0
+
+    def truncate_after(self, index):
+        return self.collection.delete_many({'index': {'$gt': index}}).deleted_count
+
+    def discard_through(self, index):
+        return self.collection.delete_many({'index': {'$lte': index}}).deleted_count
+
+    def load_hard_state(self):
+        document = self.state_collection.find_one({'_id': 'hard_state'})
+        if document is None:
+            return {'term': 0, 'voted_for': None}
+        return {'term': document['term'], 'voted_for': document['voted_for']}
+
+    def save_hard_state(self, term, voted_for):
+        self.state_collection.replace_one({'_id': 'hard_state'},
+                                          {'_id': 'hard_state', 'term': term, 'voted_for': voted_for}, upsert=True)
+
+    def load_last_applied(self):
+        document = self.state_collection.find_one({'_id': 'watermarks'})
+        if document is not None and 'last_applied' in document:
+            return document['last_applied']
+        document = self.state_collection.find_one({'_id': 'last_applied'})
+        return document['index'] if document is not None else None
+
+    def save_last_applied(self, index):
+        self.state_collection.update_one({'_id': 'watermarks'}, {'$set': {'last_applied': index}}, upsert=True)
+
+    def load_snapshot_meta(self):
+        document = self.snapshot_collection.find_one({'_id': 'meta'})
+        if document is None:
+            return None
+        return {'last_included_index': document['last_included_index'],
+                'last_included_term': document['last_included_term'],
+                'membership': document.get('membership')}
+
+    def save_snapshot(self, last_included_index, last_included_term, data, membership=None):
+        # the chunks of the new snapshot are written under a version of their own before the metadata document
+        # points to them, so a snapshot saved again at the same index never mixes with the chunks of the previous one
+        version = uuid.uuid4().hex
+        chunks = [data[i:i + self.snapshot_chunk_size] for i in range(0, len(data), self.snapshot_chunk_size)] or ['']
+        self.snapshot_collection.insert_many([{'version': version, 'chunk': i, 'data': chunk}
+                                              for i, chunk in enumerate(chunks)])
+        self.snapshot_collection.replace_one({'_id': 'meta'}, {
+            '_id': 'meta',
+            'last_included_index': last_included_index,
+            'last_included_term': last_included_term,
+            'version': version,
+            'chunks': len(chunks),
+            'membership': membership,
+        }, upsert=True)
+        self.snapshot_collection.delete_many({'version': {'$ne': version}, 'chunk': {'$exists': True}})
+
+    def load_snapshot(self, last_included_index):
+        document = self.snapshot_collection.find_one({'_id': 'meta'})
+        if document is None or document['last_included_index'] != last_included_index:
+            return None
+        # the snapshots saved before the versions were versioned by their index
+        version = document.get('version', last_included_index)
+        cursor = self.snapshot_collection.find({'version': version, 'chunk': {'$exists': True}}).sort('chunk', 1)
+        return ''.join(chunk['data'] for chunk in cursor)
+
+
+def create_log_storage(database_uri, database_name, collection_name, compressor=None):
+    """
+    Create the storage selected by the log_storage property of the [raft] section:
+    'mongodb' or 'wal', a segmented write-ahead log in wal_directory.
+
+    :param database_uri: the MongoDB URI, unused by the write-ahead log
+    :param database_name: the MongoDB database, unused by the write-ahead log
+    :param collection_name: the collection of the log, also the directory of the write-ahead log
+    :param compressor: the Compressor of the stored entries
+    """
+    kind = raft_config.get_property('raft', 'log_storage').lower()
+    if kind == 'wal':
+        from src.raft_node.wal import SegmentedWAL
+
+        return SegmentedWAL(f"{raft_config.get_property('raft', 'wal_directory')}/{collection_name}",
+                            int(raft_config.get_property('raft', 'wal_segment_size')),
+                            raft_config.get_property('raft', 'wal_fsync').lower() == 'true', compressor)
+    if kind == 'mongodb':
+        return MongoLogStorage.connect(database_uri, database_name, collection_name,
+                                       int(raft_config.get_property('raft', 'snapshot_chunk_size')), compressor)
+    raise ValueError(f"Unknown log storage: {kind}")
@@ -0,0 +1,226 @@
+import collections
+import threading
+import time
+
+from src.logger import MyLogger
+
+logger = MyLogger()
+
+# every append is written to the storage before it returns
+SYNC = 'sync'
+# the appends are written together every group_interval seconds or group_entries entries, each one returns once written
+GROUP = 'group'
+# the appends are written behind by a thread, an append returns at once unless max_queued entries are waiting
+ASYNC = 'async'
+DURABILITY_MODES = (SYNC, GROUP, ASYNC)
+
+
+class LogWriter:
+    """
+    Persists the entries appended to the log, with the durability chosen for the
+    deployment (see durability in config.ini):
+        - sync: each append is one write to the storage, it returns once the
+          storage acknowledged it
+        - group: the appends are queued and written together, with a single
+          write and fsync, once the oldest one waited group_interval seconds or
+          group_entries entries are queued. Each append still returns only once
+          its entries are written
+        - async: the appends are queued and written behind by the thread of
+          the writer, an append returns at once. The queue holds at most
+          max_queued entries, an append waits while it is full. Entries that
+          are not written yet are lost if the node crashes
+
+    Since a follower acknowledges the entries of the leader once they are
+    appended, it acknowledges them once the configured durability is reached.
+    persisted_index is the index of the last entry the storage acknowledged.
+
+    The leader does not wait for its own writes: it appends with an on_durable
+    callback, the append returns at once and the entries are written by the
+    thread of the writer, in every mode, while they are replicated. The
+    callback is called once they reach the configured durability, right away
+    in async mode. The callbacks run on a thread of their own, in the order of
+    the appends: a callback may take the locks of the node, so the writes and
+    the flushes never wait for one.
+
+    The other writes of the log (truncation, compaction, snapshots) must call
+    flush() first, so that they apply after the queued entries. A failed write
+    is retried after retry_interval seconds, the entries queued after it wait.
+
+    Usage:
+        writer = LogWriter(storage, GROUP, group_interval=0.005, group_entries=256)
+        writer.append(entries)
+        writer.append(entries, on_durable=lambda: ...)
+        writer.flush()
+        writer.wait_for_callbacks()
+
+    Args:
+        storage (LogStorage): the storage the entries are written to
+        durability (str): sync, group or async
+        group_interval (float): longest time in seconds an entry waits in the queue in group mode
+        group_entries (int): number of queued entries that are written at once in group mode
+        max_queued (int): maximum number of entries waiting in the queue in async mode
+        retry_interval (float): delay in seconds before a failed write is retried
+    """
+
+    def __init__(self, storage, durability=SYNC, group_interval=0.005, group_entries=256, max_queued=10000,
+                 retry_interval=0.05):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.storage = storage
+        self.durability = durability
+        self.group_interval = group_interval
+        self.group_entries = group_entries
+        self.max_queued = max_queued
+        self.retry_interval = retry_interval
+        self.persisted_index = 0
+        self.queue = []
+        # the time the oldest queued entry was queued at
+        self.queued_at = None
+        # the number of entries ever queued and written, an append waits until its entries are written
+        self.queued_count = 0
+        self.written_count = 0
+        self.flush_requests = 0
+        # (ticket, callback) of the appends that did not wait for their write, in ticket order
+        self.callbacks = collections.deque()
+        # (written count, last index, callbacks) of the written batches, run by the notifier thread
+        self.ready = collections.deque()
+        self.notified_count = 0
+        self.condition = threading.Condition()
+        self.thread = None
+        self.notifier = None
+        if durability != SYNC:
+            self.start()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.notifier = threading.Thread(target=self.notify, daemon=True)
+        self.notifier.start()
+
+    def append(self, entries, on_durable=None):
+        """
+        Persist the entries with the durability of the writer.
+
+        :param entries: LogEntry objects, in log order
+        :param on_durable: if given, the append does not wait for the write and
+            on_durable() is called once the entries reach the durability of the writer
+        """
+        if not entries:
+            return
+        if self.durability == SYNC and on_durable is None:
+            if self.thread is not None:
+                # the entries queued by the leader are written first
+                self.flush()
+            self.storage.append(entries)
+            self.persisted_index = entries[-1].index
+            return
+        with self.condition:
+            if self.thread is None:
+                self.start()
+            while self.durability == ASYNC and self.queue and len(self.queue) + len(entries) > self.max_queued:
+                self.condition.wait()
+            if not self.queue:
+                self.queued_at = time.monotonic()
+            self.queue.extend(entries)
+            self.queued_count += len(entries)
+            ticket = self.queued_count
+            self.condition.notify_all()
+            if on_durable is not None and self.durability != ASYNC:
+                self.callbacks.append((ticket, on_durable))
+                return
+            if self.durability == GROUP:
+                while self.written_count < ticket:
+                    self.condition.wait()
+        if on_durable is not None:
+            on_durable()
+
+    def flush(self):
+        """
+        Write the queued entries now and wait until they are written. It does not
+        wait for their callbacks, so it may be called while holding a lock they take.
+        """
+        if self.thread is None:
+            return
+        with self.condition:
+            ticket = self.queued_count
+            self.flush_requests += 1
+            self.condition.notify_all()
+            while self.written_count < ticket:
+                self.condition.wait()
+            self.flush_requests -= 1
+
+    def wait_for_callbacks(self):
+        """
+        Write the queued entries now and wait until the callbacks of their appends
+        ran. Must not be called while holding a lock the callbacks take.
+        """
+        if self.thread is None:
+            return
+        with self.condition:
+            ticket = self.queued_count
+        self.flush()
+        with self.condition:
+            while self.notified_count < ticket:
+                self.condition.wait()
+
+    def truncated(self, index):
+        """
+        Called once the entries after index are deleted from the storage.
+        """
+        self.persisted_index = min(self.persisted_index, index)
+
+    def queued(self):
+        """
+        :return: the number of entries that are not written yet
+        """
+        with self.condition:
+            return len(self.queue)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.is_due():
+                    if self.queue:
+                        self.condition.wait(max(0.0, self.queued_at + self.group_interval - time.monotonic()))
+                    else:
+                        self.condition.wait()
+                batch = self.queue
+                self.queue = []
+            while True:
+                try:
+                    self.storage.append(batch)
+                    break
+                except Exception as e:
+                    logger.error(f"Failed to write entries {batch[0].index} to {batch[-1].index} "
+                                 f"to the log storage: {e}")
+                    time.sleep(self.retry_interval)
+            with self.condition:
+                self.persisted_index = batch[-1].index
+                self.written_count += len(batch)
+                callbacks = []
+                while self.callbacks and self.callbacks[0][0] <= self.written_count:
+                    callbacks.append(self.callbacks.popleft()[1])
+                self.ready.append((self.written_count, batch[-1].index, callbacks))
+                self.condition.notify_all()
+
+    def notify(self):
+        while True:
+            with self.condition:
+                while not self.ready:
+                    self.condition.wait()
+                written_count, last_index, callbacks = self.ready.popleft()
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Failed to handle the write of entries up to {last_index}: {e}")
+            with self.condition:
+                self.notified_count = written_count
+                self.condition.notify_all()
+
+    def is_due(self):
+        if not self.queue:
+            return False
+        if self.durability != GROUP or self.flush_requests > 0:
+            return True
+        return len(self.queue) >= self.group_entries or time.monotonic() - self.queued_at >= self.group_interval
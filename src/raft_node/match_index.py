@@ -0,0 +1,73 @@
+import bisect
+import threading
+
+
+class MatchIndex:
+    """
+    The highest log index known to be replicated on each voter, the leader
+    included, kept in a sorted list next to the per-voter values. An update
+    moves one value in the sorted list (found with a binary search) and the
+    quorum index, the highest index stored on a majority, is read at a fixed
+    position, so the leader does not sort all match indexes on every ack. It
+    is thread safe, the replication lanes of all followers update it.
+
+    Usage:
+        match_index = MatchIndex([1, 2, 3], initial=0)
+        match_index.update(2, 10)
+        match_index.quorum_index()
+
+    Args:
+        voters: ids of the voting members
+        initial (int): match index the voters start with
+    """
+
+    def __init__(self, voters, initial=0):
+        self.values = {}
+        self.sorted_values = []
+        self._lock = threading.Lock()
+        for voter in voters:
+            self.add(voter, initial)
+
+    def add(self, voter, index=0):
+        with self._lock:
+            if voter in self.values:
+                return
+            self.values[voter] = index
+            bisect.insort(self.sorted_values, index)
+
+    def remove(self, voter):
+        with self._lock:
+            if voter not in self.values:
+                return
+            index = self.values.pop(voter)
+            del self.sorted_values[bisect.bisect_left(self.sorted_values, index)]
+
+    def get(self, voter, default=0):
+        return self.values.get(voter, default)
+
+    def update(self, voter, index):
+        """
+        Record that a voter stores the log up to index. Match indexes never go back.
+
+        :param voter: id of the voter
+        :param index: the highest index acknowledged by the voter
+        :return: True if the match index of the voter advanced
+        """
+        with self._lock:
+            previous = self.values.get(voter)
+            if previous is None or index <= previous:
+                return False
+            del self.sorted_values[bisect.bisect_left(self.sorted_values, previous)]
+            bisect.insort(self.sorted_values, index)
+            self.values[voter] = index
+            return True
+
+    def quorum_index(self):
+        """
+        :return: the highest index stored on a majority of the voters, 0 if there are none
+        """
+        with self._lock:
+            if not self.sorted_values:
+                return 0
+            majority = len(self.sorted_values) // 2 + 1
+            return self.sorted_values[len(self.sorted_values) - majority]
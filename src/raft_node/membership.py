@@ -0,0 +1,90 @@
+import json
+
+
+class Membership:
+    """
+    One version of the cluster configuration: the members with their addresses
+    and the members among them that are learners.
+
+    A configuration is changed by appending it to the log as a configuration
+    entry, and every node uses the latest configuration in its log, committed
+    or not. A change adds, removes, updates or promotes a single member and the
+    leader starts the next change only once the previous one is committed, so a
+    majority of the old configuration and a majority of the new one always
+    overlap (Raft thesis §4.1). The version of a configuration is the index of
+    its entry, 0 for the configuration the cluster was started with.
+
+    Usage:
+        membership = Membership({1: {'host': 'localhost', 'port': 5001}})
+        membership = membership.with_member(2, {'host': 'localhost', 'port': 5002}, learner=True)
+        command = membership.to_command()
+
+    Args:
+        servers (dict): member ids mapped to their addresses, 'host' and the raft 'port',
+            and optionally the 'api_port' and 'kv_port' of the node
+        learners: ids of the members that do not vote
+        version (int): index of the configuration entry, 0 for the initial configuration
+    """
+
+    COMMAND_KEY = 'membership'
+    COMMAND_PREFIX = '{"membership": '
+
+    def __init__(self, servers, learners=(), version=0):
+        self.servers = {int(server_id): dict(info) for server_id, info in servers.items()}
+        self.learners = frozenset(int(server_id) for server_id in learners)
+        self.version = version
+
+    def __str__(self):
+        return f"Membership(version={self.version}, voters={self.voters()}, learners={sorted(self.learners)})"
+
+    def voters(self):
+        return [server_id for server_id in self.servers if server_id not in self.learners]
+
+    def with_member(self, server_id, info, learner=False):
+        """
+        :return: a copy of the configuration in which the member has the given address and role
+        """
+        servers = dict(self.servers)
+        servers[server_id] = info
+        learners = self.learners | {server_id} if learner else self.learners - {server_id}
+        return Membership(servers, learners)
+
+    def without_member(self, server_id):
+        servers = {_server_id: info for _server_id, info in self.servers.items() if _server_id != server_id}
+        return Membership(servers, self.learners - {server_id})
+
+    def promoted(self, server_id):
+        return Membership(self.servers, self.learners - {server_id})
+
+    def at_version(self, version):
+        return Membership(self.servers, self.learners, version)
+
+    def to_dict(self):
+        return {
+            'servers': {str(server_id): info for server_id, info in self.servers.items()},
+            'learners': sorted(self.learners),
+        }
+
+    @staticmethod
+    def from_dict(data, version=0):
+        return Membership(data['servers'], data['learners'], version)
+
+    def to_command(self):
+        """
+        :return: the command of the configuration entry
+        """
+        return json.dumps({self.COMMAND_KEY: self.to_dict()})
+
+    @classmethod
+    def from_command(cls, command, version):
+        """
+        Read the configuration of a log entry. Other entries are recognized by
+        their first characters, without decoding them.
+
+        :param command: the command of the entry
+        :param version: the index of the entry
+        :return: the configuration, or None if the entry is not a configuration entry
+        """
+        if not command.startswith(cls.COMMAND_PREFIX):
+            return None
+        return cls.from_dict(json.loads(command)[cls.COMMAND_KEY], version)
@@ -0,0 +1,269 @@
+import concurrent.futures
+import threading
+import time
+
+from src.configuration_reader import IniConfig
+from src.logger import MyLogger
+from src.raft_node.raft_server import RaftServer, RaftState
+from src.raft_node.sharding import KeyRouter, group_collection_name
+from src.rpc import RPCClient, RPCServer, group_method
+
+logger = MyLogger()
+raft_config = IniConfig('src/configurations/config.ini')
+
+
+class HeartbeatCoalescer:
+    """
+    Sends the heartbeats of all the raft groups of a process. Every
+    heartbeat_interval, the heartbeats that the groups led by this node owe to a
+    peer are sent together in one coalesced_heartbeat request, so the heartbeat
+    traffic between two nodes does not grow with the number of groups. Each peer
+    has its own lane, a peer that does not answer skips the rounds until its
+    request returns instead of holding up the others.
+
+    Usage:
+        coalescer = HeartbeatCoalescer(groups, client_of, heartbeat_interval=0.1)
+        coalescer.start()
+
+    Args:
+        groups: the RaftServer of every group of the process
+        client_of: called with a peer id and its address, returns the RPC client of the peer process
+        heartbeat_interval (float): time in seconds between two rounds of heartbeats
+    """
+
+    def __init__(self, groups, client_of, heartbeat_interval):
+        self.groups = groups
+        self.client_of = client_of
+        self.heartbeat_interval = heartbeat_interval
+        self.lanes = {}
+        self.inflight = {}
+        self.stop_event = threading.Event()
+        self.is_running = False
+        self.thread = None
+
+    def start(self):
+        self.is_running = True
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.is_running = False
+        self.stop_event.set()
+
+    def run(self):
+        while self.is_running:
+            started = time.monotonic()
+            try:
+                self.send_round()
+            except Exception as e:
+                logger.error(f"Failed to send the coalesced heartbeats: {e}")
+            self.stop_event.wait(max(0.0, started + self.heartbeat_interval - time.monotonic()))
+
+    def collect(self):
+        """
+        :return: the peers mapped to their address and the (group, heartbeat) pairs they are owed
+        """
+        heartbeats = {}
+        for group in self.groups:
+            for _server_id in list(group.progress.keys()):
+                heartbeat = group.coalesced_heartbeat(_server_id)
+                info = group.raft_servers.get(_server_id)
+                if heartbeat is None or info is None:
+                    continue
+                heartbeats.setdefault(_server_id, (info, []))[1].append((group, heartbeat))
+        return heartbeats
+
+    def send_round(self):
+        """
+        Send one coalesced request to every peer that is owed a heartbeat.
+
+        :return: the futures of the dispatched requests
+        """
+        futures = []
+        for _server_id, (info, heartbeats) in self.collect().items():
+            inflight = self.inflight.get(_server_id)
+            if inflight is not None and not inflight.done():
+                continue
+            if _server_id not in self.lanes:
+                self.lanes[_server_id] = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            future = self.lanes[_server_id].submit(self.send, _server_id, info, heartbeats)
+            self.inflight[_server_id] = future
+            futures.append(future)
+        return futures
+
+    def send(self, _server_id, info, heartbeats):
+        sent_at = time.time()
+        responses = self.client_of(_server_id, info).call(
+            'coalesced_heartbeat', [[group.group_id] + heartbeat for group, heartbeat in heartbeats])
+        if responses is None:
+            responses = [None] * len(heartbeats)
+        for (group, _), response in zip(heartbeats, responses):
+            group.coalesced_heartbeat_acked(_server_id, sent_at, response)
+
+
+class MultiRaft:
+    """
+    Hosts several independent raft groups in one process, so that writes are
+    not capped by the loop of a single leader. Every group is a RaftServer with
+    its own log collection, the top-level keys of the KV store are sharded over
+    the groups by hash range (see KeyRouter).
+
+    The groups share one threaded RPC server, on the raft port of the node, on
+    which the methods of a group are registered under its name ("group3.append_entries").
+    The requests that change the state of a group are handled one at a time,
+    under the rpc_lock of the group (see RaftServer.rpc_functions), while the
+    groups are handled in parallel. The heartbeats
+    of the groups are coalesced, one request per node pair (HeartbeatCoalescer).
+
+    The leaders are spread across the nodes: every group has a preferred leader,
+    the voters taking turns, and a leader that is not the preferred one hands the
+    leadership over once the preferred leader is up to date and reachable.
+
+    Usage:
+        multi_raft = MultiRaft(server_id, raft_servers, database_uri, database_name, collection_name, 4)
+        multi_raft.start()
+        group = multi_raft.group_of('user_42')
+
+    Args:
+        server_id (int): id of the node
+        raft_servers (dict): the members of the groups with their addresses
+        database_uri (str): URI of the MongoDB server
+        database_name (str): name of the database of the logs
+        collection_name (str): log collection of group 0, the other groups add their id to it
+        number_of_groups (int): number of raft groups
+    """
+
+    def __init__(self, server_id, raft_servers, database_uri, database_name, collection_name, number_of_groups):
+        self.server_id = server_id
+        self.hostname = raft_servers[server_id]['host']
+        self.port = raft_servers[server_id]['port']
+        self.router = KeyRouter(number_of_groups)
+        self.heartbeat_interval = float(raft_config.get_property('raft', 'heartbeat_interval'))
+        self.rpc_timeout = float(raft_config.get_property('raft', 'rpc_timeout'))
+        self.leader_balance_interval = float(raft_config.get_property('raft', 'leader_balance_interval'))
+        self.groups = []
+        for group_id in range(number_of_groups):
+            group = RaftServer(server_id, raft_servers, database_uri, database_name,
+                               group_collection_name(collection_name, group_id), group_id=group_id)
+            group.coalesce_heartbeats = True
+            self.groups.append(group)
+        self.clients = {}
+        self.coalescer = HeartbeatCoalescer(self.groups, self.client_of, self.heartbeat_interval)
+        self.rpc_server = None
+        self.balancer = None
+        self.stop_event = threading.Event()
+
+    def group_of(self, key):
+        """
+        :return: the RaftServer of the group that owns the key
+        """
+        return self.groups[self.router.group_of(key)]
+
+    def client_of(self, _server_id, info):
+        """
+        :return: the RPC client of the process of a peer, created again if its address changed
+        """
+        address = (info['host'], info['port'])
+        client = self.clients.get(_server_id)
+        if client is None or client[0] != address:
+            client = (address, RPCClient(host=info['host'], port=info['port'], timeout=self.rpc_timeout))
+            self.clients[_server_id] = client
+        return client[1]
+
+    def rpc_functions(self):
+        """
+        :return: the RPC handlers of all the groups and of the coalesced heartbeats by name
+        """
+        functions = {'coalesced_heartbeat': self.coalesced_heartbeat_rpc}
+        for group in self.groups:
+            for name, function in group.rpc_functions().items():
+                functions[group_method(group.group_id, name)] = function
+        return functions
+
+    def coalesced_heartbeat_rpc(self, heartbeats):
+        """
+        Handle the heartbeats a leader sent to this node for several groups at once.
+
+        Args:
+            heartbeats: the [group_id, term, leader_id, prev_log_index, prev_log_term, leader_commit] of every group
+
+        Returns:
+            list: the append_entries response of every group, None for a group this node does not host
+        """
+        responses = []
+        for group_id, term, leader_id, prev_log_index, prev_log_term, leader_commit in heartbeats:
+            if not 0 <= group_id < len(self.groups):
+                responses.append(None)
+                continue
+            with self.groups[group_id].rpc_lock:
+                responses.append(self.groups[group_id].append_entries_rpc(
+                    term, leader_id, prev_log_index, prev_log_term, [], leader_commit))
+        return responses
+
+    def start(self):
+        """
+        Start the groups that are not running. The RPC server, the coalesced
+        heartbeats and the leader balancing are started once.
+        """
+        if self.rpc_server is None:
+            self.rpc_server = RPCServer(host=self.hostname, port=self.port, threaded=True)
+            for name, function in self.rpc_functions().items():
+                self.rpc_server.register_function(function, name)
+            threading.Thread(target=self.rpc_server.run, daemon=True).start()
+            self.coalescer.start()
+            self.balancer = threading.Thread(target=self.balance_leaders, daemon=True)
+            self.balancer.start()
+        for group in self.groups:
+            if not group.is_running:
+                group.is_running = True
+                threading.Thread(target=group.run, daemon=True).start()
+
+    def stop(self):
+        """
+        Stop the groups, a leader hands its group over first.
+        """
+        for group in self.groups:
+            if not group.is_running:
+                continue
+            if group.state == RaftState.LEADER:
+                group.transfer_leadership()
+            group.is_running = False
+            group.state = RaftState.FOLLOWER
+
+    def preferred_leader(self, group):
+        """
+        :return: the id of the voter that should lead the group, the voters take turns
+        """
+        voters = sorted(group.voters())
+        if not voters:
+            return None
+        return voters[group.group_id % len(voters)]
+
+    def balance_leaders(self):
+        while not self.stop_event.wait(self.leader_balance_interval):
+            for group in self.groups:
+                try:
+                    self.hand_over_to_preferred_leader(group)
+                except Exception as e:
+                    logger.error(f"Failed to balance the leader of group {group.group_id}: {e}")
+
+    def hand_over_to_preferred_leader(self, group):
+        """
+        Hand the leadership of a group led by this node over to its preferred
+        leader, if the preferred leader is up to date and has answered within
+        the election timeout.
+
+        :return: the id of the new leader, or None if the leadership stayed
+        """
+        if not group.is_running or group.state != RaftState.LEADER or group.transfer_target is not None:
+            return None
+        preferred_id = self.preferred_leader(group)
+        if preferred_id is None or preferred_id == self.server_id or preferred_id not in group.progress:
+            return None
+        if time.time() - group.last_ack.get(preferred_id, 0) > group.min_val_for_timeout:
+            return None
+        if group.match_index.get(preferred_id) < group.log.get_last_index():
+            return None
+        logger.info(f"Handing group {group.group_id} over to its preferred leader {preferred_id}")
+        return group.transfer_leadership(preferred_id)
@@ -0,0 +1,123 @@
+import threading
+from enum import Enum
+
+
+class ProgressState(Enum):
+    PROBE = 1
+    REPLICATE = 2
+    CATCH_UP = 3
+    SNAPSHOT = 4
+
+
+class Progress:
+    """
+    Replication progress of the leader towards a single follower.
+
+    - PROBE: the leader does not know where the logs match. It sends one batch
+      at a time and waits for the answer before moving next_index.
+    - REPLICATE: the follower is close to the end of the log. New entries are
+      sent as soon as they are available and next_index is advanced optimistically,
+      with up to max_inflight batches waiting for an answer.
+    - CATCH_UP: the follower is far behind. Like REPLICATE, but every
+      acknowledged batch is followed by the next one right away, instead of
+      waiting for the next heartbeat.
+    - SNAPSHOT: the entries the follower needs have been compacted, a snapshot
+      is being sent and nothing else is sent until it is acknowledged.
+
+    Every batch is tagged with the epoch in which it was sent. The epoch changes
+    when the leader falls back to PROBE, so that answers to batches sent before
+    that do not move next_index again.
+    """
+
+    def __init__(self, next_index, max_inflight):
+        self.state = ProgressState.PROBE
+        self.next_index = next_index
+        self.match_index = 0
+        self.inflight = 0
+        self.max_inflight = max_inflight
+        self.epoch = 0
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f"Progress(state={self.state.name}, next_index={self.next_index}, " \
+               f"match_index={self.match_index}, inflight={self.inflight})"
+
+    def can_send(self):
+        if self.state == ProgressState.SNAPSHOT:
+            return False
+        if self.state == ProgressState.PROBE:
+            return self.inflight == 0
+        return self.inflight < self.max_inflight
+
+    def sent(self, number_of_entries):
+        """
+        Record a batch that is about to be sent.
+
+        :param number_of_entries: number of entries in the batch
+        :return: the epoch the batch belongs to
+        """
+        self.inflight += 1
+        if self.state != ProgressState.PROBE:
+            self.next_index += number_of_entries
+        return self.epoch
+
+    def acked(self, epoch, last_index, leader_last_index, catch_up_threshold):
+        """
+        Record a batch accepted by the follower.
+
+        :param epoch: the epoch the batch was sent in
+        :param last_index: index of the last entry of the batch, or the previous index of an empty batch
+        :param leader_last_index: the last index of the leader's log
+        :param catch_up_threshold: number of entries behind the leader after which the follower is catching up
+        """
+        self.match_index = max(self.match_index, last_index)
+        if epoch != self.epoch:
+            return
+        self.inflight = max(0, self.inflight - 1)
+        self.next_index = max(self.next_index, last_index + 1)
+        if leader_last_index - self.match_index > catch_up_threshold:
+            self.state = ProgressState.CATCH_UP
+        else:
+            self.state = ProgressState.REPLICATE
+
+    def rejected(self, epoch, next_index):
+        """
+        Record a batch rejected because the logs did not match.
+
+        :param epoch: the epoch the batch was sent in
+        :param next_index: the index to probe next, or None to step back by one entry
+        """
+        if epoch != self.epoch:
+            return
+        if next_index is not None:
+            self.become_probe(next_index)
+        else:
+            self.become_probe(max(1, self.next_index - 1))
+
+    def unreachable(self, epoch):
+        """
+        Record a batch that got no answer. Entries after the match index may not
+        have arrived, so they are sent again once the follower answers.
+
+        :param epoch: the epoch the batch was sent in
+        """
+        if epoch != self.epoch:
+            return
+        self.become_probe(self.match_index + 1)
+
+    def become_snapshot(self):
+        """
+        Start sending a snapshot.
+
+        :return: the epoch the snapshot belongs to
+        """
+        self.state = ProgressState.SNAPSHOT
+        self.inflight = 1
+        self.epoch += 1
+        return self.epoch
+
+    def become_probe(self, next_index):
+        self.state = ProgressState.PROBE
+        self.next_index = max(1, next_index)
+        self.inflight = 0
+        self.epoch += 1
@@ -1,16 +1,25 @@
 import concurrent.futures
+import functools
 import json
 import random
 import threading
 import time
-import math
 
 from enum import Enum
 
 from src.configuration_reader import IniConfig
 from src.logger import MyLogger
+from src.metrics import LATENCY_BUCKETS, Metrics
+from src.raft_node.applier import Applier
+from src.raft_node.batcher import WriteBatcher
+from src.raft_node.compression import chunk_data
 from src.raft_node.log import Log
-from src.rpc.rpc_client import RPCClient
+from src.raft_node.match_index import MatchIndex
+from src.raft_node.membership import Membership
+from src.raft_node.progress import Progress, ProgressState
+from src.raft_node.replicator import Replicator
+from src.raft_node.staleness import StalenessTracker
+from src.rpc.rpc_client import GroupRPCClient, RPCClient
 from src.rpc.rpc_server import RPCServer
 
 logger = MyLogger()
@@ -23,20 +32,32 @@ class RaftState(Enum):
     LEADER = 3
 
 
+def serialized(function, lock):
+    """
+    :return: the function, called under the lock
+    """
+    @functools.wraps(function)
+    def call(*args):
+        with lock:
+            return function(*args)
+    return call
+
+
 class RaftServer:
-    def __init__(self, server_id, raft_servers, database_uri, database_name, collection_name):
+    def __init__(self, server_id, raft_servers, database_uri, database_name, collection_name, group_id=None):
         self.server_id = server_id
+        # the raft group of the node when the process hosts several groups (see MultiRaft), None otherwise
+        self.group_id = group_id
         self.raft_servers = raft_servers
         self.hostname = raft_servers[server_id]['host']
         self.port = raft_servers[server_id]['port']
-        self.voted_for = None
         self.state = RaftState.FOLLOWER
         self.min_val_for_timeout = float(raft_config.get_property('raft', 'min_val_for_timeout'))
         self.max_val_for_timeout = float(raft_config.get_property('raft', 'max_val_for_timeout'))
         self.election_timeout = random.uniform(self.min_val_for_timeout, self.max_val_for_timeout)
         self.start = time.time()
-        self.log = Log(database_uri, database_name, collection_name, self.server_id)
-        self.current_term = self.log.get_last_term()
+        # the log also persists the current term and vote of the node, see the properties below
+        self.log = Log(database_uri, database_name, collection_name, self.server_id, group_id=group_id or 0)
         if self.log.is_empty():
             self.commit_index = 0
         else:
@@ -51,79 +72,381 @@ class RaftServer:
         self.clients = {}
         self.start = time.time()
         self.heartbeat_interval = float(raft_config.get_property('raft', 'heartbeat_interval'))
+        self.rpc_timeout = float(raft_config.get_property('raft', 'rpc_timeout'))
+        self.pre_vote = raft_config.get_property('raft', 'pre_vote').lower() == 'true'
+        self.last_leader_contact = 0
+        # how far the state machine is behind the commit index of the leader, for bounded staleness reads
+        self.staleness = StalenessTracker()
+        self.read_mode = raft_config.get_property('raft', 'read_mode')
+        self.wait_for_index_timeout = float(raft_config.get_property('raft', 'wait_for_index_timeout'))
+        # time at which each follower was last sent a request that it acknowledged
+        self.last_ack = {}
+        self.applied_condition = threading.Condition()
+        self.ack_condition = threading.Condition()
+        self.max_entries_per_message = int(raft_config.get_property('raft', 'max_entries_per_message'))
+        self.max_bytes_per_message = int(raft_config.get_property('raft', 'max_bytes_per_message'))
+        self.max_inflight_messages = int(raft_config.get_property('raft', 'max_inflight_messages'))
+        self.catch_up_threshold = int(raft_config.get_property('raft', 'catch_up_threshold'))
+        # the configurations of the log, oldest first, the last one is in use
+        self.memberships = self.load_memberships(Membership(raft_servers))
+        self.membership = self.memberships[-1]
+        self.raft_servers = self.membership.servers
+        # members that receive the log but neither vote nor count toward the commit quorum,
+        # a learner is promoted once it is within learner_promotion_lag entries of the leader
+        self.learners = set(self.membership.learners)
+        self.learner_promotion_lag = int(raft_config.get_property('raft', 'learner_promotion_lag'))
+        self.snapshot_threshold_entries = int(raft_config.get_property('raft', 'snapshot_threshold_entries'))
+        self.snapshot_threshold_bytes = int(raft_config.get_property('raft', 'snapshot_threshold_bytes'))
+        # chunks of the snapshot being received from the leader
+        self.incoming_snapshot = []
+        self.metrics = Metrics()
+        # the compression ratio and CPU time of the log are recorded with the metrics of the node
+        self.log.compressor.metrics = self.metrics
+        self.write_batcher = WriteBatcher(self.append_client_batch,
+                                          int(raft_config.get_property('raft', 'max_batch_size')),
+                                          float(raft_config.get_property('raft', 'batch_linger')),
+                                          self.metrics)
+        # applies the committed entries to the state machine on its own thread
+        self.applier = Applier(self.log, self.log.apply_to_state_machine, self.entries_applied,
+                               int(raft_config.get_property('raft', 'apply_batch_size')),
+                               int(raft_config.get_property('raft', 'apply_queue_size')),
+                               float(raft_config.get_property('raft', 'apply_retry_interval')),
+                               float(raft_config.get_property('raft', 'apply_max_retry_interval')),
+                               self.metrics)
+        # entries committed before a restart may not have reached the state machine
+        self.applier.submit(self.commit_index)
         self.leader_id = None
         # create thread pool for handling client requests in parallel
         self.heartbeat_executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.raft_servers) - 1)
-        self.append_entries_executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.raft_servers) - 1)
+        # one single threaded lane per follower, so that its batches arrive in order
+        self.replication_lanes = {}
+        # one long-lived replication loop per follower, woken up by appends, commits and acks
+        self.replicators = {}
+
+        # the heartbeats of the groups of a MultiRaft are sent together, one request per node pair,
+        # the replicators then only send entries and the heartbeats asked for explicitly
+        self.coalesce_heartbeats = False
 
-        # create leader next index for each follower
-        self.next_index = {}
-        self.set_next_index()
-        self.follower_append_index = {}
+        # create leader replication progress for each follower
+        self.progress = {}
+        self.reset_progress()
+        # highest index stored on each voter, and when the leader appended the entries not yet applied
+        self.match_index = MatchIndex([])
+        self.append_times = {}
+        # the follower the leadership is being handed over to, writes are refused meanwhile
+        self.transfer_target = None
         self.is_running = False
         self.lock = threading.Lock()
+        # the RPC handlers that change the state of the node run one at a time, see rpc_functions
+        self.rpc_lock = threading.Lock()
 
     def __str__(self):
         return f"Server(id={self.server_id}, state={self.state.name}, " \
                f"term={self.current_term}, votedFor={self.voted_for})"
 
+    @property
+    def current_term(self):
+        return self.log.current_term
+
+    @current_term.setter
+    def current_term(self, term):
+        # a new term starts without a vote
+        self.log.save_hard_state(term, self.log.voted_for if term == self.log.current_term else None)
+
+    @property
+    def voted_for(self):
+        return self.log.voted_for
+
+    @voted_for.setter
+    def voted_for(self, candidate_id):
+        self.log.save_hard_state(self.log.current_term, candidate_id)
+
     def run(self):
         logger.info(f"Starting RaftNode with ID: {self.server_id}")
 
         if self.first_boot:
-            self.rpc_server = RPCServer(host=self.hostname, port=self.port)
-            threading.Thread(target=self.rpc_server.run).start()
-            self.rpc_server.register_function(self.append_entries_rpc, 'append_entries')
-            self.rpc_server.register_function(self.request_vote_rpc, 'request_vote')
-            self.clients = {_server_id: RPCClient(host=server['host'], port=server['port'])
+            if self.group_id is None:
+                # the groups of a MultiRaft share the RPC server of their process
+                self.rpc_server = RPCServer(host=self.hostname, port=self.port, threaded=True)
+                threading.Thread(target=self.rpc_server.run).start()
+                for name, function in self.rpc_functions().items():
+                    self.rpc_server.register_function(function, name)
+            self.clients = {_server_id: self.create_client(server)
                             for _server_id, server in self.raft_servers.items() if _server_id != self.server_id}
+            for _server_id in self.clients.keys():
+                self.start_replicator(_server_id)
+            self.applier.start()
             self.first_boot = False
         self.transition_to_follower()
         while self.is_running:
+            self.take_snapshot_if_needed()
             if self.state == RaftState.FOLLOWER:
-                if time.time() - self.start > self.election_timeout:
+                if time.time() - self.start > self.election_timeout and self.server_id in self.voters():
                     self.transition_to_candidate()
                     self.reset_election_timeout()
             elif self.state == RaftState.LEADER:
-                threading.Thread(target=self.send_append_entries_to_servers_multicast).start()
+                if not self.check_quorum():
+                    logger.info(f"Leader has not heard from a majority within the election timeout. Stepping down.")
+                    self.transition_to_follower()
+                    continue
                 self.reset_election_timeout()
             time.sleep(self.heartbeat_interval)
 
-    def add_node(self, server_id, host, port):
-        self.raft_servers[server_id] = {'host': host, 'port': port}
-        self.clients[server_id] = RPCClient(host=host, port=port)
-        self.next_index[server_id] = 1
-        self.follower_append_index[server_id] = 0
+    def rpc_functions(self):
+        """
+        The RPC server is threaded. The handlers that check and update the term,
+        the vote or the log run under rpc_lock, one at a time, so that two
+        candidates cannot both be granted the vote of a term and the appends of
+        two leaders cannot interleave. read_index waits for a round of
+        acknowledgements and wait_for_index for the state machine, they run
+        outside of it so that the node keeps answering the leader meanwhile.
+
+        :return: the RPC handlers of the node by name
+        """
+        return {
+            'append_entries': serialized(self.append_entries_rpc, self.rpc_lock),
+            'request_vote': serialized(self.request_vote_rpc, self.rpc_lock),
+            'pre_vote': serialized(self.pre_vote_rpc, self.rpc_lock),
+            'install_snapshot': serialized(self.install_snapshot_rpc, self.rpc_lock),
+            'timeout_now': serialized(self.timeout_now_rpc, self.rpc_lock),
+            'read_index': self.read_index_rpc,
+            'wait_for_index': self.wait_for_index,
+        }
+
+    def create_client(self, info):
+        """
+        :param info: the address of a member, 'host' and the raft 'port'
+        :return: the RPC client of the member, which calls the methods of this group on a MultiRaft
+        """
+        client = RPCClient(host=info['host'], port=info['port'], timeout=self.rpc_timeout)
+        if self.group_id is None:
+            return client
+        return GroupRPCClient(client, self.group_id)
+
+    def load_memberships(self, initial):
+        """
+        Find the configurations of the log: the one of the snapshot, or the
+        initial one if there is none, followed by the configuration entries.
+
+        :param initial: the configuration the cluster was started with
+        :return: the configurations, oldest first
+        """
+        if self.log.snapshot_membership is not None:
+            initial = Membership.from_dict(self.log.snapshot_membership, self.log.snapshot_index)
+        memberships = [initial]
+        for entry in self.log.find_entries(Membership.COMMAND_PREFIX):
+            membership = Membership.from_command(entry.command, entry.index)
+            if membership is not None:
+                memberships.append(membership)
+        return memberships
+
+    def membership_at(self, index):
+        """
+        :return: the configuration in use once the log is applied up to index
+        """
+        for membership in reversed(self.memberships):
+            if membership.version <= index:
+                return membership
+        return self.memberships[0]
+
+    def track_membership(self, index, command):
+        """
+        Called for every entry appended to the log. A configuration entry takes
+        effect as soon as it is in the log, before it is committed.
+        """
+        membership = Membership.from_command(command, index)
+        if membership is not None:
+            self.memberships.append(membership)
+            self.apply_membership(membership)
+
+    def truncate_membership(self, index):
+        """
+        Called when the entries after index are deleted, the configuration
+        falls back to the latest one that is still in the log.
+        """
+        if self.memberships[-1].version <= index:
+            return
+        while len(self.memberships) > 1 and self.memberships[-1].version > index:
+            self.memberships.pop()
+        self.apply_membership(self.memberships[-1])
+
+    def compact_memberships(self, index, membership=None):
+        """
+        Drop the configurations replaced by a snapshot up to index.
+
+        :param index: the last index covered by the snapshot
+        :param membership: the configuration stored with a snapshot received from the leader
+        """
+        if membership is None:
+            membership = self.membership_at(index)
+        # the configuration entries after index are gone if the snapshot replaced the whole log
+        later = [_membership for _membership in self.memberships
+                 if _membership.version > index and self.log.get_entry(_membership.version) is not None]
+        self.memberships = [membership] + later
+        if self.memberships[-1] is not self.membership:
+            self.apply_membership(self.memberships[-1])
+
+    def apply_membership(self, membership):
+        """
+        Switch to a configuration: connect to the new members, disconnect the
+        removed ones and, on the leader, count the new voters toward the quorum.
 
-    def update_node(self, server_id, host, port):
-        del self.raft_servers[server_id]
-        del self.clients[server_id]
-        self.raft_servers[server_id] = {'host': host, 'port': port}
-        self.clients[server_id] = RPCClient(host=host, port=port)
+        :param membership: the configuration to use
+        """
+        previous = self.membership
+        self.membership = membership
+        self.raft_servers = membership.servers
+        self.learners = set(membership.learners)
+        for _server_id, info in membership.servers.items():
+            if _server_id != self.server_id and previous.servers.get(_server_id) != info:
+                self.connect_peer(_server_id, info)
+        for _server_id in previous.servers.keys():
+            if _server_id != self.server_id and _server_id not in membership.servers:
+                self.disconnect_peer(_server_id)
+        if self.state == RaftState.LEADER:
+            voters = membership.voters()
+            for _server_id in previous.voters():
+                if _server_id not in voters:
+                    self.match_index.remove(_server_id)
+            for _server_id in voters:
+                if _server_id == self.server_id:
+                    self.match_index.add(_server_id, self.log.get_persisted_index())
+                elif _server_id in self.progress:
+                    self.match_index.add(_server_id, self.progress[_server_id].match_index)
+        logger.info(f"RaftNode {self.server_id} switched to {membership}")
+
+    def connect_peer(self, server_id, info):
+        self.clients[server_id] = self.create_client(info)
+        if server_id not in self.progress:
+            self.progress[server_id] = Progress(self.log.get_last_index() + 1, self.max_inflight_messages)
+        if not self.first_boot:
+            self.start_replicator(server_id)
+
+    def disconnect_peer(self, server_id):
+        self.clients.pop(server_id, None)
+        self.progress.pop(server_id, None)
+        if server_id in self.replicators:
+            self.replicators.pop(server_id).stop()
+        if server_id in self.replication_lanes:
+            self.replication_lanes.pop(server_id).shutdown(wait=False, cancel_futures=True)
+
+    def change_membership(self, membership):
+        """
+        Append a configuration entry on the leader. The leader only starts a
+        change once it has committed an entry of its term and the previous
+        change is committed, so two uncommitted configurations never coexist.
+
+        AsyncRaftServer calls it on its event loop, where self.lock does nothing:
+        the checks and the append must not be separated by an await.
+
+        :param membership: the new configuration, it may differ from the current one by a single member
+        :return: the index of the configuration entry
+        :raises RuntimeError: if this node is not the leader or a change is still in progress
+        """
+        with self.lock:
+            if self.state != RaftState.LEADER:
+                raise RuntimeError(f"RaftNode {self.server_id} is not the leader")
+            if self.log.get_term(self.commit_index) != self.current_term or \
+                    self.membership.version > self.commit_index:
+                raise RuntimeError("A membership change is still in progress")
+            command = membership.to_command()
+            term = self.current_term
+            # written in the background like the client batches, nothing waits for the storage under the lock
+            index = self.log.append_entries(term, [command],
+                                            on_durable=lambda last_index: self.entries_stored(term, last_index))[0]
+            self.track_membership(index, command)
+        self.record_appended([index], stored=False)
+        self.replicate()
+        return index
+
+    def add_node(self, server_id, host, port, learner=True, **addresses):
+        """
+        Add a member to the cluster. By default it joins as a learner, so that
+        replaying the log to it does not hold back the commit index, and it is
+        promoted to voter once it has caught up.
+
+        :param server_id: id of the new member
+        :param host: host of its raft RPC server
+        :param port: port of its raft RPC server
+        :param learner: False to count the member toward the quorums right away
+        :param addresses: the other ports of the node, api_port and kv_port
+        :return: the index of the configuration entry
+        """
+        if server_id in self.membership.servers:
+            raise RuntimeError(f"RaftNode {server_id} is already a member")
+        return self.change_membership(
+            self.membership.with_member(server_id, {'host': host, 'port': port, **addresses}, learner))
+
+    def update_node(self, server_id, host, port, **addresses):
+        if server_id not in self.membership.servers:
+            raise RuntimeError(f"RaftNode {server_id} is not a member")
+        return self.change_membership(self.membership.with_member(
+            server_id, {'host': host, 'port': port, **addresses}, server_id in self.membership.learners))
 
     def delete_node(self, server_id):
-        if server_id in self.raft_servers:
-            del self.raft_servers[server_id]
-        if server_id in self.clients:
-            del self.clients[server_id]
-        if server_id in self.next_index:
-            del self.next_index[server_id]
-        if server_id in self.follower_append_index:
-            del self.follower_append_index[server_id]
+        if server_id not in self.membership.servers:
+            raise RuntimeError(f"RaftNode {server_id} is not a member")
+        return self.change_membership(self.membership.without_member(server_id))
+
+    def voters(self):
+        """
+        :return: the ids of the members that vote and count toward the commit quorum, this node included
+        """
+        return self.membership.voters()
+
+    def record_match(self, _server_id, index):
+        """
+        Record that a member stores the log up to index. A learner close enough
+        to the end of the log is promoted to voter.
+
+        :param _server_id: id of the member
+        :param index: the highest index acknowledged by the member
+        """
+        if _server_id not in self.learners:
+            self.match_index.update(_server_id, index)
+        elif self.log.get_last_index() - index <= self.learner_promotion_lag:
+            self.promote_learner(_server_id, index)
+
+    def promote_learner(self, _server_id, index):
+        try:
+            self.change_membership(self.membership.promoted(_server_id))
+        except RuntimeError as e:
+            # retried on one of the next acks of the learner
+            logger.info(f"RaftNode {_server_id} is not promoted yet: {e}")
+            return
+        self.metrics.counter('learner_promotions').inc()
+        logger.info(f"RaftNode {_server_id} caught up to index {index} and was promoted to voter")
+
+    def step_down_if_removed(self):
+        """
+        A leader that removed itself from the cluster manages the cluster until
+        the change is committed and then steps down.
+        """
+        if self.server_id not in self.membership.servers and self.commit_index >= self.membership.version:
+            logger.info(f"RaftNode {self.server_id} is no longer a member of the cluster. Stepping down.")
+            self.transition_to_follower()
 
     def transition_to_follower(self, verbose=True):
         if verbose:
             logger.info(f"Transitioning to follower state. Server state: {self}")
         self.state = RaftState.FOLLOWER
-        self.voted_for = None
         self.start = time.time()
+        self.append_times = {}
 
-    def transition_to_candidate(self, verbose=True):
-        self.state = RaftState.CANDIDATE
-        if verbose:
-            logger.info(f"Transitioning to candidate state. Server state: {self}")
-        self.current_term += 1
-        self.voted_for = self.server_id
+    def transition_to_candidate(self, verbose=True, skip_pre_vote=False):
+        if self.pre_vote and not skip_pre_vote and not self.run_pre_vote():
+            logger.info(f"Pre-vote failed, staying follower. Server state: {self}")
+            self.metrics.counter('elections_avoided').inc()
+            self.election_timeout = random.uniform(self.min_val_for_timeout, self.max_val_for_timeout)
+            self.reset_election_timeout()
+            return
+        # the new term and the vote for itself are persisted together, not in between the check and the
+        # write of a request_vote
+        with self.rpc_lock:
+            self.state = RaftState.CANDIDATE
+            if verbose:
+                logger.info(f"Transitioning to candidate state. Server state: {self}")
+            self.log.save_hard_state(self.current_term + 1, self.server_id)
         self.start = time.time()
         self.election_timeout = random.uniform(self.min_val_for_timeout, self.max_val_for_timeout)
         self.reset_election_timeout()
@@ -136,104 +459,700 @@ class RaftServer:
         self.leader_id = self.server_id
         self.start = time.time()
         self.election_timeout = random.uniform(1, 2)
-        self.set_next_index()
+        self.reset_progress()
         self.commit_index = self.log.get_last_commit_index()
-        self.follower_append_index = {_server_id: self.commit_index for _server_id in self.clients.keys()}
-        if self.log.is_empty():
-            self.commit_index = 0
-        else:
-            self.commit_index = self.log.get_last_commit_index()
-        self.follower_append_index = {_server_id: 0 if self.commit_index is None else self.commit_index
-                                      for _server_id in self.clients.keys()}
+        self.match_index = MatchIndex(self.voters(), self.commit_index)
+        self.append_times = {}
+        self.last_ack = {_server_id: self.start for _server_id in self.clients.keys()}
+        # Commit a no-op entry of the new term, so that reads can be served once it is committed
+        self.record_appended([self.log.append_entry(self.current_term, json.dumps({'commands': [], 'rep_ids': []}))])
+        self.commit_leader_entries()
+        self.replicate(heartbeat=True)
+
+    def reset_progress(self):
+        self.progress = {_server_id: Progress(self.log.get_last_index() + 1, self.max_inflight_messages)
+                         for _server_id in self.raft_servers.keys() if _server_id != self.server_id}
+
+    def start_replicator(self, _server_id):
+        if _server_id in self.replicators:
+            return
+        replicator = Replicator(_server_id, self.replicate_to,
+                                None if self.coalesce_heartbeats else self.heartbeat_interval)
+        self.replicators[_server_id] = replicator
+        replicator.start()
+
+    def replicate(self, heartbeat=False):
+        """
+        Wake up the replicators of all followers.
+
+        :param heartbeat: make every replicator send a request, even if there is nothing new
+        """
+        for replicator in list(self.replicators.values()):
+            replicator.notify(heartbeat)
+
+    def replicate_to(self, _server_id, heartbeat):
+        """
+        Called by the replicator of a server when it is woken up.
 
-    def set_next_index(self):
-        self.next_index = {_server_id: self.log.get_last_index() + 1 for _server_id in self.raft_servers.keys() if
-                           _server_id != self.server_id}
+        :param _server_id: id of the server to replicate to
+        :param heartbeat: whether a heartbeat is due
+        :return: the futures of the dispatched batches
+        """
+        if not self.is_running or self.state != RaftState.LEADER:
+            return []
+        return self.send_append_entries(_server_id, heartbeat)
+
+    def coalesced_heartbeat(self, _server_id):
+        """
+        Build the heartbeat of this group for a follower, to be sent together with
+        the heartbeats of the other groups of the process. The heartbeat is an empty
+        append_entries after the match index of the follower, which the follower
+        holds, so it never fails the log check and takes no part in the flow control
+        of the replicator.
+
+        :param _server_id: id of the follower
+        :return: the append_entries arguments after the leader id, or None if no heartbeat is due
+        """
+        if not self.is_running or self.state != RaftState.LEADER:
+            return None
+        progress = self.progress.get(_server_id)
+        if progress is None:
+            return None
+        prev_log_index = progress.match_index
+        prev_log_term = self.log.get_term(prev_log_index)
+        if prev_log_term is None:
+            # compacted, the replicator sends the snapshot
+            return None
+        return [self.current_term, self.server_id, prev_log_index, prev_log_term, self.commit_index]
+
+    def coalesced_heartbeat_acked(self, _server_id, sent_at, response):
+        """
+        Handle the answer of a follower to a coalesced heartbeat of this group.
+
+        :param _server_id: id of the follower
+        :param sent_at: time at which the heartbeat was sent
+        :param response: the append_entries response, None if the follower is unreachable
+        """
+        if response is None or self.state != RaftState.LEADER:
+            return
+        if response['term'] > self.current_term:
+            logger.info(f"Node {_server_id} has higher term")
+            self.transition_to_follower()
+            return
+        with self.ack_condition:
+            self.last_ack[_server_id] = max(self.last_ack.get(_server_id, 0), sent_at)
+            self.ack_condition.notify_all()
+        progress = self.progress.get(_server_id)
+        replicator = self.replicators.get(_server_id)
+        if progress is not None and replicator is not None and progress.match_index < self.log.get_last_index():
+            # the periodic heartbeats no longer wake the replicator up, retry a follower that is behind
+            replicator.notify()
 
-    def send_append_entries(self, _server_id):
-        # write detailed documentation
+    def send_append_entries(self, _server_id, heartbeat=True):
         """
-        Send append entries to a single server. The entries to be sent in
-        each server are determined by the next_index
+        Send append entries to a single server. The entries to be sent are
+        determined by the replication progress of the server: batches bounded by
+        max_entries_per_message and max_bytes_per_message are queued on the
+        server's replication lane until the window of in-flight batches is full.
+        The lane sends them back to back and in order, without waiting for the
+        next heartbeat. If there is nothing new to send, nothing in flight and
+        a heartbeat is due, an empty batch is sent as the heartbeat. If the
+        entries the server needs have been compacted, the snapshot is sent instead.
+
         :param _server_id: id of the server to send append entries to
+        :param heartbeat: send an empty batch if there is nothing else to send
+        :return: the futures of the dispatched batches
+        """
+        progress = self.progress.get(_server_id)
+        futures = []
+        if progress is None:
+            return futures
+        if _server_id not in self.replication_lanes:
+            self.replication_lanes[_server_id] = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        lane = self.replication_lanes[_server_id]
+        with progress.lock:
+            if progress.state != ProgressState.SNAPSHOT and progress.next_index <= self.log.snapshot_index:
+                epoch = progress.become_snapshot()
+                futures.append(lane.submit(self.send_snapshot, _server_id, epoch))
+                return futures
+            while progress.can_send():
+                entries = self.log.get_entries(progress.next_index, self.max_entries_per_message,
+                                               self.max_bytes_per_message)
+                if not entries and (not heartbeat or progress.inflight > 0 or futures):
+                    break
+                prev_log_index = progress.next_index - 1
+                epoch = progress.sent(len(entries))
+                futures.append(lane.submit(self.send_append_entries_batch, _server_id, prev_log_index, entries, epoch))
+                if not entries:
+                    break
+        return futures
+
+    def conflict_next_index(self, response):
+        """
+        Find the next index to probe after a rejected append_entries. If the
+        follower reported the term of its conflicting entry and this log holds
+        that term, probing continues after the last entry of the term, otherwise
+        it continues at the first index of the conflicting term on the follower.
+
+        :param response: the append_entries response of the follower
+        :return: the next index to probe, or None if the response holds no hint
+        """
+        conflict_term = response.get('conflict_term')
+        conflict_index = response.get('conflict_index')
+        if conflict_term is not None:
+            last_index = self.log.last_index_of_term(conflict_term)
+            if last_index is not None:
+                return last_index + 1
+        if conflict_index is not None:
+            return conflict_index
+        if response['index'] >= 0:
+            return response['index'] + 1
+        return None
+
+    def send_append_entries_batch(self, _server_id, prev_log_index, entries, epoch):
+        """
+        Send one batch of entries to a single server and update its replication
+        progress with the answer.
+
+        :param _server_id: id of the server to send the batch to
+        :param prev_log_index: index of the entry preceding the batch
+        :param entries: the entries of the batch
+        :param epoch: the progress epoch in which the batch was sent
         """
-        entries = self.log.get_all_entries_from_index(self.next_index[_server_id])
+        progress = self.progress.get(_server_id)
+        if progress is None or progress.epoch != epoch:
+            # the leader fell back to probing after this batch was queued
+            return
         try:
-            prev_log_index = self.next_index[_server_id] - 1
-            prev_log_entry = self.log.get_entry(self.next_index[_server_id] - 1)
-            if prev_log_entry is not None:
-                prev_log_term = prev_log_entry.term
-            else:
-                prev_log_term = self.current_term
+            prev_log_term = self.log.get_term(prev_log_index)
+            if prev_log_term is None:
+                # the log was compacted after this batch was queued, the snapshot is sent instead
+                with progress.lock:
+                    progress.become_probe(prev_log_index + 1)
+                return
 
+            sent_at = time.time()
             response = self.clients[_server_id].call(
                 'append_entries', self.current_term, self.server_id, prev_log_index,
-                prev_log_term, entries, self.commit_index
+                prev_log_term, self.log.compressor.pack_entries(entries), self.commit_index
             )
+            if response is not None and response['term'] <= self.current_term:
+                # Any answer at our term acknowledges this node as the leader
+                with self.ack_condition:
+                    self.last_ack[_server_id] = max(self.last_ack.get(_server_id, 0), sent_at)
+                    self.ack_condition.notify_all()
+
+            with progress.lock:
+                if response is None:
+                    logger.info(f"Node {_server_id} is unreachable")
+                    progress.unreachable(epoch)
+                elif response['term'] > self.current_term:
+                    logger.info(f"Node {_server_id} has higher term")
+                    self.transition_to_follower()
+                    return
+                elif response['success']:
+                    progress.acked(epoch, prev_log_index + len(entries), self.log.get_last_index(),
+                                   self.catch_up_threshold)
+                    logger.info(f"Node {_server_id} accepted append entries up to "
+                                f"{prev_log_index + len(entries)}. {progress}")
+                else:
+                    next_index = self.conflict_next_index(response)
+                    logger.info(f"Node {_server_id} rejected append entries with index {response['index']}. "
+                                f"Probing from {next_index}")
+                    progress.rejected(epoch, next_index)
             if response is None:
-                logger.info(f"Node {_server_id} is unreachable")
-            elif response['term'] > self.current_term:
-                logger.info(f"Node {_server_id} has higher term")
-                self.transition_to_follower()
-            elif response['success']:
-                logger.info(f"Node {_server_id} accepted append entries")
-                self.next_index[_server_id] = len(self.log.entries) + 1
-                logger.info(f"Node {_server_id} next index: {self.next_index[_server_id]}")
-                if len(entries) > 0:
-                    self.follower_append_index[_server_id] = entries[-1].index
-            elif response['index'] != -1:
-                logger.info(f"Node {_server_id} rejected append entries with index {response['index']}"
-                            f"setting next index to {response['index']} + 1")
-                logger.info(f"Node {_server_id} has missing entries")
-                self.next_index[_server_id] = response['index'] + 1
+                return
+            if response['success']:
+                # outside of the progress lock, promoting a learner replicates to it
+                self.record_match(_server_id, prev_log_index + len(entries))
+                self.commit_leader_entries()
+            # The window has room again or the next probe is known, keep streaming
+            # to the follower instead of waiting for the next heartbeat
+            replicator = self.replicators.get(_server_id)
+            if replicator is not None:
+                replicator.notify()
+            elif progress.state == ProgressState.CATCH_UP:
+                self.send_append_entries(_server_id, heartbeat=False)
         except Exception as e:
             logger.error(f"An error occurred: {e}")
 
+    def send_snapshot(self, _server_id, epoch):
+        """
+        Send the snapshot to a server whose next entry has been compacted. The
+        snapshot is sent in chunks of snapshot_chunk_size.
+
+        :param _server_id: id of the server to send the snapshot to
+        :param epoch: the progress epoch in which the snapshot was sent
+        """
+        progress = self.progress.get(_server_id)
+        if progress is None:
+            return
+        try:
+            with self.lock:
+                last_included_index = self.log.snapshot_index
+                last_included_term = self.log.snapshot_term
+                data = self.log.load_snapshot()
+                membership = self.membership_at(last_included_index).to_dict()
+            logger.info(f"Sending snapshot up to index {last_included_index} to node {_server_id}")
+            data = self.log.compressor.pack_snapshot(data)
+            chunk_size = self.log.snapshot_chunk_size
+            offset = 0
+            response = None
+            while True:
+                chunk = self.log.compressor.snapshot_chunk(data, offset, chunk_size)
+                done = offset + chunk_size >= len(data)
+                response = self.clients[_server_id].call(
+                    'install_snapshot', self.current_term, self.server_id, last_included_index,
+                    last_included_term, offset, chunk, done, membership
+                )
+                if response is None or not response['success'] or done:
+                    break
+                offset += chunk_size
+
+            with progress.lock:
+                if response is None:
+                    logger.info(f"Node {_server_id} is unreachable")
+                    progress.unreachable(epoch)
+                elif response['term'] > self.current_term:
+                    logger.info(f"Node {_server_id} has higher term")
+                    self.transition_to_follower()
+                elif response['success']:
+                    progress.acked(epoch, last_included_index, self.log.get_last_index(), self.catch_up_threshold)
+                    logger.info(f"Node {_server_id} installed snapshot up to {last_included_index}. {progress}")
+                else:
+                    progress.unreachable(epoch)
+            if response is not None and response['success']:
+                self.record_match(_server_id, last_included_index)
+        except Exception as e:
+            logger.error(f"An error occurred: {e}")
+
+    def take_snapshot_if_needed(self):
+        """
+        Snapshot the state machine and compact the log, once the entries applied
+        since the last snapshot exceed snapshot_threshold_entries or
+        snapshot_threshold_bytes.
+        """
+        if not self.snapshot_due():
+            return
+        # the applier is paused, so the state machine stays at last_applied, but replication goes on
+        with self.applier.lock:
+            last_included_index = self.log.last_applied
+            last_included_term = self.log.get_term(last_included_index)
+            data = self.log.create_state_machine_snapshot()
+            if data is None or last_included_term is None:
+                logger.error(f"Could not get a snapshot of the state machine at index {last_included_index}")
+                return
+            # write the queued entries before taking the lock, compact then only waits for the newer ones
+            self.log.writer.flush()
+            with self.lock:
+                self.log.compact(last_included_index, last_included_term, data,
+                                 self.membership_at(last_included_index).to_dict())
+                self.compact_memberships(last_included_index)
+
+    def snapshot_due(self):
+        """
+        :return: whether the entries applied since the last snapshot exceed the snapshot thresholds
+        """
+        return self.log.last_applied - self.log.snapshot_index >= self.snapshot_threshold_entries or \
+            self.log.applied_bytes_since_snapshot >= self.snapshot_threshold_bytes
+
+    def record_appended(self, indexes, stored=True):
+        """
+        Record entries appended by the leader: their commit latency is measured from now.
+
+        :param indexes: the indexes of the appended entries
+        :param stored: whether the leader stored them already, otherwise it counts
+            itself toward their quorum once they are, see record_stored
+        """
+        now = time.monotonic()
+        for index in indexes:
+            self.append_times[index] = now
+        if stored and indexes:
+            self.match_index.update(self.server_id, indexes[-1])
+
+    def entries_stored(self, term, index):
+        """
+        Called by the log writer on its thread once the leader stored its own
+        entries up to index, see record_stored.
+        """
+        self.record_stored(term, index)
+
+    def record_stored(self, term, index):
+        """
+        Record that the leader stored its own entries up to index, while they were
+        being replicated: only then does it count itself toward their quorum
+        (Raft thesis §10.2.1).
+
+        :param term: the term the entries were appended in
+        :param index: the index of the last stored entry
+        """
+        if self.state != RaftState.LEADER or self.current_term != term:
+            return
+        if self.match_index.update(self.server_id, index):
+            self.commit_leader_entries()
+
+    def record_committed(self, commit_index, new_commit_index):
+        now = time.monotonic()
+        histogram = self.metrics.histogram('commit_latency', LATENCY_BUCKETS)
+        for index in range(commit_index + 1, new_commit_index + 1):
+            appended_at = self.append_times.get(index)
+            if appended_at is not None:
+                histogram.observe(now - appended_at)
+
+    def record_applied(self, index):
+        appended_at = self.append_times.pop(index, None)
+        if appended_at is not None:
+            self.metrics.histogram('apply_latency', LATENCY_BUCKETS).observe(time.monotonic() - appended_at)
+
+    def entries_applied(self, first_index, last_index):
+        """
+        Called by the applier on its thread after it applied a batch of entries, see record_applied_batch.
+        """
+        self.record_applied_batch(first_index, last_index)
+
+    def record_applied_batch(self, first_index, last_index):
+        """
+        Record the apply latency of a batch of entries and wake up the readers waiting for them.
+
+        :param first_index: index of the first entry of the batch
+        :param last_index: index of the last entry of the batch
+        """
+        for index in range(first_index, last_index + 1):
+            self.record_applied(index)
+        self.notify_applied()
+
     def commit_leader_entries(self):
+        """
+        Advance the commit index to the quorum index and hand the newly
+        committed entries to the applier. Called when an ack or an append moves
+        a match index.
+        """
         with self.lock:
             new_commit_index = self.calculate_committed_index()
+            if new_commit_index <= self.commit_index:
+                return
+            self.record_committed(self.commit_index, new_commit_index)
             self.log.commit_entries(self.commit_index, new_commit_index)
             self.commit_index = new_commit_index
+        self.applier.submit(new_commit_index)
+        self.step_down_if_removed()
+        # let the followers know about the new commit index without waiting for the next heartbeat
+        self.replicate()
+
+    def notify_applied(self):
+        """
+        Wake up the readers that wait for the state machine to catch up.
+        """
+        with self.applied_condition:
+            self.applied_condition.notify_all()
+
+    def wait_for_applied(self, index, timeout):
+        """
+        Block until the entry with the given index has been applied to the
+        state machine of this node.
+
+        :param index: the log index to wait for
+        :param timeout: maximum time to wait in seconds
+        :return: True if the entry was applied in time, False otherwise
+        """
+        with self.applied_condition:
+            return self.applied_condition.wait_for(lambda: self.log.last_applied >= index, timeout)
+
+    def wait_for_index(self, index, term, timeout=None):
+        """
+        Long-poll until the write that was assigned the given index and term is
+        committed and applied to the state machine of this node. A write is
+        acknowledged to the client only then.
+
+        Registered as the wait_for_index RPC. It does not take rpc_lock: the
+        appends it waits for are served on the other threads of the RPC server
+        meanwhile (see rpc_functions).
+
+        :param index: the log index returned for the write
+        :param term: the term returned for the write
+        :param timeout: maximum time to wait in seconds, defaults to wait_for_index_timeout
+        :return: the status of the write, see write_status
+        """
+        if timeout is None:
+            timeout = self.wait_for_index_timeout
+        applied = self.wait_for_applied(index, timeout)
+        return self.write_status(index, term, applied)
+
+    def write_status(self, index, term, applied):
+        """
+        :param index: the log index of the write
+        :param term: the term of the write
+        :param applied: whether the entry with the index has been applied
+        :return: 'APPLIED' if the write has been applied, 'LOST' if another entry was
+                 committed at its index, 'TIMEOUT' if it is not applied yet, or 'UNKNOWN'
+                 if it was compacted into a snapshot before it could be checked
+        """
+        entry_term = self.log.get_term(index)
+        if entry_term is not None and entry_term != term and index <= self.commit_index:
+            return 'LOST'
+        if not applied:
+            return 'TIMEOUT'
+        if entry_term is None:
+            return 'UNKNOWN'
+        return 'APPLIED'
+
+    def quorum_contact_time(self):
+        """
+        The latest time at which a majority of the cluster, the leader included,
+        had acknowledged this node as leader.
+
+        :return: a timestamp as returned by time.time()
+        """
+        voters = self.voters()
+        majority = len(voters) // 2 + 1
+        ack_times = sorted([time.time()] + [self.last_ack.get(_server_id, 0) for _server_id in voters
+                                            if _server_id != self.server_id], reverse=True)
+        return ack_times[majority - 1]
+
+    def check_quorum(self):
+        """
+        A leader that has not heard from a majority within the maximum election
+        timeout may already have been replaced, so it has to step down.
+
+        :return: True if the leader is still in contact with a majority
+        """
+        return time.time() - self.quorum_contact_time() <= self.max_val_for_timeout
+
+    def has_lease(self):
+        """
+        The followers do not start an election before the minimum election timeout
+        has passed since they last heard from the leader. Since the acknowledgement
+        times are taken when the requests were sent, no other leader can exist until
+        that timeout has passed since the quorum contact time.
+
+        :return: True if the leader lease is still valid
+        """
+        return time.time() - self.quorum_contact_time() < self.min_val_for_timeout
+
+    def read_index(self):
+        """
+        Compute a read index on the leader (Raft thesis §6.4). The current commit
+        index is recorded and the leadership of the node is confirmed either with
+        the leader lease or with one round of heartbeats acknowledged by a majority.
+
+        :return: the read index, or None if the leadership could not be confirmed
+        """
+        with self.lock:
+            if self.state != RaftState.LEADER:
+                return None
+            if self.log.get_term(self.commit_index) != self.current_term:
+                # The leader does not know the latest commit index until an entry of its term is committed
+                return None
+            read_index = self.commit_index
+        if self.read_mode == 'lease' and self.has_lease():
+            return read_index
+        round_started = time.time()
+        self.replicate(heartbeat=True)
+        with self.ack_condition:
+            confirmed = self.ack_condition.wait_for(lambda: self.quorum_contact_time() >= round_started,
+                                                    self.max_val_for_timeout)
+        if confirmed and self.state == RaftState.LEADER:
+            return read_index
+        return None
+
+    def read_staleness(self):
+        """
+        How far the local state machine may be behind the leader. A leader is fresh
+        while its lease holds and it has applied its commit index, a follower is as
+        fresh as the last leader commit index it has applied (see StalenessTracker).
+
+        :return: the number of committed entries not applied locally and the seconds
+            since the local state machine was known to be up to date, infinite if unknown
+        """
+        now = time.time()
+        if self.state == RaftState.LEADER:
+            entries = max(0, self.commit_index - self.log.last_applied)
+            seconds = 0.0 if self.has_lease() else now - self.quorum_contact_time()
+            if entries > 0:
+                seconds = float('inf')
+        else:
+            entries, seconds = self.staleness.staleness(self.log.last_applied, now)
+        if entries != float('inf'):
+            self.metrics.gauge('staleness_entries').set(entries)
+        return entries, seconds
+
+    def wait_for_bounded_staleness(self, max_entries=None, max_seconds=None, timeout=None):
+        """
+        Wait until the local state machine is within the staleness bounds, so
+        that a read can be served locally without contacting the leader.
+
+        :param max_entries: maximum number of committed entries not applied locally, None for no bound
+        :param max_seconds: maximum seconds since the state machine was up to date, None for no bound
+        :param timeout: maximum time to wait, defaults to the heartbeat interval
+        :return: the staleness, as returned by read_staleness, or None if the bounds were not met in time
+        """
+        if timeout is None:
+            timeout = self.heartbeat_interval
+        deadline = time.monotonic() + timeout
+        while True:
+            entries, seconds = self.read_staleness()
+            if (max_entries is None or entries <= max_entries) and (max_seconds is None or seconds <= max_seconds):
+                return entries, seconds
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # fresher once more entries are applied or the leader is heard from again
+            with self.applied_condition:
+                self.applied_condition.wait(min(remaining, self.heartbeat_interval / 2))
+
+    def read_barrier(self, read_index=None, timeout=None):
+        """
+        Wait until a linearizable read can be served from the local state machine.
+        If no read index is given, it is obtained from the leader first.
+
+        :param read_index: a read index obtained earlier, possibly by another node
+        :param timeout: maximum time to wait for the local apply, defaults to the election timeout
+        :return: the read index once it has been applied locally, or None on failure
+        """
+        if timeout is None:
+            timeout = self.max_val_for_timeout
+        if read_index is None:
+            if self.state == RaftState.LEADER:
+                read_index = self.read_index()
+            elif self.leader_id is not None and self.leader_id in self.clients:
+                response = self.clients[self.leader_id].call('read_index')
+                if response is not None and response['success']:
+                    read_index = response['read_index']
+        if read_index is None:
+            return None
+        if not self.wait_for_applied(read_index, timeout):
+            return None
+        return read_index
 
     def send_append_entries_to_servers_multicast(self):
         """
         This method sends append entries to all servers in the cluster. It is called by the leader.
         """
         logger.info(f"Starting append entries multicast.")
-        self.commit_leader_entries()
         futures = {self.heartbeat_executor.submit(self.send_append_entries, _server_id)
                    for _server_id in self.raft_servers.keys() if _server_id != self.server_id}
+        batches = []
         for future in concurrent.futures.as_completed(futures):
-            future.result()
+            batches.extend(future.result())
+        concurrent.futures.wait(batches)
         logger.info(f"Append entries multicast finished.")
         return
 
     def calculate_committed_index(self):
         """
-        This method calculates the committed index for the leader.
+        The leader commits the highest index stored on a majority, but only once
+        that entry is from its current term; the entries of earlier terms are
+        committed with it (§5.4.2).
+
         :return: the committed index
         """
-        def get_top_servers(server_dict, x):
-            sorted_servers = sorted(server_dict.items(), key=lambda item: item[1], reverse=True)
-            return dict(sorted_servers[:x])
-
-        number_of_nodes_needed = math.ceil((len(self.raft_servers)) / 2)
-        top_servers = get_top_servers(self.follower_append_index, number_of_nodes_needed)
-
-        # the following index has been at least replicated by majority of the nodes
-        return min(top_servers.values())
+        quorum_index = self.match_index.quorum_index()
+        if quorum_index <= self.commit_index or self.log.get_term(quorum_index) != self.current_term:
+            return self.commit_index
+        return quorum_index
 
     def append_entries_to_leader(self, _append_entries):
         """
         This method is called when the leader receives an append entries
-        request from the client or another raft node.
+        request from the client or another raft node. Concurrent requests
+        are merged into one batch by the write batcher.
 
         :param _append_entries:
+        :return: the log index and the term assigned to the entry, or False if this node is not the leader
         """
-        if self.state != RaftState.LEADER:
+        if self.state != RaftState.LEADER or self.transfer_target is not None:
+            return False
+        if Membership.COMMAND_KEY in _append_entries:
+            # configuration entries are only appended by change_membership
+            return False
+        if self.applier.is_full():
+            # the state machine is too far behind, let it catch up before taking more writes
+            self.metrics.counter('apply_backpressure').inc()
+            logger.info(f"Refusing the write, {self.applier.pending()} committed entries are not applied yet")
+            return False
+        try:
+            return self.write_batcher.submit(json.dumps(_append_entries)).result()
+        except Exception as e:
+            logger.error(f"Failed to append entries: {e}")
             return False
-        self.log.append_entry(self.current_term, json.dumps(_append_entries))
-        return True
+
+    def append_client_batch(self, commands):
+        """
+        Flush function of the write batcher.
+
+        :param commands: the commands of the batch
+        :return: the log index and the term assigned to each command
+        """
+        term = self.current_term
+        return [(index, term) for index in self.append_batch_to_leader(commands, term)]
+
+    def append_batch_to_leader(self, commands, term=None):
+        """
+        Append a batch of client commands and start one replication round for
+        all of them. The batch is persisted with one write, in parallel with its
+        replication, so a write waits for the slower of the local write and the
+        followers instead of one after the other.
+
+        :param commands: the commands of the batch
+        :param term: the term the batch must be appended in, by default the current term
+        :return: the log indexes assigned to the commands
+        """
+        if term is None:
+            term = self.current_term
+        if self.state != RaftState.LEADER or self.transfer_target is not None or self.current_term != term:
+            raise RuntimeError(f"RaftNode {self.server_id} is no longer the leader")
+        indexes = self.log.append_entries(term, commands,
+                                          on_durable=lambda last_index: self.entries_stored(term, last_index))
+        self.record_appended(indexes, stored=False)
+        self.replicate()
+        return indexes
+
+    def transfer_leadership(self, target_id=None, timeout=None):
+        """
+        Hand the leadership over to another node without waiting for an election
+        timeout (Raft thesis §3.10). New writes are refused during the transfer,
+        the target is brought up to date and then told with timeout_now to start
+        an election at once. Stopping a leader this way costs about one round
+        trip of unavailability instead of an election timeout.
+
+        :param target_id: id of the node to hand over to, by default the most up-to-date follower
+        :param timeout: maximum time to bring the target up to date, defaults to the maximum election timeout
+        :return: the id of the target if it started an election, None otherwise
+        """
+        if self.state != RaftState.LEADER or not self.progress:
+            return None
+        if target_id is None:
+            target_id = max(self.progress.keys(), key=lambda _server_id: self.match_index.get(_server_id, -1))
+        if target_id not in self.progress or target_id in self.learners:
+            logger.info(f"Cannot transfer leadership to node {target_id}, it is not a voter")
+            return None
+        if timeout is None:
+            timeout = self.max_val_for_timeout
+        logger.info(f"Transferring leadership from RaftNode {self.server_id} to RaftNode {target_id}")
+        self.transfer_target = target_id
+        try:
+            deadline = time.time() + timeout
+            while self.match_index.get(target_id) < self.log.get_last_index():
+                if self.state != RaftState.LEADER or time.time() > deadline:
+                    logger.info(f"RaftNode {target_id} could not be brought up to date, transfer aborted")
+                    return None
+                replicator = self.replicators.get(target_id)
+                if replicator is not None:
+                    replicator.notify()
+                    with self.ack_condition:
+                        self.ack_condition.wait(self.heartbeat_interval)
+                else:
+                    concurrent.futures.wait(self.send_append_entries(target_id, heartbeat=False))
+            response = self.clients[target_id].call('timeout_now', self.current_term, self.server_id)
+            if response is None or not response['success']:
+                logger.info(f"RaftNode {target_id} refused timeout_now, transfer aborted")
+                return None
+            self.metrics.counter('leadership_transfers').inc()
+            # the target starts an election in a newer term, this node will vote for it
+            self.transition_to_follower()
+            return target_id
+        finally:
+            self.transfer_target = None
 
     def reset_election_timeout(self):
         self.start = time.time()
@@ -241,57 +1160,104 @@ class RaftServer:
     def start_election(self):
         """
         This method is called when a node times out and starts an election.
-        It sends a vote request to all other nodes in the cluster.
+        It sends a vote request to all other nodes in the cluster in parallel
+        and decides as soon as the outcome is known.
         """
         if self.election_in_progress:
             return
         self.election_in_progress = True
         logger.info(f"Starting election for RaftNode {self}")
+        try:
+            election_term = self.current_term
+            won = self.collect_votes('request_vote', election_term)
+            if self.state != RaftState.CANDIDATE or self.current_term != election_term:
+                # A leader was discovered or a newer term started while the votes were in flight
+                return
+            if won:
+                self.transition_to_leader()
+            else:
+                self.transition_to_follower()
+        finally:
+            self.election_in_progress = False
+
+    def run_pre_vote(self):
+        """
+        Ask the other nodes whether they would vote for this node in the next
+        term, without incrementing the current term. A node that was cut off
+        from the cluster fails this round and so cannot force a healthy leader
+        to step down when it rejoins.
+
+        :return: True if a majority would grant the vote, False otherwise
+        """
+        logger.info(f"Starting pre-vote for RaftNode {self}")
+        pre_vote_started = time.time()
+        won = self.collect_votes('pre_vote', self.current_term + 1)
+        # A leader may have contacted this node while the pre-vote was in flight
+        return won and self.last_leader_contact < pre_vote_started
+
+    def collect_votes(self, method, term):
+        """
+        Send a vote request to all other nodes in parallel and count the replies
+        as they arrive. The method returns as soon as a majority has granted the
+        vote, a higher term is discovered or a majority can no longer be reached.
+        Replies that arrive after the decision are ignored and requests that have
+        not started yet are cancelled.
+
+        :param method: name of the remote vote method to call
+        :param term: the term the vote is requested for
+        :return: True if a majority of the cluster granted the vote, False otherwise
+        """
+        voters = self.voters()
+        peers = [_server_id for _server_id in voters if _server_id != self.server_id]
+        majority = len(voters) // 2 + 1
         votes_received = 1
-        unreachable_nodes = 0
-        total_servers = len(self.raft_servers)
-
-        # TODO: Send vote requests in parallel
-        for _server_id in self.raft_servers.keys():
-            if _server_id != self.server_id:
-                last_log_index = self.log.get_last_index()
-                if self.log.is_empty():
-                    last_log_term = self.current_term
-                else:
-                    last_log_term = self.log.get_entry(last_log_index).term
-                response = self.clients[_server_id].call(
-                    'request_vote', self.server_id, self.current_term,
-                    last_log_index, last_log_term
-                )
+        votes_pending = len(peers)
+        if votes_received >= majority:
+            return True
+
+        last_log_index = self.log.get_last_index()
+        last_log_term = self.log.get_last_term()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(peers))
+        futures = {executor.submit(self.clients[_server_id].call, method, self.server_id, term,
+                                   last_log_index, last_log_term): _server_id
+                   for _server_id in peers}
+        try:
+            for future in concurrent.futures.as_completed(futures, timeout=self.election_timeout):
+                _server_id = futures[future]
+                votes_pending -= 1
+                response = future.result()
                 if response is None:
                     logger.info(f"Node {_server_id} is unreachable")
-                    unreachable_nodes += 1
-                    if unreachable_nodes > total_servers / 3:
-                        self.election_in_progress = False
-                        self.transition_to_follower()
-                        return
-                    continue
-                elif response['term'] > self.current_term:
+                elif response['term'] > term:
                     logger.info(f"RaftNode {self.server_id} discovered higher term. Transitioning to follower")
-                    self.election_in_progress = False
+                    self.current_term = response['term']
                     self.transition_to_follower()
-                    return
+                    return False
                 elif response['vote_granted']:
                     logger.info(f"Vote granted to RaftNode {self.server_id} by RaftNode {_server_id}")
                     votes_received += 1
-                    if votes_received > total_servers / 2:
-                        self.election_in_progress = False
-                        self.transition_to_leader()
-                        return
+                    if votes_received >= majority:
+                        return True
                 else:
-                    self.election_in_progress = False
-                    self.transition_to_follower()
-                    return
+                    logger.info(f"Vote denied to RaftNode {self.server_id} by RaftNode {_server_id}")
+                if votes_received + votes_pending < majority:
+                    logger.info(f"RaftNode {self.server_id} can no longer reach a majority")
+                    return False
+        except concurrent.futures.TimeoutError:
+            logger.info(f"Vote requests of RaftNode {self.server_id} timed out "
+                        f"with {votes_received} of {majority} votes")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return False
 
     def append_entries_rpc(self, term, leader_id, prev_log_index, prev_log_term, entries, leader_commit):
         """
         Invoked by leader to replicate log entries; also used as heartbeat.
 
+        Called under rpc_lock here, and by AsyncRaftServer on its event loop with
+        no lock at all: it must run to completion without awaiting or waiting on
+        another thread, or other handlers would see the log half updated.
+
         Args:
             term: leader's term
             leader_id: so follower can redirect clients
@@ -301,9 +1267,12 @@ class RaftServer:
             leader_commit: leader's commit_index
         """
 
+        # a large batch is sent compressed
+        entries = self.log.compressor.unpack_entries(entries)
         logger.info(f"Received append_entries from RaftNode {leader_id} to "
                     f"RaftNode {self.server_id} with entries {entries}")
-        response = {'term': self.current_term, 'success': True, 'index': -1}
+        response = {'term': self.current_term, 'success': True, 'index': -1,
+                    'conflict_term': None, 'conflict_index': None}
 
         if term < self.current_term:
             logger.info(f"Received outdated term, responding to RaftNode {leader_id} "
@@ -313,6 +1282,8 @@ class RaftServer:
 
         if term >= self.current_term:
             self.reset_election_timeout()
+            self.last_leader_contact = time.time()
+            self.staleness.leader_contact(leader_commit, self.last_leader_contact)
             self.leader_id = leader_id
             self.current_term = term
 
@@ -339,40 +1310,72 @@ class RaftServer:
                 f"Last log index: {self.log.get_last_index()}"
             )
             response['index'] = self.log.get_last_index()
+            response['conflict_index'] = self.log.get_last_index() + 1
             response['success'] = False
             return response
 
         # 2. Reply false if log doesn't contain an entry at prevLogIndex whose term matches prevLogTerm (§5.3)
+        #    Entries covered by the snapshot are committed and always match.
+        local_prev_log_term = self.log.get_term(prev_log_index)
+        if prev_log_index > 0 and local_prev_log_term is not None and local_prev_log_term != prev_log_term:
+            logger.info(
+                f"RaftNode {self.server_id} rejected append_entries from RaftNode {leader_id} "
+                f"due to conflicting entries. Previous log index: {prev_log_index}, "
+                f"Previous log term: {prev_log_term}, "
+                f"Log term at index {prev_log_index}: {local_prev_log_term}"
+                f"Conflicting entries will be deleted."
+            )
+            # Let the leader skip the whole conflicting term instead of one entry per round
+            response['conflict_term'] = local_prev_log_term
+            response['conflict_index'] = self.log.first_index_of_term(local_prev_log_term) or prev_log_index
+            self.log.delete_entries_after(prev_log_index - 1)
+            self.truncate_membership(prev_log_index - 1)
+            response['index'] = self.log.get_last_index()
+            response['success'] = False
+            return response
+
         # 3. If an existing entry conflicts with a new one (same index but different terms), delete the
         #    existing entry and all that follow it (§5.3)
-        if self.log.get_entry(prev_log_index) is not None:
-            if prev_log_term != self.log.get_entry(prev_log_index).term:
-                logger.info(
-                    f"RaftNode {self.server_id} rejected append_entries from RaftNode {leader_id} "
-                    f"due to conflicting entries. Previous log index: {prev_log_index}, "
-                    f"Previous log term: {prev_log_term}, "
-                    f"Log term at index {prev_log_index}: {self.log.get_entry(prev_log_index).term}"
-                    f"Conflicting entries will be deleted."
-                )
-                self.log.delete_entries_after(prev_log_index)
-                response['success'] = False
-                # return response
-
         # 4. Append any new entries not already in the log
         if entries is not None:
+            new_entries = []
             for entry in entries:
-                self.log.append_entry(entry['term'], entry['command'])
+                if entry['index'] <= self.log.snapshot_index:
+                    continue
+                if new_entries:
+                    # the entries after a new one are new as well
+                    new_entries.append(entry)
+                    continue
+                existing_term = self.log.get_term(entry['index'])
+                if existing_term is not None:
+                    if existing_term == entry['term']:
+                        # already received, e.g. a batch that was sent again
+                        continue
+                    self.log.delete_entries_after(entry['index'] - 1)
+                    self.truncate_membership(entry['index'] - 1)
+                new_entries.append(entry)
+            # the new entries are stored with a single write
+            for index, entry in zip(self.log.append_replicated_entries(new_entries), new_entries):
+                self.track_membership(index, entry['command'])
 
         # 5. If leaderCommit > commitIndex, set commitIndex = min(leaderCommit, index of last new entry)
-        if leader_commit > self.commit_index:
-            self.log.commit_entries(self.commit_index, leader_commit)
-            self.commit_index = min(leader_commit, self.log.get_last_index())
+        # Entries after the last new one have not been checked against the leader's log yet
+        last_new_index = prev_log_index + (len(entries) if entries is not None else 0)
+        new_commit_index = min(leader_commit, last_new_index)
+        if new_commit_index > self.commit_index:
+            with self.lock:
+                self.log.commit_entries(self.commit_index, new_commit_index)
+                self.commit_index = new_commit_index
+            self.applier.submit(new_commit_index)
         return response
 
     def request_vote_rpc(self, candidate_id, term, last_log_index, last_log_term):
         """
         Invoked by candidates to gather votes.
 
+        Also called by AsyncRaftServer on its event loop without a lock: the vote
+        check and the vote write must stay in one step, with no await between them.
+
         Args:
             candidate_id: candidate requesting vote
             term: candidate's term
@@ -388,7 +1391,8 @@ class RaftServer:
 
         if term > self.current_term:
             self.current_term = term
-            self.voted_for = None
+            if self.state != RaftState.FOLLOWER:
+                self.transition_to_follower()
             self.reset_election_timeout()
 
         if (self.voted_for is None or self.voted_for == candidate_id) and self.log.is_up_to_date(last_log_index,
@@ -400,3 +1404,165 @@ class RaftServer:
         else:
             logger.info(f"Vote denied to RaftNode {candidate_id} by RaftNode {self.server_id}")
             return response
+
+    def pre_vote_rpc(self, candidate_id, term, last_log_index, last_log_term):
+        """
+        Invoked by a node before it starts an election, to find out whether it
+        could win. Unlike request_vote, it does not change the state of the
+        receiver. The vote is granted only if the receiver has not heard from a
+        leader within the minimum election timeout and the candidate's log is at
+        least as up-to-date as its own.
+
+        Also called by AsyncRaftServer on its event loop without a lock, so it
+        must not await or wait on another thread.
+
+        Args:
+            candidate_id: candidate requesting the pre-vote
+            term: the term the candidate would use for the election (its current term + 1)
+            last_log_index: index of candidate's last log entry
+            last_log_term: term of candidate's last log entry
+        """
+        logger.info(f"RPC call received: pre_vote for RaftNode {self.server_id}")
+        response = {'term': self.current_term, 'vote_granted': False}
+        if term < self.current_term:
+            logger.info(
+                f"Received outdated term, responding to RaftNode {candidate_id} with current term {self.current_term}")
+            return response
+
+        leader_is_alive = self.state == RaftState.LEADER or \
+            time.time() - self.last_leader_contact < self.min_val_for_timeout
+        if not leader_is_alive and self.log.is_up_to_date(last_log_index, last_log_term):
+            response['vote_granted'] = True
+            logger.info(f"Pre-vote granted to RaftNode {candidate_id} by RaftNode {self.server_id}")
+        else:
+            logger.info(f"Pre-vote denied to RaftNode {candidate_id} by RaftNode {self.server_id}")
+        return response
+
+    def timeout_now_rpc(self, term, leader_id):
+        """
+        Invoked by the leader to hand its leadership over to this node. The node
+        starts an election right away, without waiting for its election timeout
+        and without a pre-vote round, since the leader agreed to step down.
+
+        Args:
+            term: leader's term
+            leader_id: id of the leader handing over
+        """
+        logger.info(f"RPC call received: timeout_now from RaftNode {leader_id} for RaftNode {self.server_id}")
+        response = {'term': self.current_term, 'success': False}
+        if term < self.current_term or self.state == RaftState.LEADER:
+            return response
+        response['success'] = True
+        threading.Thread(target=self.transition_to_candidate, kwargs={'skip_pre_vote': True}).start()
+        return response
+
+    def read_index_rpc(self):
+        """
+        Invoked by followers that need a read index to serve a linearizable read.
+        It runs outside of rpc_lock: read_index takes self.lock only to read the
+        commit index, then waits for the heartbeat round without holding a lock.
+        """
+        logger.info(f"RPC call received: read_index for RaftNode {self.server_id}")
+        read_index = self.read_index()
+        return {'term': self.current_term, 'success': read_index is not None, 'read_index': read_index}
+
+    def install_snapshot_rpc(self, term, leader_id, last_included_index, last_included_term, offset, data, done,
+                             membership=None):
+        """
+        Invoked by leader to send chunks of a snapshot to a follower that is
+        behind the compaction point of the leader's log.
+
+        Args:
+            term: leader's term
+            leader_id: so follower can redirect clients
+            last_included_index: the snapshot replaces all entries up through and including this index
+            last_included_term: term of last_included_index
+            offset: position of the chunk in the snapshot
+            data: the chunk of the snapshot, starting at offset, binary if the snapshot is compressed
+            done: true if this is the last chunk
+            membership: the configuration at last_included_index
+        """
+        response, snapshot = self.receive_snapshot_chunk(term, leader_id, last_included_index, offset, data, done)
+        if snapshot is None:
+            return response
+        if membership is not None:
+            membership = Membership.from_dict(membership, last_included_index)
+        # the applier is paused, so no entry is applied on top of the snapshot being restored
+        with self.applier.lock, self.lock:
+            if self.install_received_snapshot(last_included_index, last_included_term, snapshot, membership):
+                self.restore_state_machine(snapshot, self.membership_at(last_included_index).to_command())
+        self.snapshot_installed(last_included_index)
+        return response
+
+    def receive_snapshot_chunk(self, term, leader_id, last_included_index, offset, data, done):
+        """
+        Collect a chunk of a snapshot sent with install_snapshot. Also called by
+        AsyncRaftServer on its event loop without a lock, the chunks must be
+        collected in one step.
+
+        :return: the response to the leader, and the whole snapshot once its last chunk arrived,
+            None until then or if the log already covers it
+        """
+        logger.info(f"Received install_snapshot from RaftNode {leader_id} to RaftNode {self.server_id} "
+                    f"up to index {last_included_index}, offset {offset}")
+        response = {'term': self.current_term, 'success': False}
+        if term < self.current_term:
+            return response, None
+        self.reset_election_timeout()
+        self.last_leader_contact = time.time()
+        self.leader_id = leader_id
+        self.current_term = term
+
+        if offset == 0:
+            self.incoming_snapshot = []
+        elif offset != sum(len(chunk) for chunk in self.incoming_snapshot):
+            logger.info(f"Snapshot chunk at offset {offset} is out of order")
+            return response, None
+        self.incoming_snapshot.append(chunk_data(data))
+        response['success'] = True
+        if not done:
+            return response, None
+
+        snapshot = self.log.compressor.unpack_snapshot(self.incoming_snapshot)
+        self.incoming_snapshot = []
+        if last_included_index <= self.log.snapshot_index:
+            return response, None
+        return response, snapshot
+
+    def install_received_snapshot(self, last_included_index, last_included_term, snapshot, membership):
+        """
+        Replace the log up to last_included_index with a snapshot from the leader.
+        Called with the applier paused.
+
+        AsyncRaftServer calls it on its event loop without a lock, after it awaited
+        the applier. The log may have changed during that await, so the caller checks
+        again that the snapshot is newer, and nothing may be awaited from here on
+        until the log and the memberships are consistent again.
+
+        :param membership: the Membership at last_included_index, or None
+        :return: whether the state machine is behind the snapshot and must be restored from it
+        """
+        restore = last_included_index > self.log.last_applied
+        self.log.install_snapshot(last_included_index, last_included_term, snapshot,
+                                  None if membership is None else membership.to_dict())
+        self.compact_memberships(last_included_index, membership)
+        self.commit_index = max(self.commit_index, last_included_index)
+        return restore
+
+    def restore_state_machine(self, snapshot, membership_command):
+        """
+        Restore the state machine from a snapshot. Called with the applier paused.
+
+        :param membership_command: the configuration at the snapshot, as a log command
+        """
+        self.log.restore_state_machine_snapshot(snapshot)
+        # the state machine learns the configuration from the log, which no longer holds it
+        try:
+            self.log.append_to_state_machine(membership_command)
+        except Exception as e:
+            logger.error(f"Failed to send the configuration to the state machine: {e}")
+
+    def snapshot_installed(self, last_included_index):
+        self.applier.submit(self.commit_index)
+        self.notify_applied()
+        logger.info(f"Installed snapshot up to index {last_included_index}")
@@ -0,0 +1,79 @@
+import threading
+import time
+
+from src.logger import MyLogger
+
+logger = MyLogger()
+
+
+class Replicator:
+    """
+    Long-lived replication loop of the leader for one follower. The loop sleeps
+    until it is notified of new entries, a new commit index or an answer of the
+    follower, or until a heartbeat is due, and then asks the send function to
+    build and dispatch the next requests. Notifications that arrive while a
+    request is being built are coalesced into a single wake-up, so at most one
+    request for the follower is built at a time.
+
+    Usage:
+        replicator = Replicator(follower_id, send_function, heartbeat_interval=0.05)
+        replicator.start()
+        replicator.notify()
+
+    Args:
+        server_id: id of the follower to replicate to
+        send_function: called with the follower id and whether a heartbeat is due,
+            returns a truthy value if a request was dispatched
+        heartbeat_interval (float): maximum time in seconds between two requests to the follower,
+            None if the heartbeats are sent by someone else and only the requested ones are sent here
+    """
+
+    def __init__(self, server_id, send_function, heartbeat_interval):
+        self.server_id = server_id
+        self.send_function = send_function
+        self.heartbeat_interval = heartbeat_interval
+        self.wake_event = threading.Event()
+        self.heartbeat_requested = False
+        self.last_sent = 0
+        self.is_running = False
+        self.thread = None
+
+    def start(self):
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.is_running = False
+        self.wake_event.set()
+
+    def notify(self, heartbeat=False):
+        """
+        Wake the loop up to send whatever the follower is missing.
+
+        :param heartbeat: send a request even if there is nothing new to send
+        """
+        if heartbeat:
+            self.heartbeat_requested = True
+        self.wake_event.set()
+
+    def run(self):
+        while self.is_running:
+            timeout = None
+            if self.heartbeat_interval is not None:
+                timeout = max(0.0, self.last_sent + self.heartbeat_interval - time.monotonic())
+            self.wake_event.wait(timeout)
+            self.wake_event.clear()
+            if not self.is_running:
+                break
+            heartbeat = self.heartbeat_requested or (self.heartbeat_interval is not None and
+                                                     time.monotonic() - self.last_sent >= self.heartbeat_interval)
+            self.heartbeat_requested = False
+            try:
+                sent = self.send_function(self.server_id, heartbeat)
+            except Exception as e:
+                logger.error(f"Failed to replicate to node {self.server_id}: {e}")
+                sent = False
+            if sent or heartbeat:
+                # requests still in flight count as the heartbeat, so the next one is due one interval later
+                self.last_sent = time.monotonic()
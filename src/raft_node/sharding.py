@@ -0,0 +1,57 @@
+import zlib
+
+
+def group_collection_name(collection_name, group_id):
+    """
+    :return: the log collection of a raft group, group 0 keeps the collection of a single group node
+    """
+    if group_id == 0:
+        return collection_name
+    return f"{collection_name}_group{group_id}"
+
+
+class KeyRouter:
+    """
+    Maps the top-level keys of the KV store to raft groups. The 32-bit CRC of a
+    top-level key is split into number_of_groups equal hash ranges and the key
+    belongs to the group of the range its hash falls in, so every node and every
+    KV server routes a key to the same group without asking anyone. The nested
+    keys of a top-level key ("key.sub") belong to the group of the top-level key,
+    so all the writes to a key are ordered by the log of one group.
+
+    Changing the number of groups moves keys to other groups, it needs an empty
+    keyspace.
+
+    Usage:
+        router = KeyRouter(number_of_groups=4)
+        group_id = router.group_of('user_42')
+
+    Args:
+        number_of_groups (int): number of raft groups the keyspace is sharded over
+    """
+
+    HASH_SPACE = 2 ** 32
+
+    def __init__(self, number_of_groups):
+        if number_of_groups < 1:
+            raise ValueError(f"At least one raft group is needed, got {number_of_groups}")
+        self.number_of_groups = number_of_groups
+
+    @staticmethod
+    def key_hash(key):
+        top_level_key = key.split('.', 1)[0]
+        return zlib.crc32(top_level_key.encode('utf-8'))
+
+    def group_of(self, key):
+        """
+        :param key: a top-level or nested key
+        :return: the id of the group that owns the key
+        """
+        return self.key_hash(key) * self.number_of_groups // self.HASH_SPACE
+
+    def hash_range(self, group_id):
+        """
+        :return: the first and the last hash, exclusive, of the range of the group
+        """
+        return (group_id * self.HASH_SPACE // self.number_of_groups,
+                (group_id + 1) * self.HASH_SPACE // self.number_of_groups)
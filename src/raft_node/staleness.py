@@ -0,0 +1,58 @@
+import collections
+import threading
+
+
+class StalenessTracker:
+    """
+    Tracks how far the state machine of a follower may be behind the leader,
+    from the commit index the leader sends with every append_entries and the
+    time it was received.
+
+    Each time the leader is heard from, the follower learns that the entries up
+    to the leader commit index were committed by then. The local state machine
+    is fresh as of the last contact whose commit index it has applied, the
+    staleness is the time since then, and the number of entries it lags is the
+    latest leader commit index minus the applied index. Commit indexes never go
+    back, so a new leader that does not know the commit index of the previous
+    one yet does not make the follower look fresher than it is. The staleness
+    does not count the transit time of the request from the leader.
+
+    Usage:
+        tracker = StalenessTracker()
+        tracker.leader_contact(leader_commit, time.time())
+        entries, seconds = tracker.staleness(log.last_applied, time.time())
+
+    Args:
+        max_samples (int): number of contacts kept while the state machine lags,
+            the oldest ones are dropped, which only overestimates the staleness
+    """
+
+    def __init__(self, max_samples=1024):
+        # [leader commit index, time it was last reported], commit indexes increasing
+        self.samples = collections.deque(maxlen=max_samples)
+        self.lock = threading.Lock()
+
+    def leader_contact(self, leader_commit, received_at):
+        with self.lock:
+            if self.samples and self.samples[-1][0] >= leader_commit:
+                self.samples[-1][1] = received_at
+            else:
+                self.samples.append([leader_commit, received_at])
+
+    def staleness(self, last_applied, now):
+        """
+        :param last_applied: the index of the last entry applied to the state machine
+        :param now: the current time
+        :return: the number of entries the state machine lags and the seconds since it was
+            fresh, infinite if no leader was heard from or none of the reported commit
+            indexes has been applied
+        """
+        with self.lock:
+            while len(self.samples) > 1 and self.samples[1][0] <= last_applied:
+                self.samples.popleft()
+            if not self.samples:
+                return float('inf'), float('inf')
+            entries = max(0, self.samples[-1][0] - last_applied)
+            if self.samples[0][0] > last_applied:
+                return entries, float('inf')
+            return entries, max(0.0, now - self.samples[0][1])
@@ -0,0 +1,112 @@
+import asyncio
+import math
+
+from src.logger import MyLogger
+
+logger = MyLogger()
+
+
+class Timer:
+    """
+    A callback scheduled on a TimerWheel.
+    """
+    __slots__ = ('wheel', 'rounds', 'callback', 'args', 'cancelled')
+
+    def __init__(self, wheel, rounds, callback, args):
+        self.wheel = wheel
+        self.rounds = rounds
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self.wheel.active -= 1
+
+
+class TimerWheel:
+    """
+    A hashed timing wheel on an asyncio event loop. Timers are put in the slot
+    of the tick at which they expire, so scheduling and cancelling take constant
+    time however many timers there are, and a single task drives the timers of
+    all raft nodes of a process. A timer fires at the first tick after its
+    deadline, so the precision is one tick. When no timer is pending the task
+    sleeps until the next one is scheduled.
+
+    Usage:
+        wheel = TimerWheel(tick=0.005, slots=512)
+        timer = wheel.schedule(0.15, on_election_timeout)
+        timer.cancel()
+
+    Args:
+        tick (float): duration of one slot in seconds
+        slots (int): number of slots, a timer further away than one turn waits for several turns
+    """
+
+    def __init__(self, tick, slots):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.position = 0
+        self.last_tick_at = None
+        self.active = 0
+        self.task = None
+        self.wakeup = None
+
+    def schedule(self, delay, callback, *args):
+        """
+        Call callback(*args) on the event loop once delay seconds have passed.
+        Must be called from the event loop.
+
+        :param delay: the delay in seconds
+        :param callback: a plain function, it must not block
+        :return: the Timer, which can be cancelled
+        """
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = loop.create_task(self.run())
+        if self.active == 0:
+            # the wheel was idle, restart its clock from now
+            self.last_tick_at = loop.time()
+        ticks = max(1, math.ceil((loop.time() + delay - self.last_tick_at) / self.tick))
+        timer = Timer(self, (ticks - 1) // len(self.slots), callback, args)
+        self.slots[(self.position + ticks) % len(self.slots)].append(timer)
+        self.active += 1
+        self.wakeup.set()
+        return timer
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.active == 0:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            await asyncio.sleep(max(0.0, self.last_tick_at + self.tick - loop.time()))
+            now = loop.time()
+            while self.active > 0 and self.last_tick_at + self.tick <= now:
+                self.last_tick_at += self.tick
+                self.position = (self.position + 1) % len(self.slots)
+                self.expire(self.position)
+
+    def expire(self, position):
+        timers = self.slots[position]
+        self.slots[position] = []
+        for timer in timers:
+            if timer.cancelled:
+                continue
+            if timer.rounds > 0:
+                timer.rounds -= 1
+                self.slots[position].append(timer)
+                continue
+            timer.cancel()
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                logger.error(f"Timer callback {timer.callback.__name__} failed: {e}")
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
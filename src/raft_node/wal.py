@@ -0,0 +1,389 @@
+import json
+import os
+import struct
+import threading
+import zlib
+from array import array
+
+from src.logger import MyLogger
+from src.raft_node.log_storage import LogStorage
+
+logger = MyLogger()
+
+# every record is prefixed with the length and the CRC32 of its payload
+HEADER = struct.Struct('>II')
+# the first byte of a compressed payload, an uncompressed one is a JSON object
+COMPRESSED = b'Z'
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.wal'
+
+
+class CorruptedRecordError(Exception):
+    pass
+
+
+def encode_record(document, compressor=None):
+    payload = json.dumps(document, separators=(',', ':')).encode()
+    compressed = compressor.compress(payload) if compressor is not None else None
+    if compressed is not None:
+        payload = COMPRESSED + compressed
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_payload(payload, compressor=None):
+    if payload[:1] == COMPRESSED:
+        payload = compressor.decompress(payload[1:]) if compressor is not None else zlib.decompress(payload[1:])
+    return json.loads(payload)
+
+
+def read_payloads(file):
+    """
+    Read the payloads of the records of a file. A record that is incomplete or
+    fails its checksum raises a CorruptedRecordError.
+
+    :param file: a file opened for binary reading, at the start of a record
+    :return: a generator of (offset, payload), the offset is the position of the record in the file
+    """
+    while True:
+        offset = file.tell()
+        header = file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            if header:
+                raise CorruptedRecordError(offset)
+            return
+        length, checksum = HEADER.unpack(header)
+        payload = file.read(length)
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            raise CorruptedRecordError(offset)
+        yield offset, payload
+
+
+def read_records(file, compressor=None):
+    """
+    :return: a generator of (offset, document) over the records of a file, see read_payloads
+    """
+    for offset, payload in read_payloads(file):
+        yield offset, decode_payload(payload, compressor)
+
+
+def fsync_directory(path):
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Segment:
+    """
+    A file of the write-ahead log, named after the index of its first entry.
+    The offsets of its records are only indexed once an entry is read from it.
+    """
+
+    def __init__(self, path, first_index, last_index, size):
+        self.path = path
+        self.first_index = first_index
+        self.last_index = last_index
+        self.size = size
+        self.offsets = None
+
+
+class SegmentedWAL(LogStorage):
+    """
+    A log storage on the local disk: an append-only write-ahead log split in
+    segment files, plus small files for the hard state and the snapshot.
+
+    Every entry is a record made of its length, the CRC32 of its payload and the
+    payload, the JSON of the entry, compressed from the threshold of the
+    compressor up. A batch of entries is written with a single
+    write and, with fsync enabled, made durable with a single fsync before
+    append returns. Once the active segment exceeds segment_size, the next
+    append starts a new segment, so that the entries covered by a snapshot are
+    dropped by deleting whole files. Deleting the entries after an index, when
+    the log of a follower conflicts with the leader, deletes the later segments
+    and truncates the file holding the index.
+
+    Opening the log only reads the last segment: a crash may leave a partly
+    written record at its end, which is cut off. The earlier segments are
+    complete, their last index is the one before the next segment. Entries are
+    read by index through the offsets of the records of a segment, indexed on
+    the first read. A bad record there means the disk lost acknowledged data
+    and raises a CorruptedRecordError.
+
+    The hard state (term, vote, commit index and applied index) and the snapshot
+    are each rewritten as a whole: into a temporary file, which then replaces
+    the previous one, so that a crash leaves either the old or the new version.
+
+    :param directory: the directory of the log, created if needed
+    :param segment_size: the size in bytes after which a new segment is started
+    :param fsync: whether writes are flushed to the disk before they return
+    :param compressor: the Compressor of the records, by default they are stored as they are
+    """
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, fsync=True, compressor=None):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.compressor = compressor
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.hard_state = self.read_document('hard_state', {'term': 0, 'voted_for': None, 'commit': 0,
+                                                            'last_applied': None})
+        self.segments = self.recover_segments()
+        self.active = None
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def segment_path(self, first_index):
+        return self.path(f"{SEGMENT_PREFIX}{first_index:020d}{SEGMENT_SUFFIX}")
+
+    def recover_segments(self):
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+        segments = []
+        first_indexes = [int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for name in names]
+        for position, name in enumerate(names):
+            first_index = first_indexes[position]
+            path = self.path(name)
+            if position < len(names) - 1:
+                segments.append(Segment(path, first_index, first_indexes[position + 1] - 1, os.path.getsize(path)))
+                continue
+            last_index = first_index - 1
+            size = 0
+            with open(path, 'rb') as file:
+                try:
+                    for _, entry in read_records(file):
+                        last_index = entry['index']
+                        size = file.tell()
+                except CorruptedRecordError as error:
+                    logger.info(f"Cutting off a partly written record at offset {error.args[0]} of {path}")
+            if last_index < first_index:
+                # started by a crashed append, the next one starts it again
+                os.remove(path)
+                continue
+            if size != os.path.getsize(path):
+                with open(path, 'r+b') as file:
+                    file.truncate(size)
+            segments.append(Segment(path, first_index, last_index, size))
+        return segments
+
+    def read_document(self, name, default):
+        try:
+            with open(self.path(name), 'rb') as file:
+                return next(read_records(file))[1]
+        except (FileNotFoundError, StopIteration):
+            return default
+
+    def write_document(self, name, document):
+        temporary = self.path(f"{name}.tmp")
+        with open(temporary, 'wb') as file:
+            file.write(encode_record(document))
+            if self.fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(temporary, self.path(name))
+        if self.fsync:
+            fsync_directory(self.directory)
+
+    def close(self):
+        with self.lock:
+            if self.active is not None:
+                self.active.close()
+                self.active = None
+
+    def open_active(self, first_index):
+        """
+        Get the file the next entries are appended to, starting a new segment if
+        there is none or the last one is full.
+        """
+        if self.segments and self.segments[-1].size < self.segment_size:
+            if self.active is None:
+                self.active = open(self.segments[-1].path, 'ab')
+            return self.active
+        if self.active is not None:
+            self.active.close()
+        segment = Segment(self.segment_path(first_index), first_index, first_index - 1, 0)
+        self.active = open(segment.path, 'ab')
+        self.segments.append(segment)
+        if self.fsync:
+            fsync_directory(self.directory)
+        return self.active
+
+    def last_index(self):
+        return self.segments[-1].last_index if self.segments else 0
+
+    def index_segment(self, segment):
+        """
+        Get the offsets of the records of a segment, from their headers.
+        """
+        if segment.offsets is None:
+            offsets = array('q')
+            with open(segment.path, 'rb') as file:
+                offset = 0
+                while offset < segment.size:
+                    header = file.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        raise CorruptedRecordError(offset)
+                    offsets.append(offset)
+                    offset += HEADER.size + HEADER.unpack(header)[0]
+                    file.seek(offset)
+            if len(offsets) != segment.last_index - segment.first_index + 1:
+                raise CorruptedRecordError(segment.path)
+            segment.offsets = offsets
+        return segment.offsets
+
+    def load_entries(self, after_index):
+        with self.lock:
+            return self.read_entries_locked(after_index + 1, self.last_index())
+
+    def load_last_entries(self, after_index, count):
+        with self.lock:
+            last_index = self.last_index()
+            return self.read_entries_locked(max(after_index + 1, last_index - count + 1), last_index)
+
+    def read_entries(self, first_index, last_index):
+        with self.lock:
+            return self.read_entries_locked(first_index, last_index)
+
+    def read_entries_locked(self, first_index, last_index):
+        entries = []
+        for segment in self.segments:
+            if segment.last_index < first_index or segment.first_index > last_index:
+                continue
+            start = max(first_index, segment.first_index)
+            with open(segment.path, 'rb') as file:
+                file.seek(self.index_segment(segment)[start - segment.first_index])
+                for _, entry in read_records(file, self.compressor):
+                    if entry['index'] > last_index:
+                        break
+                    entry['is_committed'] = entry['index'] <= self.hard_state['commit']
+                    entries.append(entry)
+        return entries
+
+    def find_entries(self, after_index, command_prefix):
+        # the commands are matched in the records, only the matching and the compressed ones are decoded
+        needle = b'"command":' + json.dumps(command_prefix)[:-1].encode()
+        entries = []
+        with self.lock:
+            for segment in self.segments:
+                if segment.last_index <= after_index:
+                    continue
+                with open(segment.path, 'rb') as file:
+                    for _, payload in read_payloads(file):
+                        if needle in payload or payload[:1] == COMPRESSED:
+                            entry = decode_payload(payload, self.compressor)
+                            if entry['index'] > after_index and entry['command'].startswith(command_prefix):
+                                entry['is_committed'] = entry['index'] <= self.hard_state['commit']
+                                entries.append(entry)
+        return entries
+
+    def append(self, entries):
+        if not entries:
+            return
+        records = [encode_record({'index': entry.index, 'term': entry.term, 'command': entry.command},
+                                 self.compressor)
+                   for entry in entries]
+        data = b''.join(records)
+        with self.lock:
+            file = self.open_active(entries[0].index)
+            file.write(data)
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+            segment = self.segments[-1]
+            if segment.offsets is not None:
+                offset = segment.size
+                for record in records:
+                    segment.offsets.append(offset)
+                    offset += len(record)
+            segment.size += len(data)
+            segment.last_index = entries[-1].index
+
+    def commit(self, commit_index, new_commit_index):
+        with self.lock:
+            if new_commit_index > self.hard_state['commit']:
+                self.hard_state = dict(self.hard_state, commit=new_commit_index)
+                self.write_document('hard_state', self.hard_state)
+
+    def load_commit_index(self):
+        return self.hard_state['commit']
+
+    def truncate_after(self, index):
+        deleted = 0
+        with self.lock:
+            if self.active is not None:
+                self.active.close()
+                self.active = None
+            # the later segments go first, a crash part way leaves a prefix of the log
+            while self.segments and self.segments[-1].first_index > index:
+                segment = self.segments.pop()
+                deleted += segment.last_index - segment.first_index + 1
+                os.remove(segment.path)
+            if self.segments and self.segments[-1].last_index > index:
+                segment = self.segments[-1]
+                offsets = self.index_segment(segment)
+                with open(segment.path, 'r+b') as file:
+                    file.truncate(offsets[index + 1 - segment.first_index])
+                    if self.fsync:
+                        os.fsync(file.fileno())
+                del offsets[index + 1 - segment.first_index:]
+                deleted += segment.last_index - index
+                segment.last_index = index
+                segment.size = os.path.getsize(segment.path)
+            if self.fsync:
+                fsync_directory(self.directory)
+        return deleted
+
+    def discard_through(self, index):
+        deleted = 0
+        with self.lock:
+            # the last segment is kept, the next entries are appended to it
+            while len(self.segments) > 1 and self.segments[0].last_index <= index:
+                segment = self.segments.pop(0)
+                deleted += segment.last_index - segment.first_index + 1
+                os.remove(segment.path)
+            if len(self.segments) == 1 and self.segments[0].last_index <= index:
+                # a new segment must start at the next index
+                if self.active is not None:
+                    self.active.close()
+                    self.active = None
+                segment = self.segments.pop()
+                deleted += segment.last_index - segment.first_index + 1
+                os.remove(segment.path)
+        return deleted
+
+    def load_hard_state(self):
+        return {'term': self.hard_state['term'], 'voted_for': self.hard_state['voted_for']}
+
+    def save_hard_state(self, term, voted_for):
+        with self.lock:
+            self.hard_state = dict(self.hard_state, term=term, voted_for=voted_for)
+            self.write_document('hard_state', self.hard_state)
+
+    def load_last_applied(self):
+        return self.hard_state['last_applied']
+
+    def save_last_applied(self, index):
+        with self.lock:
+            self.hard_state = dict(self.hard_state, last_applied=index)
+            self.write_document('hard_state', self.hard_state)
+
+    def load_snapshot_meta(self):
+        snapshot = self.read_document('snapshot', None)
+        if snapshot is None:
+            return None
+        return {key: snapshot[key] for key in ('last_included_index', 'last_included_term', 'membership')}
+
+    def save_snapshot(self, last_included_index, last_included_term, data, membership=None):
+        self.write_document('snapshot', {'last_included_index': last_included_index,
+                                         'last_included_term': last_included_term,
+                                         'membership': membership, 'data': data})
+
+    def load_snapshot(self, last_included_index):
+        snapshot = self.read_document('snapshot', None)
+        if snapshot is None or snapshot['last_included_index'] != last_included_index:
+            return None
+        return snapshot['data']
@@ -1,4 +1,5 @@
-from .rpc_client import RPCClient
+from .async_rpc import AsyncRPCClient, AsyncRPCServer
+from .rpc_client import GroupRPCClient, RPCClient, group_method
 from .rpc_server import RPCServer
 
-__all__ = ['RPCClient', 'RPCServer']
+__all__ = ['AsyncRPCClient', 'AsyncRPCServer', 'GroupRPCClient', 'RPCClient', 'RPCServer', 'group_method']
@@ -0,0 +1,238 @@
+# async_rpc.py
+import asyncio
+import gzip
+import inspect
+import ssl
+import xmlrpc.client
+
+from src.configuration_reader import IniConfig
+from src.logger import MyLogger
+
+logger = MyLogger()
+raft_config = IniConfig('src/configurations/config.ini')
+
+
+async def read_http_message(reader):
+    """
+    Read one HTTP/1.x message from a stream.
+
+    Args:
+        reader (asyncio.StreamReader): the stream to read from
+
+    Returns:
+        The start line, the headers with lower case names and the body, or None
+        if the connection was closed before a new message started.
+    """
+    start_line = await reader.readline()
+    if not start_line:
+        return None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+    if headers.get('content-encoding') == 'gzip':
+        body = gzip.decompress(body)
+    return start_line.decode('latin-1').rstrip(), headers, body
+
+
+def is_keep_alive(start_line, headers):
+    if headers.get('connection', '').lower() == 'close':
+        return False
+    return 'HTTP/1.1' in start_line
+
+
+class AsyncRPCServer:
+    """
+    An XML-RPC server running on an asyncio event loop. It speaks the same
+    protocol as RPCServer, so the threaded RPCClient can call it and the other
+    way round. Registered functions run on the event loop, they may be plain
+    functions or coroutine functions.
+
+    Usage:
+        server = AsyncRPCServer(host="localhost", port=8000)
+        server.register_function(function1, name="function1")
+        await server.start()
+
+    Args:
+        host (str): Hostname of the server
+        port (int): Port number of the server
+        ssl_context (ssl.SSLContext): Optional server context, by default it is
+            created from the certificate and key of the configuration
+    """
+
+    def __init__(self, host="localhost", port=8000, ssl_context=None):
+        self.host = host
+        self.port = port
+        if ssl_context is None:
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ssl_context.load_cert_chain(certfile=raft_config.get_property('SSL', 'ssl_cert_file'),
+                                        keyfile=raft_config.get_property('SSL', 'ssl_key_file'))
+        self.ssl_context = ssl_context
+        self.functions = {}
+        self.server = None
+
+    def register_function(self, function, name=None):
+        """
+        Register a function with the server.
+
+        Args:
+            function: The function or coroutine function to register
+            name (str): The name to register the function with
+        """
+        self.functions[name or function.__name__] = function
+        logger.info(f"Function '{function.__name__}' registered.")
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                                 ssl=self.ssl_context)
+        logger.info(f"Async RPC server initialized. Listening on {self.host}:{self.port}...")
+
+    async def stop(self):
+        logger.info("Stopping async RPC server...")
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        logger.info("Async RPC server stopped.")
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                message = await read_http_message(reader)
+                if message is None:
+                    break
+                start_line, headers, body = message
+                response = (await self.dispatch(body)).encode('utf-8', 'xmlcharrefreplace')
+                keep_alive = is_keep_alive(start_line, headers)
+                writer.write(b"HTTP/1.1 200 OK\r\n"
+                             b"Content-Type: text/xml\r\n"
+                             b"Content-Length: %d\r\n"
+                             b"Connection: %s\r\n\r\n" % (len(response), b"keep-alive" if keep_alive else b"close"))
+                writer.write(response)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError) as e:
+            logger.info(f"RPC connection closed: {e}")
+        finally:
+            writer.close()
+
+    async def dispatch(self, body):
+        """
+        Decode an XML-RPC call, run the registered function and encode its result.
+
+        Args:
+            body (bytes): the XML-RPC request
+
+        Returns:
+            The XML-RPC response, a fault if the call failed
+        """
+        try:
+            params, method = xmlrpc.client.loads(body)
+            if method not in self.functions:
+                raise Exception(f'method "{method}" is not supported')
+            result = self.functions[method](*params)
+            if inspect.isawaitable(result):
+                result = await result
+            return xmlrpc.client.dumps((result,), methodresponse=True, allow_none=True)
+        except Exception as e:
+            return xmlrpc.client.dumps(xmlrpc.client.Fault(1, f"{type(e)}:{e}"), allow_none=True)
+
+
+class AsyncRPCClient:
+    """
+    An XML-RPC client for asyncio. Connections are kept alive and reused, a call
+    that finds no idle connection opens a new one, so concurrent calls to the
+    same server do not wait for each other.
+
+    Args:
+        host (str): Hostname of the remote server
+        port (int): Port number of the remote server
+        timeout (float): Optional deadline in seconds for each call
+        ssl_context (ssl.SSLContext): Optional client context, by default it
+            verifies the server against the certificate of the configuration
+    """
+
+    def __init__(self, host="localhost", port=8000, timeout=None, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        if ssl_context is None:
+            ssl_context = ssl.create_default_context(cafile=raft_config.get_property('SSL', 'ssl_cert_file'))
+            ssl_context.check_hostname = True
+            ssl_context.verify_mode = ssl.CERT_REQUIRED
+        self.context = ssl_context
+        self.idle_connections = []
+
+    async def call(self, method, *args):
+        """
+        Call a remote method on the server.
+
+        Args:
+            method (str): Name of the remote method to call
+            *args: Variable length argument list for the remote method
+
+        Returns:
+            The return value of the remote method, or None if the call failed
+        """
+        try:
+            if self.timeout is None:
+                return await self.send(method, args)
+            return await asyncio.wait_for(self.send(method, args), self.timeout)
+        except Exception as e:
+            logger.error(f"An error occurred while calling remote method '{method}': {str(e)}")
+
+    async def send(self, method, args):
+        body = xmlrpc.client.dumps(args, method, allow_none=True).encode('utf-8', 'xmlcharrefreplace')
+        request = (b"POST /RPC2 HTTP/1.1\r\n"
+                   b"Host: %s:%d\r\n"
+                   b"Content-Type: text/xml\r\n"
+                   b"Content-Length: %d\r\n\r\n" % (self.host.encode(), self.port, len(body))) + body
+        while True:
+            reused = bool(self.idle_connections)
+            if reused:
+                reader, writer = self.idle_connections.pop()
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.context)
+            try:
+                writer.write(request)
+                await writer.drain()
+                message = await read_http_message(reader)
+            except asyncio.CancelledError:
+                # the call timed out, the connection may hold a late answer and is not reused
+                writer.close()
+                raise
+            except Exception:
+                writer.close()
+                if reused:
+                    # the server may have closed the idle connection, try once more on a new one
+                    continue
+                raise
+            if message is None:
+                writer.close()
+                if reused:
+                    continue
+                raise ConnectionError(f"{self.host}:{self.port} closed the connection")
+            break
+
+        start_line, headers, response = message
+        if is_keep_alive(start_line, headers):
+            self.idle_connections.append((reader, writer))
+        else:
+            writer.close()
+        if start_line.split()[1] != '200':
+            raise xmlrpc.client.ProtocolError(f"{self.host}:{self.port}/RPC2", int(start_line.split()[1]),
+                                              start_line, headers)
+        (result,), _ = xmlrpc.client.loads(response)
+        return result
+
+    async def close(self):
+        while self.idle_connections:
+            _, writer = self.idle_connections.pop()
+            writer.close()
@@ -1,5 +1,6 @@
 # rpc_client.py
 import ssl
+import threading
 import xmlrpc.client
 
 from src.configuration_reader import IniConfig
@@ -9,31 +10,69 @@ logger = MyLogger()
 raft_config = IniConfig('src/configurations/config.ini')
 
 
+class TimeoutSafeTransport(xmlrpc.client.SafeTransport):
+    """
+    An HTTPS transport that puts a deadline on the connection, so that a call
+    to a dead or unresponsive server fails instead of hanging on the socket.
+
+    Args:
+        timeout (float): Socket timeout in seconds
+        context (ssl.SSLContext): SSL context used for the connection
+    """
+    def __init__(self, timeout, context=None):
+        super().__init__(context=context)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+
 class RPCClient:
     """
     A simple RPC client that connects to a remote server and calls a method on it.
+    The client can be shared between threads, every thread uses its own connection.
 
     Args:
         host (str): Hostname of the remote server
         port (int): Port number of the remote server
+        timeout (float): Optional deadline in seconds for each call
 
     Attributes:
         server_proxy (xmlrpc.client.ServerProxy): A proxy object that represents the remote server
     """
-    def __init__(self, host="localhost", port=8000):
+    def __init__(self, host="localhost", port=8000, timeout=None):
         """
         Initialize the RPC client.
 
         Args:
             host (str): Hostname of the remote server
             port (int): Port number of the remote server
+            timeout (float): Optional deadline in seconds for each call. If None the
+                call blocks until the underlying socket gives up.
         """
-        url = f"https://{host}:{port}"  # Use HTTPS instead of HTTP
-        context = ssl.create_default_context(cafile=raft_config.get_property('SSL', 'ssl_cert_file'))
-        context.check_hostname = True
-        context.verify_mode = ssl.CERT_REQUIRED
-        self.server_proxy = xmlrpc.client.ServerProxy(url, allow_none=True, context=context)
-        logger.info(f"RPC client initialized. Connected to {url}.")
+        self.url = f"https://{host}:{port}"  # Use HTTPS instead of HTTP
+        self.timeout = timeout
+        self.context = ssl.create_default_context(cafile=raft_config.get_property('SSL', 'ssl_cert_file'))
+        self.context.check_hostname = True
+        self.context.verify_mode = ssl.CERT_REQUIRED
+        self._local = threading.local()
+        logger.info(f"RPC client initialized. Connected to {self.url}.")
+
+    @property
+    def server_proxy(self):
+        """
+        The proxy of the calling thread. xmlrpc.client.ServerProxy keeps the connection
+        in the transport, so a proxy must not be used by two threads at the same time.
+        """
+        if not hasattr(self._local, 'server_proxy'):
+            if self.timeout is None:
+                self._local.server_proxy = xmlrpc.client.ServerProxy(self.url, allow_none=True, context=self.context)
+            else:
+                transport = TimeoutSafeTransport(self.timeout, context=self.context)
+                self._local.server_proxy = xmlrpc.client.ServerProxy(self.url, allow_none=True, transport=transport)
+        return self._local.server_proxy
 
     def call(self, method, *args):
         """
@@ -56,3 +95,35 @@ class RPCClient:
             logger.error(f"An error occurred while calling remote method '{method}': {str(e)}")
             # Handle the exception or re-raise it if needed.
             # You can also return a specific value to indicate the error condition.
+
+
+def group_method(group_id, method):
+    """
+    Name under which a process hosting several raft groups registers a method of one group.
+
+    Args:
+        group_id (int): Id of the raft group
+        method (str): Name of the method of the group
+
+    Returns:
+        str: The name of the method on the shared RPC server
+    """
+    return f"group{group_id}.{method}"
+
+
+class GroupRPCClient:
+    """
+    An RPC client for one raft group of a remote process that hosts several
+    groups on a single RPC server. The calls go through a client of the
+    process, with the method names of the group.
+
+    Args:
+        client (RPCClient): Client of the remote process
+        group_id (int): Id of the raft group to call
+    """
+    def __init__(self, client, group_id):
+        self.client = client
+        self.group_id = group_id
+
+    def call(self, method, *args):
+        return self.client.call(group_method(self.group_id, method), *args)
@@ -1,4 +1,5 @@
 # rpc_server.py
+import socketserver
 import ssl
 from xmlrpc.server import SimpleXMLRPCServer
 
@@ -9,6 +10,13 @@ logger = MyLogger()
 raft_config = IniConfig('src/configurations/config.ini')
 
 
+class ThreadingXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    """
+    An XML-RPC server that handles every connection on its own thread.
+    """
+    daemon_threads = True
+
+
 class RPCServer:
     """
     A simple XML-RPC server that can register functions and run forever.
@@ -22,20 +30,24 @@ class RPCServer:
     Args:
         host (str): Hostname of the server
         port (int): Port number of the server
+        threaded (bool): Handle the requests concurrently, so that a long-running
+            call does not hold up the others
 
     Attributes:
         server (xmlrpc.server.SimpleXMLRPCServer): An XML-RPC server object
     """
 
-    def __init__(self, host="localhost", port=8000):
+    def __init__(self, host="localhost", port=8000, threaded=False):
         """
         Initialize the RPC server.
 
         Args:
             host (str): Hostname of the server
             port (int): Port number of the server
+            threaded (bool): Handle the requests concurrently, one thread per connection
         """
-        self.server = SimpleXMLRPCServer((host, port), logRequests=False, allow_none=True)
+        server_class = ThreadingXMLRPCServer if threaded else SimpleXMLRPCServer
+        self.server = server_class((host, port), logRequests=False, allow_none=True)
         self.server.socket = ssl.wrap_socket(self.server.socket,
                                              certfile=raft_config.get_property('SSL', 'ssl_cert_file'),
                                              keyfile=raft_config.get_property('SSL', 'ssl_key_file'),
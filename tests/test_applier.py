@@ -0,0 +1,110 @@
+import threading
+import time
+import unittest
+
+from src.metrics import Metrics
+from src.raft_node.applier import Applier
+from test_raft_server import FakeLog
+
+
+class TestApplier(unittest.TestCase):
+    def setUp(self):
+        self.log = FakeLog()
+        self.log.append_entries(1, [f"command{i}" for i in range(10)])
+        self.log.commit_entries(0, 10)
+        self.batches = []
+        self.failures = 0
+        self.metrics = Metrics()
+        self.applier = self.make_applier(self.log.apply_to_state_machine)
+
+    def tearDown(self):
+        self.applier.stop()
+
+    def make_applier(self, apply_function, max_batch_size=4, max_pending=8):
+        return Applier(self.log, apply_function, lambda first, last: self.batches.append((first, last)),
+                       max_batch_size=max_batch_size, max_pending=max_pending, retry_interval=0.01,
+                       max_retry_interval=0.02, metrics=self.metrics)
+
+    def flaky_apply(self, entries):
+        if any(entry.command == 'command5' for entry in entries) and self.failures < 2:
+            self.failures += 1
+            raise ConnectionError('state machine unreachable')
+        return self.log.apply_to_state_machine(entries)
+
+    def apply_two(self, entries):
+        return self.log.apply_to_state_machine(entries[:2])
+
+    def test_applies_in_order_in_batches_and_saves_the_watermark(self):
+        self.applier.submit(10)
+
+        self.assertTrue(self.applier.apply_committed())
+
+        self.assertEqual(self.log.applied, [f"command{i}" for i in range(10)])
+        self.assertEqual(self.batches, [(1, 4), (5, 8), (9, 10)])
+        self.assertEqual(self.log.load_last_applied(), 10)
+        self.assertEqual(self.metrics.to_dict()['apply_queue_length'], 0)
+
+    def test_submit_only_applies_committed_entries(self):
+        self.applier.submit(3)
+        self.applier.apply_committed()
+
+        self.assertEqual(self.log.last_applied, 3)
+        self.assertEqual(self.applier.pending(), 0)
+
+    def test_failed_batch_is_retried_and_the_next_ones_wait(self):
+        self.applier = self.make_applier(self.flaky_apply)
+        self.applier.submit(10)
+
+        self.assertFalse(self.applier.apply_committed())
+        self.assertEqual(self.log.last_applied, 4)
+        self.assertEqual(self.log.load_last_applied(), 4)
+
+        self.applier.start()
+        deadline = time.monotonic() + 1
+        while self.log.last_applied < 10 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(self.log.applied, [f"command{i}" for i in range(10)])
+        self.assertEqual(self.metrics.to_dict()['apply_retries'], 2)
+
+    def test_partially_applied_batch_resumes_after_the_applied_index(self):
+        self.applier = self.make_applier(self.apply_two)
+        self.applier.submit(10)
+
+        while not self.applier.apply_committed():
+            pass
+
+        self.assertEqual(self.log.applied, [f"command{i}" for i in range(10)])
+        self.assertEqual(self.batches, [(1, 2), (3, 4), (5, 6), (7, 8), (9, 10)])
+
+    def test_slow_state_machine_fills_the_queue_without_blocking_submit(self):
+        release = threading.Event()
+        self.applier = self.make_applier(lambda entries: release.wait(1) and entries[-1].index)
+        self.applier.start()
+
+        started = time.monotonic()
+        self.applier.submit(10)
+        self.assertLess(time.monotonic() - started, 0.1)
+        self.assertTrue(self.applier.is_full())
+
+        release.set()
+        deadline = time.monotonic() + 1
+        while self.applier.is_full() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(self.applier.is_full())
+
+    def test_restart_applies_the_entries_committed_after_the_watermark(self):
+        self.applier.submit(6)
+        self.applier.apply_committed()
+
+        restarted = FakeLog(storage=self.log.storage)
+        applier = Applier(restarted, restarted.apply_to_state_machine, lambda first, last: None,
+                          max_batch_size=4, max_pending=8, retry_interval=0.01, max_retry_interval=0.02)
+        applier.submit(restarted.get_last_commit_index())
+        applier.apply_committed()
+
+        self.assertEqual(restarted.applied, [f"command{i}" for i in range(6, 10)])
+
+
+if __name__ == '__main__':
+    unittest.main()
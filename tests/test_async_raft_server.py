@@ -0,0 +1,237 @@
+import asyncio
+import inspect
+import time
+import unittest
+from unittest import mock
+
+from src.raft_node.async_raft_server import AsyncRaftServer
+from src.raft_node.raft_server import RaftServer, RaftState
+from src.raft_node.timer_wheel import TimerWheel
+from test_raft_server import FakeLog
+
+
+class LoopbackAsyncClient:
+    """
+    Calls the RPC handlers of another node of the same process, unless one of the two nodes is down.
+    """
+    def __init__(self, cluster, caller_id, server_id):
+        self.cluster = cluster
+        self.caller_id = caller_id
+        self.server_id = server_id
+
+    async def call(self, method, *args):
+        await asyncio.sleep(0.001)
+        if self.caller_id in self.cluster.down or self.server_id in self.cluster.down:
+            return None
+        server = self.cluster.nodes[self.server_id]
+        if isinstance(server, AsyncRaftServer):
+            handlers = {'append_entries': server.handle_append_entries, 'request_vote': server.handle_request_vote,
+                        'pre_vote': server.pre_vote_rpc, 'read_index': server.read_index_rpc,
+                        'install_snapshot': server.handle_install_snapshot, 'timeout_now': server.timeout_now_rpc}
+        else:
+            handlers = {'append_entries': server.append_entries_rpc, 'request_vote': server.request_vote_rpc,
+                        'pre_vote': server.pre_vote_rpc, 'install_snapshot': server.install_snapshot_rpc,
+                        'timeout_now': server.timeout_now_rpc}
+        result = handlers[method](*args)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def close(self):
+        pass
+
+
+class Cluster:
+    def __init__(self, number_of_nodes, threaded_ids=()):
+        raft_servers = {i: {'host': 'localhost', 'port': 5000 + i} for i in range(1, number_of_nodes + 1)}
+        self.wheel = TimerWheel(tick=0.005, slots=64)
+        self.down = set()
+        self.nodes = {}
+        for server_id in raft_servers:
+            if server_id in threaded_ids:
+                with mock.patch('src.raft_node.raft_server.Log', FakeLog):
+                    node = RaftServer(server_id, dict(raft_servers), None, None, None)
+            else:
+                with mock.patch('src.raft_node.async_raft_server.Log', FakeLog):
+                    node = AsyncRaftServer(server_id, dict(raft_servers), None, None, None, timer_wheel=self.wheel)
+                node.rpc_server = mock.AsyncMock()
+                node.clients = {peer: LoopbackAsyncClient(self, server_id, peer) for peer in raft_servers if peer != server_id}
+            self.nodes[server_id] = node
+
+    def async_nodes(self):
+        return [node for node in self.nodes.values() if isinstance(node, AsyncRaftServer)]
+
+    async def start(self):
+        for node in self.async_nodes():
+            await node.start()
+
+    async def stop(self):
+        for node in self.async_nodes():
+            await node.stop()
+        self.wheel.stop()
+
+    def leaders(self):
+        return [node for server_id, node in self.nodes.items()
+                if node.state == RaftState.LEADER and server_id not in self.down]
+
+    async def stable_leader(self):
+        """
+        Wait for a leader that has committed an entry of its term.
+        """
+        def committed_in_term():
+            leaders = self.leaders()
+            return len(leaders) == 1 and leaders[0].log.get_term(leaders[0].commit_index) == leaders[0].current_term
+        if not await self.wait_for(committed_in_term):
+            return None
+        return self.leaders()[0]
+
+    async def wait_for(self, predicate, timeout=3.0):
+        deadline = asyncio.get_running_loop().time() + timeout
+        while not predicate():
+            if asyncio.get_running_loop().time() > deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+
+class TestAsyncRaftServer(unittest.IsolatedAsyncioTestCase):
+
+    async def test_elects_one_leader_and_replicates_a_write(self):
+        cluster = Cluster(3)
+        self.addAsyncCleanup(cluster.stop)
+        await cluster.start()
+
+        leader = await cluster.stable_leader()
+        self.assertIsNotNone(leader)
+        index, term = await leader.append_entries_to_leader({'commands': ['PUT a 1'], 'rep_ids': []})
+        self.assertEqual(term, leader.current_term)
+
+        self.assertEqual(await leader.wait_for_index(index, term, timeout=1), 'APPLIED')
+        self.assertEqual(leader.log.applied[-1], leader.log.get_entry(index).command)
+        self.assertTrue(await cluster.wait_for(lambda: all(node.commit_index >= index
+                                                           for node in cluster.nodes.values())))
+        for node in cluster.nodes.values():
+            self.assertEqual(node.log.get_entry(index).term, term)
+
+    async def test_new_leader_is_elected_when_the_leader_fails(self):
+        cluster = Cluster(3)
+        self.addAsyncCleanup(cluster.stop)
+        await cluster.start()
+        old_leader = await cluster.stable_leader()
+        self.assertIsNotNone(old_leader)
+
+        cluster.down.add(old_leader.server_id)
+
+        self.assertTrue(await cluster.wait_for(lambda: len(cluster.leaders()) == 1))
+        new_leader = cluster.leaders()[0]
+        self.assertNotEqual(new_leader.server_id, old_leader.server_id)
+        self.assertGreater(new_leader.current_term, old_leader.current_term)
+        # without a quorum the old leader steps down
+        self.assertTrue(await cluster.wait_for(lambda: old_leader.state != RaftState.LEADER))
+
+    async def test_read_index_is_confirmed_by_a_quorum(self):
+        cluster = Cluster(3)
+        self.addAsyncCleanup(cluster.stop)
+        await cluster.start()
+        leader = await cluster.stable_leader()
+        self.assertIsNotNone(leader)
+
+        self.assertEqual(await leader.read_barrier(), leader.commit_index)
+
+    async def test_leadership_is_transferred_to_the_chosen_follower(self):
+        cluster = Cluster(3)
+        self.addAsyncCleanup(cluster.stop)
+        await cluster.start()
+        old_leader = await cluster.stable_leader()
+        self.assertIsNotNone(old_leader)
+        old_term = old_leader.current_term
+        target_id = next(server_id for server_id in cluster.nodes if server_id != old_leader.server_id)
+
+        self.assertEqual(await old_leader.transfer_leadership(target_id), target_id)
+
+        new_leader = await cluster.stable_leader()
+        self.assertIsNotNone(new_leader)
+        self.assertEqual(new_leader.server_id, target_id)
+        self.assertGreater(new_leader.current_term, old_term)
+        self.assertEqual(old_leader.state, RaftState.FOLLOWER)
+
+    async def test_removed_member_is_dropped_by_every_node(self):
+        cluster = Cluster(3)
+        self.addAsyncCleanup(cluster.stop)
+        await cluster.start()
+        leader = await cluster.stable_leader()
+        self.assertIsNotNone(leader)
+        removed_id = next(server_id for server_id in cluster.nodes if server_id != leader.server_id)
+
+        index = leader.delete_node(removed_id)
+
+        self.assertTrue(await cluster.wait_for(lambda: leader.commit_index >= index))
+        remaining = [node for server_id, node in cluster.nodes.items() if server_id != removed_id]
+        self.assertTrue(await cluster.wait_for(lambda: all(removed_id not in node.raft_servers for node in remaining)))
+        self.assertNotIn(removed_id, leader.progress)
+        self.assertEqual(len(leader.voters()), 2)
+
+    async def test_threaded_follower_accepts_the_async_leader(self):
+        cluster = Cluster(3, threaded_ids=(3,))
+        self.addAsyncCleanup(cluster.stop)
+        await cluster.start()
+        leader = await cluster.stable_leader()
+        self.assertIsNotNone(leader)
+        index, _ = await leader.append_entries_to_leader({'commands': ['PUT a 1'], 'rep_ids': []})
+
+        threaded = cluster.nodes[3]
+        self.assertTrue(await cluster.wait_for(lambda: threaded.commit_index >= index))
+        self.assertEqual(threaded.leader_id, leader.server_id)
+        self.assertEqual(threaded.log.get_entry(index).command, leader.log.get_entry(index).command)
+
+
+    async def event_loop_lag(self, cluster, busy):
+        """
+        :return: the longest time a short sleep of the loop took while busy() held
+        """
+        self.assertTrue(await cluster.wait_for(busy))
+        lag = 0
+        while busy():
+            started = time.monotonic()
+            await asyncio.sleep(0.01)
+            lag = max(lag, time.monotonic() - started)
+        return lag
+
+    async def test_a_slow_snapshot_of_the_state_machine_does_not_hold_up_the_loop(self):
+        cluster = Cluster(3)
+        self.addAsyncCleanup(cluster.stop)
+        await cluster.start()
+        leader = await cluster.stable_leader()
+        self.assertIsNotNone(leader)
+        self.assertTrue(await cluster.wait_for(lambda: leader.log.last_applied > 0))
+        create_snapshot = leader.log.create_state_machine_snapshot
+        leader.log.create_state_machine_snapshot = lambda: (time.sleep(0.5), create_snapshot())[1]
+
+        leader.snapshot_threshold_entries = 1
+
+        self.assertLess(await self.event_loop_lag(cluster, lambda: leader.snapshot_in_progress), 0.2)
+        self.assertGreater(leader.log.snapshot_index, 0)
+        self.assertEqual(leader.state, RaftState.LEADER)
+
+    async def test_a_slow_restore_of_the_state_machine_does_not_hold_up_the_loop(self):
+        cluster = Cluster(3)
+        self.addAsyncCleanup(cluster.stop)
+        await cluster.start()
+        leader = await cluster.stable_leader()
+        self.assertIsNotNone(leader)
+        follower = next(node for node in cluster.async_nodes() if node is not leader)
+        cluster.down.add(follower.server_id)
+        restored = []
+        follower.log.restore_state_machine_snapshot = lambda data: (time.sleep(0.5), restored.append(data))
+
+        install = asyncio.ensure_future(follower.handle_install_snapshot(
+            follower.current_term, leader.server_id, 100, follower.current_term, 0, '["snapshot"]', True))
+
+        self.assertLess(await self.event_loop_lag(cluster, lambda: not install.done()), 0.2)
+        self.assertTrue((await install)['success'])
+        self.assertEqual(restored, ['["snapshot"]'])
+        self.assertEqual(follower.log.snapshot_index, 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
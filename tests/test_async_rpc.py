@@ -0,0 +1,70 @@
+import asyncio
+import ssl
+import unittest
+import xmlrpc.client
+
+from src.rpc import AsyncRPCClient, AsyncRPCServer
+
+CERT_FILE = 'src/rpc/ssl/certificate.pem'
+KEY_FILE = 'src/rpc/ssl/private_key.pem'
+
+
+def add_numbers(x, y):
+    return x + y
+
+
+async def slow_echo(value, delay):
+    await asyncio.sleep(delay)
+    return value
+
+
+def client_context():
+    # the test certificate may have expired, only the encryption is exercised here
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class AsyncRPCServerClientTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(certfile=CERT_FILE, keyfile=KEY_FILE)
+        self.server = AsyncRPCServer(host='localhost', port=0, ssl_context=server_context)
+        self.server.register_function(add_numbers)
+        self.server.register_function(slow_echo)
+        await self.server.start()
+        self.port = self.server.server.sockets[0].getsockname()[1]
+        self.client = AsyncRPCClient(host='localhost', port=self.port, timeout=1, ssl_context=client_context())
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.server.stop()
+
+    async def test_addition(self):
+        self.assertEqual(await self.client.call('add_numbers', 5, 3), 8)
+        self.assertEqual(await self.client.call('add_numbers', 1, 1), 2)
+        self.assertEqual(len(self.client.idle_connections), 1)
+
+    async def test_concurrent_calls_use_separate_connections(self):
+        results = await asyncio.gather(*(self.client.call('slow_echo', i, 0.05) for i in range(5)))
+
+        self.assertEqual(results, list(range(5)))
+        self.assertEqual(len(self.client.idle_connections), 5)
+
+    async def test_failed_and_timed_out_calls_return_none(self):
+        self.assertIsNone(await self.client.call('missing_method'))
+        self.assertIsNone(await self.client.call('slow_echo', 1, 2))
+        self.assertEqual(await self.client.call('add_numbers', 2, 2), 4)
+
+    async def test_threaded_client_can_call_the_async_server(self):
+        def call():
+            proxy = xmlrpc.client.ServerProxy(f"https://localhost:{self.port}", allow_none=True,
+                                              context=client_context())
+            return proxy.add_numbers(20, 22), proxy.slow_echo(None, 0)
+
+        self.assertEqual(await asyncio.to_thread(call), (42, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
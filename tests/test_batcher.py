@@ -0,0 +1,58 @@
+import threading
+import time
+import unittest
+
+from src.metrics import Metrics
+from src.raft_node.batcher import WriteBatcher
+
+
+class TestWriteBatcher(unittest.TestCase):
+    def setUp(self):
+        self.log = []
+        self.flushes = []
+        self.metrics = Metrics()
+
+    def flush(self, commands):
+        self.flushes.append(list(commands))
+        first_index = len(self.log) + 1
+        self.log.extend(commands)
+        return list(range(first_index, first_index + len(commands)))
+
+    def test_concurrent_writes_are_merged(self):
+        batcher = WriteBatcher(self.flush, max_batch_size=100, linger=0.05, metrics=self.metrics)
+        results = {}
+
+        def write(i):
+            results[i] = batcher.submit(f"command{i}").result()
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLess(len(self.flushes), 20)
+        self.assertEqual(sorted(results.values()), list(range(1, 21)))
+        for i, index in results.items():
+            self.assertEqual(self.log[index - 1], f"command{i}")
+        self.assertEqual(self.metrics.to_dict()['write_batch_size']['sum'], 20)
+
+    def test_full_batch_does_not_wait_for_linger(self):
+        batcher = WriteBatcher(self.flush, max_batch_size=2, linger=10, metrics=self.metrics)
+        start = time.monotonic()
+        first = batcher.submit('a')
+        second = batcher.submit('b')
+        self.assertEqual((first.result(timeout=1), second.result(timeout=1)), (1, 2))
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_failed_flush_is_reported_to_every_caller(self):
+        def failing_flush(commands):
+            raise RuntimeError('not the leader')
+
+        batcher = WriteBatcher(failing_flush, max_batch_size=10, linger=0.001)
+        with self.assertRaises(RuntimeError):
+            batcher.submit('a').result(timeout=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
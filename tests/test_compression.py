@@ -0,0 +1,137 @@
+import json
+import os
+import tempfile
+import unittest
+import xmlrpc.client
+
+from src.metrics import Metrics
+from src.raft_node.compression import Compressor, chunk_data
+from src.raft_node.log import LogEntry
+from src.raft_node.log_storage import MongoLogStorage
+from src.raft_node.wal import SegmentedWAL
+from test_raft_server import FakeCollection, LoopbackClient, make_server
+
+
+def put_command(index):
+    # a client request with a nested value, as the data creator writes them
+    value = {'name': f"user{index}", 'address': {'street': 'Main Street', 'city': 'Athens', 'zip': '10558'},
+             'tags': ['customer', 'active', 'newsletter'] * 4}
+    return json.dumps({'commands': [f'PUT "user{index}": {json.dumps(value)}'], 'rep_ids': [index]})
+
+
+def marshal(*args):
+    return xmlrpc.client.loads(xmlrpc.client.dumps(args, allow_none=True))[0]
+
+
+class TestCompressor(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+        self.compressor = Compressor(enabled=True, threshold=512, level=1, metrics=self.metrics)
+
+    def test_payloads_below_the_threshold_are_not_compressed(self):
+        self.assertIsNone(self.compressor.compress(b'x' * 511))
+        self.assertIsNone(Compressor(enabled=False).compress(b'x' * 4096))
+
+    def test_payloads_are_compressed_and_the_ratio_is_recorded(self):
+        payload = put_command(1).encode() * 4
+
+        compressed = self.compressor.compress(payload)
+
+        self.assertEqual(self.compressor.decompress(compressed), payload)
+        metrics = self.metrics.to_dict()
+        self.assertEqual(metrics['compression_input_bytes'], len(payload))
+        self.assertEqual(metrics['compression_output_bytes'], len(compressed))
+        self.assertGreater(metrics['compression_ratio'], 2)
+        self.assertIn('compression_seconds', metrics)
+
+    def test_a_large_batch_is_sent_as_one_compressed_binary(self):
+        entries = [LogEntry(index, 2, put_command(index)) for index in range(1, 21)]
+
+        packed = self.compressor.pack_entries(entries)
+        (received,) = marshal(packed)
+
+        self.assertIsInstance(packed, xmlrpc.client.Binary)
+        self.assertLess(len(packed.data) * 4, sum(len(entry.command) for entry in entries))
+        self.assertEqual(Compressor().unpack_entries(received),
+                         [{'index': entry.index, 'term': 2, 'command': entry.command} for entry in entries])
+
+    def test_a_small_batch_is_sent_as_it_is(self):
+        entries = [LogEntry(1, 1, 'PUT "a": 1')]
+
+        self.assertIs(self.compressor.pack_entries(entries), entries)
+
+    def test_a_snapshot_is_sent_compressed_in_chunks(self):
+        snapshot = json.dumps([put_command(index) for index in range(50)])
+        data = self.compressor.pack_snapshot(snapshot)
+
+        chunks = [chunk_data(marshal(Compressor.snapshot_chunk(data, offset, 100))[0])
+                  for offset in range(0, len(data), 100)]
+
+        self.assertTrue(all(isinstance(chunk, bytes) for chunk in chunks))
+        self.assertEqual(Compressor().unpack_snapshot(chunks), snapshot)
+
+
+class TestCompressedStorage(unittest.TestCase):
+    def setUp(self):
+        self.compressor = Compressor(enabled=True, threshold=512)
+        self.entries = [LogEntry(1, 1, 'small'), LogEntry(2, 1, put_command(2) * 2),
+                        LogEntry(3, 1, '{"membership": ' + put_command(3) + '}')]
+
+    def test_mongo_stores_large_commands_compressed(self):
+        storage = MongoLogStorage(FakeCollection(), FakeCollection(), FakeCollection(), 1048576, self.compressor)
+        storage.append(self.entries)
+
+        self.assertIn('command', storage.collection.find_one({'index': 1}))
+        self.assertIsInstance(storage.collection.find_one({'index': 2})['zcommand'], bytes)
+        self.assertEqual([entry['command'] for entry in storage.load_entries(0)],
+                         [entry.command for entry in self.entries])
+        self.assertEqual([entry['index'] for entry in storage.find_entries(0, '{"membership"')], [3])
+
+    def test_the_write_ahead_log_stores_large_records_compressed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            storage = SegmentedWAL(directory, fsync=False, compressor=self.compressor)
+            storage.append(self.entries)
+            storage.close()
+            size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+            # a log written with compression stays readable once it is turned off
+            storage = SegmentedWAL(directory, fsync=False)
+            self.assertEqual([entry['command'] for entry in storage.read_entries(1, 3)],
+                             [entry.command for entry in self.entries])
+            self.assertEqual([entry['index'] for entry in storage.find_entries(0, '{"membership"')], [3])
+            storage.close()
+        self.assertLess(size, sum(len(entry.command) for entry in self.entries))
+
+
+class TestCompressedReplication(unittest.TestCase):
+    def test_entries_and_snapshots_reach_the_follower_compressed(self):
+        leader = make_server(2)
+        leader.log.compressor = Compressor(enabled=True, threshold=256, metrics=leader.metrics)
+        leader.current_term = 1
+        leader.transition_to_leader(verbose=False)
+        for index in range(20):
+            leader.log.append_entry(1, put_command(index))
+        leader.commit_index = leader.log.get_last_index()
+        leader.log.commit_entries(0, leader.commit_index)
+        leader.applier.submit(leader.commit_index)
+        leader.applier.apply_committed()
+        leader.snapshot_threshold_entries = 10
+        leader.take_snapshot_if_needed()
+        for index in range(20, 30):
+            leader.log.append_entry(1, put_command(index))
+        follower = make_server(2)
+        follower.server_id = 2
+        leader.clients = {2: LoopbackClient(follower)}
+        leader.reset_progress()
+        leader.progress[2].become_probe(1)
+
+        for _ in range(3):
+            leader.send_append_entries_to_servers_multicast()
+
+        self.assertEqual(follower.log.restored, leader.log.load_snapshot())
+        self.assertEqual(follower.log.get_entry(31).command, put_command(29))
+        self.assertGreater(leader.metrics.to_dict()['compression_ratio'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
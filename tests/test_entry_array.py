@@ -0,0 +1,67 @@
+import unittest
+import xmlrpc.client
+
+from src.raft_node.log import EntryArray
+from test_raft_server import FakeLog
+
+
+class TestEntryArray(unittest.TestCase):
+    def setUp(self):
+        self.entries = EntryArray(first_index=11)
+        self.entries.extend((term, f"command{index}") for index, term in zip(range(11, 16), [1, 1, 2, 2, 3]))
+
+    def test_entries_are_built_with_their_index_term_and_command(self):
+        entry = self.entries[2]
+
+        self.assertEqual((entry.index, entry.term, entry.command), (13, 2, 'command13'))
+        self.assertEqual(self.entries[-1].index, 15)
+        self.assertEqual([entry.index for entry in self.entries[3:]], [14, 15])
+        self.assertEqual(len(list(self.entries)), 5)
+        with self.assertRaises(IndexError):
+            self.entries[5]
+
+    def test_entries_up_to_the_commit_index_are_committed(self):
+        self.entries.commit_index = 12
+
+        self.assertEqual([entry.is_committed for entry in self.entries], [True, True, False, False, False])
+
+    def test_truncate_keeps_the_first_entries(self):
+        self.entries.truncate(2)
+        self.entries.append(4, 'replacement')
+
+        self.assertEqual([(entry.index, entry.term, entry.command) for entry in self.entries],
+                         [(11, 1, 'command11'), (12, 1, 'command12'), (13, 4, 'replacement')])
+
+    def test_drop_removes_the_first_entries(self):
+        self.entries.drop(3)
+
+        self.assertEqual(self.entries.first_index, 14)
+        self.assertEqual([(entry.index, entry.command) for entry in self.entries], [(14, 'command14'),
+                                                                                    (15, 'command15')])
+
+    def test_commands_are_stored_as_utf8(self):
+        self.entries.append(3, 'PUT "clé": "värde"')
+
+        self.assertEqual(self.entries[-1].command, 'PUT "clé": "värde"')
+        self.assertEqual(self.entries.command_size(5), len('PUT "clé": "värde"'.encode()))
+
+    def test_log_batches_are_bounded_by_the_size_of_the_commands(self):
+        log = FakeLog()
+        log.append_entries(1, ['x' * 10] * 10)
+
+        self.assertEqual([entry.index for entry in log.get_entries(3, 5, 25)], [3, 4])
+        self.assertEqual([entry.index for entry in log.get_entries(3, 5, 5)], [3])
+        self.assertEqual([entry.index for entry in log.get_entries(9, 5, 1000)], [9, 10])
+
+    def test_entries_are_sent_to_the_followers_as_structs(self):
+        log = FakeLog()
+        log.append_entries(1, ['a', 'b'])
+
+        (entries,), _ = xmlrpc.client.loads(xmlrpc.client.dumps((log.get_entries(1, 5, 1000),)))
+
+        self.assertEqual([(entry['index'], entry['term'], entry['command']) for entry in entries],
+                         [(1, 1, 'a'), (2, 1, 'b')])
+
+
+if __name__ == '__main__':
+    unittest.main()
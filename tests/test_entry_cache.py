@@ -0,0 +1,95 @@
+import unittest
+from unittest import mock
+
+from src.raft_node.entry_cache import ENTRY_OVERHEAD, EntryCache
+from src.raft_node.log import LogEntry
+from src.raft_node.log_storage import MemoryLogStorage
+from test_raft_server import FakeLog
+
+
+class TestEntryCache(unittest.TestCase):
+    def test_least_recently_used_entries_are_evicted_beyond_the_size(self):
+        cache = EntryCache(max_bytes=3 * (ENTRY_OVERHEAD + 10))
+        for index in range(1, 4):
+            cache.put(LogEntry(index, 1, 'x' * 10))
+        cache.get(1)
+
+        cache.put(LogEntry(4, 1, 'x' * 10))
+
+        self.assertIsNone(cache.get(2))
+        self.assertEqual([index for index in (1, 3, 4) if cache.get(index) is not None], [1, 3, 4])
+        self.assertEqual(cache.size, 3 * (ENTRY_OVERHEAD + 10))
+
+    def test_discarded_entries_are_no_longer_cached(self):
+        cache = EntryCache(max_bytes=1048576)
+        for index in range(1, 6):
+            cache.put(LogEntry(index, 1, 'x'))
+
+        cache.discard(lambda index: index > 3)
+
+        self.assertEqual([index for index in range(1, 6) if cache.get(index) is not None], [4, 5])
+        self.assertEqual(cache.size, 2 * (ENTRY_OVERHEAD + 1))
+
+
+class WindowedLog(FakeLog):
+    def __init__(self, storage):
+        super().__init__(storage=storage)
+        self.window_entries = 10
+        self.prefetch_entries = 5
+        self.load_entries()
+
+
+class TestLogWindow(unittest.TestCase):
+    def setUp(self):
+        self.storage = MemoryLogStorage()
+        self.storage.append([LogEntry(index, 1 if index <= 50 else 2, f"command{index}") for index in range(1, 101)])
+        self.storage.commit(0, 90)
+        self.log = WindowedLog(self.storage)
+
+    def test_only_the_last_entries_are_loaded(self):
+        self.assertEqual(len(self.log.entries), 10)
+        self.assertEqual(self.log.entries.first_index, 91)
+        self.assertEqual((self.log.get_last_index(), self.log.get_last_term()), (100, 2))
+        self.assertEqual(self.log.get_last_commit_index(), 90)
+
+    def test_older_entries_are_read_from_the_storage_with_a_prefetch(self):
+        with mock.patch.object(self.storage, 'read_entries', wraps=self.storage.read_entries) as read_entries:
+            entries = [self.log.get_entry(index) for index in range(20, 30)]
+
+        self.assertEqual([entry.command for entry in entries], [f"command{index}" for index in range(20, 30)])
+        self.assertTrue(all(entry.is_committed for entry in entries))
+        self.assertEqual(read_entries.call_count, 2)
+        self.assertEqual(self.log.get_term(40), 1)
+
+    def test_a_batch_spans_the_stored_entries_and_the_window(self):
+        batch = self.log.get_entries(85, 10, 1000)
+
+        self.assertEqual([entry.index for entry in batch], list(range(85, 95)))
+        self.assertEqual([entry.index for entry in self.log.get_all_entries_from_index(88)], list(range(88, 101)))
+
+    def test_the_window_slides_over_the_applied_entries(self):
+        self.log.last_applied = 105
+        for index in range(101, 111):
+            self.log.append_entry(3, f"command{index}")
+        self.assertEqual(len(self.log.entries), 20)
+
+        self.log.append_entry(3, 'command111')
+
+        self.assertEqual(self.log.entries.first_index, 102)
+        self.assertEqual(self.log.first_index_of_term(3), 102)
+        self.assertEqual(self.log.get_entry(101).command, 'command101')
+
+    def test_truncation_before_the_window_drops_the_cached_entries(self):
+        self.assertEqual(self.log.get_entry(60).term, 2)
+
+        self.log.delete_entries_after(55)
+        self.log.append_entry(3, 'replacement')
+
+        self.assertEqual(self.log.get_last_index(), 56)
+        self.assertEqual(self.log.get_entry(56).command, 'replacement')
+        self.assertEqual(self.log.get_entry(55).command, 'command55')
+        self.assertIsNone(self.log.cache.get(60))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,45 +16,45 @@ class TestLog(unittest.TestCase):
         client.drop_database(self.database_name)
 
     def test_append_and_get_entry(self):
-        self.log.append_entry('term1', 'command1')
+        self.log.append_entry(1, 'command1')
         entry = self.log.get_entry(1)
         self.assertEqual(len(self.log.entries), 1)
-        self.assertEqual(entry.term, 'term1')
+        self.assertEqual(entry.term, 1)
         self.assertEqual(entry.command, 'command1')
 
     def test_commit_entry(self):
-        self.log.append_entry('term1', 'command1')
+        self.log.append_entry(1, 'command1')
         self.log.commit_entry(1)
         self.assertTrue(self.log.entries[0].is_committed)
 
     def test_delete_entries_after(self):
-        self.log.append_entry('term1', 'command1')
-        self.log.append_entry('term2', 'command2')
+        self.log.append_entry(1, 'command1')
+        self.log.append_entry(2, 'command2')
         self.log.delete_entries_after(1)
         self.assertEqual(len(self.log.entries), 1)
 
     def test_get_last_index(self):
-        self.log.append_entry('term1', 'command1')
+        self.log.append_entry(1, 'command1')
         self.assertEqual(self.log.get_last_index(), 1)
 
     def test_get_last_term(self):
-        self.log.append_entry('term1', 'command1')
-        self.assertEqual(self.log.get_last_term(), 'term1')
+        self.log.append_entry(1, 'command1')
+        self.assertEqual(self.log.get_last_term(), 1)
 
     def test_commit_entries(self):
-        self.log.append_entry('term1', 'command1')
-        self.log.append_entry('term2', 'command2')
+        self.log.append_entry(1, 'command1')
+        self.log.append_entry(2, 'command2')
         self.log.commit_entries(0, 2)
         self.assertTrue(all(entry.is_committed for entry in self.log.entries))
 
     def test_get_last_commit_index(self):
-        self.log.append_entry('term1', 'command1')
+        self.log.append_entry(1, 'command1')
         self.log.commit_entry(1)
         self.assertEqual(self.log.get_last_commit_index(), 1)
 
     def test_get_all_entries_from_index(self):
-        self.log.append_entry('term1', 'command1')
-        self.log.append_entry('term2', 'command2')
+        self.log.append_entry(1, 'command1')
+        self.log.append_entry(2, 'command2')
         entries = self.log.get_all_entries_from_index(1)
         self.assertEqual(len(entries), 2)
 
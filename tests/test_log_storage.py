@@ -0,0 +1,230 @@
+import os
+import tempfile
+import unittest
+
+from src.raft_node.log import LogEntry
+from src.raft_node.log_storage import MemoryLogStorage, MongoLogStorage
+from src.raft_node.wal import CorruptedRecordError, SegmentedWAL
+from test_raft_server import FakeCollection, FakeLog
+
+
+def entries(first_index, last_index, term=1):
+    return [LogEntry(index, term, f"command{index}") for index in range(first_index, last_index + 1)]
+
+
+class LogStorageContract:
+    """
+    The behaviour every log storage shares, run against each of them.
+    """
+
+    def make_storage(self):
+        raise NotImplementedError
+
+    def reopen(self, storage):
+        return storage
+
+    def setUp(self):
+        self.storage = self.make_storage()
+
+    def indexes(self, after_index=0):
+        return [entry['index'] for entry in self.reopen(self.storage).load_entries(after_index)]
+
+    def test_entries_are_read_back_in_order_with_their_commit_flag(self):
+        self.storage.append(entries(1, 3))
+        self.storage.append(entries(4, 5, term=2))
+        self.storage.commit(0, 4)
+
+        loaded = self.reopen(self.storage).load_entries(0)
+
+        self.assertEqual([(entry['index'], entry['term']) for entry in loaded],
+                         [(1, 1), (2, 1), (3, 1), (4, 2), (5, 2)])
+        self.assertEqual([entry['is_committed'] for entry in loaded], [True] * 4 + [False])
+        self.assertEqual(loaded[0]['command'], 'command1')
+
+    def test_truncate_after_deletes_the_conflicting_suffix(self):
+        self.storage.append(entries(1, 5))
+
+        self.assertEqual(self.storage.truncate_after(2), 3)
+        self.storage.append(entries(3, 4, term=2))
+
+        self.assertEqual(self.indexes(), [1, 2, 3, 4])
+        self.assertEqual(self.reopen(self.storage).load_entries(0)[-1]['term'], 2)
+
+    def test_entries_covered_by_the_snapshot_are_not_loaded(self):
+        self.storage.append(entries(1, 5))
+        self.storage.discard_through(3)
+        self.storage.save_snapshot(3, 1, 'state', {'voters': [1]})
+
+        storage = self.reopen(self.storage)
+        self.assertEqual([entry['index'] for entry in storage.load_entries(3)], [4, 5])
+        self.assertEqual(storage.load_snapshot_meta(),
+                         {'last_included_index': 3, 'last_included_term': 1, 'membership': {'voters': [1]}})
+        self.assertEqual(storage.load_snapshot(3), 'state')
+
+    def test_entries_are_read_by_range(self):
+        self.storage.append(entries(1, 10))
+        self.storage.commit(0, 3)
+
+        storage = self.reopen(self.storage)
+        self.assertEqual([entry['index'] for entry in storage.read_entries(4, 6)], [4, 5, 6])
+        self.assertEqual([entry['index'] for entry in storage.load_last_entries(7, 5)], [8, 9, 10])
+        self.assertEqual([entry['index'] for entry in storage.load_last_entries(0, 2)], [9, 10])
+        self.assertEqual([entry['is_committed'] for entry in storage.read_entries(2, 4)], [True, True, False])
+
+    def test_entries_are_found_by_the_start_of_their_command(self):
+        self.storage.append(entries(1, 3))
+        self.storage.append([LogEntry(4, 1, '{"membership": {}}'), LogEntry(5, 1, 'x {"membership": {}}')])
+
+        found = self.reopen(self.storage).find_entries(0, '{"membership"')
+
+        self.assertEqual([entry['index'] for entry in found], [4])
+
+    def test_hard_state_and_applied_index_survive_a_restart(self):
+        storage = self.reopen(self.storage)
+        self.assertEqual(storage.load_hard_state(), {'term': 0, 'voted_for': None})
+        self.assertIsNone(storage.load_last_applied())
+
+        self.storage.save_hard_state(4, 2)
+        self.storage.save_last_applied(7)
+
+        storage = self.reopen(self.storage)
+        self.assertEqual(storage.load_hard_state(), {'term': 4, 'voted_for': 2})
+        self.assertEqual(storage.load_last_applied(), 7)
+
+    def test_a_log_on_the_storage_restarts_with_its_term_vote_and_commit_index(self):
+        log = FakeLog(storage=self.storage)
+        log.append_entries(1, ['a', 'b', 'c'])
+        log.commit_entries(0, 2)
+        log.save_hard_state(3, 2)
+
+        restarted = FakeLog(storage=self.reopen(self.storage))
+
+        self.assertEqual(restarted.get_last_index(), 3)
+        self.assertEqual(restarted.get_last_commit_index(), 2)
+        self.assertEqual((restarted.current_term, restarted.voted_for), (3, 2))
+
+
+class TestMemoryLogStorage(LogStorageContract, unittest.TestCase):
+    def make_storage(self):
+        return MemoryLogStorage()
+
+
+class TestMongoLogStorage(LogStorageContract, unittest.TestCase):
+    def make_storage(self):
+        return MongoLogStorage(FakeCollection(), FakeCollection(), FakeCollection(), snapshot_chunk_size=2)
+
+    def test_a_commit_is_one_write_of_the_watermark_document(self):
+        self.storage.append(entries(1, 100))
+        self.storage.save_last_applied(40)
+
+        self.storage.commit(0, 100)
+        self.storage.commit(100, 50)
+
+        self.assertEqual(self.storage.state_collection.find({}),
+                         [{'_id': 'watermarks', 'last_applied': 40, 'commit_index': 100}])
+        self.assertNotIn('is_committed', self.storage.collection.find_one({'index': 1}))
+        self.assertEqual(self.storage.load_commit_index(), 100)
+
+    def test_a_log_with_commit_flags_loads_its_commit_index(self):
+        self.storage.collection.insert_many([dict(entry.to_dict(), is_committed=entry.index <= 2)
+                                             for entry in entries(1, 3)])
+        self.storage.state_collection.insert_one({'_id': 'last_applied', 'index': 1})
+
+        self.assertEqual(self.storage.load_commit_index(), 2)
+        self.assertEqual(self.storage.load_last_applied(), 1)
+        self.assertEqual([entry['is_committed'] for entry in self.storage.load_entries(0)], [True, True, False])
+
+    def test_a_snapshot_saved_again_at_the_same_index_replaces_the_previous_one(self):
+        self.storage.save_snapshot(5, 1, 'abcde')
+        self.storage.save_snapshot(5, 1, 'abcde')
+
+        self.assertEqual(self.storage.load_snapshot(5), 'abcde')
+        self.assertEqual(len(self.storage.snapshot_collection.find({'chunk': {'$exists': True}})), 3)
+
+    def test_a_batch_retried_after_a_partial_write_is_written_once(self):
+        collection = self.storage.collection
+        bulk_write = collection.bulk_write
+
+        def fail_after_two(requests, ordered=True):
+            bulk_write(requests[:2], ordered)
+            raise ConnectionError('primary stepped down')
+
+        collection.bulk_write = fail_after_two
+        with self.assertRaises(ConnectionError):
+            self.storage.append(entries(1, 4))
+        collection.bulk_write = bulk_write
+        self.storage.append(entries(1, 4))
+
+        self.assertEqual(self.indexes(), [1, 2, 3, 4])
+
+    def test_snapshot_is_stored_in_chunks(self):
+        self.storage.save_snapshot(3, 1, 'state')
+
+        self.assertEqual(len(self.storage.snapshot_collection.find({'chunk': {'$exists': True}})), 3)
+        self.assertEqual(self.storage.load_snapshot(3), 'state')
+
+
+class TestSegmentedWAL(LogStorageContract, unittest.TestCase):
+    def make_storage(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        return SegmentedWAL(self.directory.name, segment_size=100, fsync=False)
+
+    def reopen(self, storage):
+        storage.close()
+        return SegmentedWAL(self.directory.name, segment_size=100, fsync=False)
+
+    def segment_files(self):
+        return sorted(name for name in os.listdir(self.directory.name) if name.endswith('.wal'))
+
+    def test_full_segments_roll_over_and_are_deleted_once_compacted(self):
+        for index in range(1, 11):
+            self.storage.append(entries(index, index))
+        self.assertGreater(len(self.segment_files()), 2)
+
+        first_segments = len(self.segment_files())
+        deleted = self.storage.discard_through(6)
+
+        self.assertLess(len(self.segment_files()), first_segments)
+        self.assertEqual(self.indexes(6), [7, 8, 9, 10])
+        self.assertEqual(deleted, 10 - len(self.reopen(self.storage).load_entries(0)))
+
+    def test_truncation_deletes_the_later_segments(self):
+        for index in range(1, 11):
+            self.storage.append(entries(index, index))
+
+        self.storage.truncate_after(3)
+        self.storage.append(entries(4, 5, term=2))
+
+        self.assertEqual(self.indexes(), [1, 2, 3, 4, 5])
+        self.assertTrue(all(int(name[len('segment-'):-len('.wal')]) <= 4 for name in self.segment_files()))
+
+    def test_a_partly_written_record_at_the_end_is_cut_off(self):
+        self.storage.append(entries(1, 2))
+        self.storage.close()
+        path = os.path.join(self.directory.name, self.segment_files()[-1])
+        with open(path, 'ab') as file:
+            file.write(b'\x00\x00\x01')
+
+        storage = SegmentedWAL(self.directory.name, segment_size=100, fsync=False)
+        storage.append(entries(3, 3))
+
+        self.assertEqual(self.indexes(), [1, 2, 3])
+
+    def test_a_corrupted_record_before_the_last_segment_fails_the_read(self):
+        for index in range(1, 11):
+            self.storage.append(entries(index, index))
+        self.storage.close()
+        path = os.path.join(self.directory.name, self.segment_files()[0])
+        with open(path, 'r+b') as file:
+            file.seek(10)
+            file.write(b'X')
+
+        # only the last segment is read when the log is opened
+        storage = SegmentedWAL(self.directory.name, segment_size=100, fsync=False)
+        with self.assertRaises(CorruptedRecordError):
+            storage.read_entries(1, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
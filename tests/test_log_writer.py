@@ -0,0 +1,162 @@
+import threading
+import time
+import unittest
+
+from src.raft_node.log import LogEntry
+from src.raft_node.log_storage import MemoryLogStorage
+from src.raft_node.log_writer import ASYNC, GROUP, SYNC, LogWriter
+from test_raft_server import FakeLog
+
+
+def entries(first_index, last_index, term=1):
+    return [LogEntry(index, term, f"command{index}") for index in range(first_index, last_index + 1)]
+
+
+class RecordingStorage(MemoryLogStorage):
+    """
+    Records the batches it is asked to write, each write waits until the gate is open.
+    """
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.failures = 0
+
+    def append(self, entries):
+        self.gate.wait()
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError('disk full')
+        self.batches.append([entry.index for entry in entries])
+        super().append(entries)
+
+
+class TestLogWriter(unittest.TestCase):
+    def setUp(self):
+        self.storage = RecordingStorage()
+
+    def test_unknown_durability_is_refused(self):
+        with self.assertRaises(ValueError):
+            LogWriter(self.storage, 'eventually')
+
+    def test_sync_appends_are_written_before_they_return(self):
+        writer = LogWriter(self.storage, SYNC)
+
+        writer.append(entries(1, 2))
+        writer.append(entries(3, 3))
+
+        self.assertEqual(self.storage.batches, [[1, 2], [3]])
+        self.assertEqual(writer.persisted_index, 3)
+
+    def test_group_appends_are_written_together(self):
+        writer = LogWriter(self.storage, GROUP, group_interval=0.2, group_entries=1000)
+        threads = [threading.Thread(target=writer.append, args=(entries(index, index),)) for index in (1, 2, 3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual([sorted(batch) for batch in self.storage.batches], [[1, 2, 3]])
+        self.assertEqual(writer.persisted_index, 3)
+
+    def test_a_full_group_is_written_without_waiting_for_the_interval(self):
+        writer = LogWriter(self.storage, GROUP, group_interval=10, group_entries=4)
+
+        start = time.monotonic()
+        writer.append(entries(1, 4))
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(self.storage.batches, [[1, 2, 3, 4]])
+
+    def test_async_appends_return_before_they_are_written(self):
+        writer = LogWriter(self.storage, ASYNC, max_queued=4)
+        self.storage.gate.clear()
+
+        writer.append(entries(1, 2))
+        self.assertEqual(writer.persisted_index, 0)
+
+        self.storage.gate.set()
+        writer.flush()
+        self.assertEqual(writer.persisted_index, 2)
+        self.assertEqual([entry['index'] for entry in self.storage.load_entries(0)], [1, 2])
+
+    def test_async_appends_wait_while_the_queue_is_full(self):
+        writer = LogWriter(self.storage, ASYNC, max_queued=2)
+        self.storage.gate.clear()
+        writer.append(entries(1, 1))
+        # wait for the writer to take the first entry, it then blocks on the gate
+        while writer.queued():
+            time.sleep(0.001)
+        writer.append(entries(2, 3))
+
+        appended = threading.Event()
+        threading.Thread(target=lambda: (writer.append(entries(4, 4)), appended.set())).start()
+
+        self.assertFalse(appended.wait(0.1))
+        self.storage.gate.set()
+        self.assertTrue(appended.wait(5))
+
+    def test_a_failed_write_is_retried(self):
+        writer = LogWriter(self.storage, GROUP, group_interval=0.001, retry_interval=0.001)
+        self.storage.failures = 2
+
+        writer.append(entries(1, 2))
+
+        self.assertEqual(self.storage.batches, [[1, 2]])
+
+    def test_an_append_with_a_callback_does_not_wait_for_its_write(self):
+        writer = LogWriter(self.storage, SYNC)
+        durable = []
+        self.storage.gate.clear()
+
+        writer.append(entries(1, 2), on_durable=lambda: durable.append(writer.persisted_index))
+        self.assertEqual(durable, [])
+
+        self.storage.gate.set()
+        writer.append(entries(3, 3))
+        writer.wait_for_callbacks()
+        self.assertEqual(durable, [2])
+        self.assertEqual(self.storage.batches, [[1, 2], [3]])
+
+    def test_writes_and_flushes_do_not_wait_for_a_callback(self):
+        writer = LogWriter(self.storage, GROUP, group_interval=0.001)
+        lock = threading.Lock()
+        durable = []
+
+        with lock:
+            writer.append(entries(1, 1), on_durable=lambda: (lock.acquire(), durable.append(1), lock.release()))
+            writer.flush()
+            writer.append(entries(2, 2))
+            self.assertEqual(writer.persisted_index, 2)
+            self.assertEqual(durable, [])
+
+        writer.wait_for_callbacks()
+        self.assertEqual(durable, [1])
+
+    def test_in_async_mode_the_callback_is_called_at_once(self):
+        writer = LogWriter(self.storage, ASYNC)
+        durable = []
+        self.storage.gate.clear()
+
+        writer.append(entries(1, 1), on_durable=lambda: durable.append(1))
+
+        self.assertEqual(durable, [1])
+        self.storage.gate.set()
+
+    def test_the_log_writes_the_queued_entries_before_truncating(self):
+        log = FakeLog(storage=self.storage)
+        log.writer = LogWriter(self.storage, ASYNC)
+        log.append_entries(1, ['a', 'b', 'c'])
+
+        log.delete_entries_after(1)
+        log.append_entries(2, ['d'])
+        log.writer.flush()
+
+        self.assertEqual([(entry['index'], entry['command']) for entry in self.storage.load_entries(0)],
+                         [(1, 'a'), (2, 'd')])
+        self.assertEqual(log.get_persisted_index(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
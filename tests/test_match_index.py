@@ -0,0 +1,38 @@
+import unittest
+
+from src.raft_node.match_index import MatchIndex
+
+
+class TestMatchIndex(unittest.TestCase):
+    def setUp(self):
+        self.match_index = MatchIndex([1, 2, 3, 4, 5], initial=0)
+
+    def test_quorum_index_is_stored_on_a_majority(self):
+        self.match_index.update(1, 10)
+        self.match_index.update(2, 7)
+        self.assertEqual(self.match_index.quorum_index(), 0)
+
+        self.match_index.update(3, 5)
+        self.assertEqual(self.match_index.quorum_index(), 5)
+
+        self.match_index.update(4, 9)
+        self.assertEqual(self.match_index.quorum_index(), 7)
+
+    def test_match_index_never_goes_back(self):
+        self.assertTrue(self.match_index.update(2, 8))
+        self.assertFalse(self.match_index.update(2, 3))
+        self.assertEqual(self.match_index.get(2), 8)
+        self.assertEqual(sorted(self.match_index.values.values()), self.match_index.sorted_values)
+
+    def test_removed_voter_no_longer_counts(self):
+        for voter, index in [(1, 10), (2, 10), (3, 4)]:
+            self.match_index.update(voter, index)
+        self.match_index.remove(4)
+        self.match_index.remove(5)
+
+        self.assertEqual(self.match_index.quorum_index(), 10)
+        self.assertFalse(self.match_index.update(5, 20))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import concurrent.futures
+import time
+import unittest
+from unittest import mock
+
+from src.raft_node.multi_raft import MultiRaft
+from src.raft_node.raft_server import RaftState
+from src.raft_node.sharding import KeyRouter, group_collection_name
+from test_raft_server import FakeLog
+
+
+class LocalPeer:
+    """
+    Calls the RPC handlers of a MultiRaft of the same process, None if the peer is down.
+    """
+    def __init__(self, multi_raft=None):
+        self.functions = multi_raft.rpc_functions() if multi_raft is not None else {}
+        self.calls = []
+
+    def call(self, method, *args):
+        self.calls.append((method, args))
+        if method not in self.functions:
+            return None
+        return self.functions[method](*args)
+
+
+def make_multi_raft(server_id, number_of_groups):
+    raft_servers = {i: {'host': 'localhost', 'port': 5000 + i} for i in range(1, 4)}
+    with mock.patch('src.raft_node.raft_server.Log', FakeLog):
+        return MultiRaft(server_id, raft_servers, None, None, 'log', number_of_groups)
+
+
+class TestKeyRouter(unittest.TestCase):
+    def test_keys_are_spread_over_all_groups(self):
+        router = KeyRouter(4)
+        groups = [router.group_of(f"key{i}") for i in range(1000)]
+
+        self.assertEqual(set(groups), {0, 1, 2, 3})
+        self.assertTrue(all(150 < groups.count(group_id) < 350 for group_id in range(4)))
+
+    def test_nested_keys_belong_to_the_group_of_their_top_level_key(self):
+        router = KeyRouter(8)
+        self.assertEqual(router.group_of('user_42.address.city'), router.group_of('user_42'))
+
+    def test_hash_ranges_cover_the_hash_space(self):
+        router = KeyRouter(3)
+        ranges = [router.hash_range(group_id) for group_id in range(3)]
+
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], KeyRouter.HASH_SPACE)
+        self.assertTrue(all(ranges[i][1] == ranges[i + 1][0] for i in range(2)))
+        start, end = ranges[router.group_of('user_42')]
+        self.assertTrue(start <= KeyRouter.key_hash('user_42') < end)
+
+    def test_group_zero_keeps_the_collection_of_a_single_group(self):
+        self.assertEqual(group_collection_name('log_1', 0), 'log_1')
+        self.assertEqual(group_collection_name('log_1', 2), 'log_1_group2')
+
+
+class TestMultiRaft(unittest.TestCase):
+    def setUp(self):
+        self.leader = make_multi_raft(1, 3)
+        self.follower = make_multi_raft(2, 3)
+        self.peers = {2: LocalPeer(self.follower), 3: LocalPeer()}
+        self.leader.coalescer.client_of = lambda _server_id, info: self.peers[_server_id]
+        for group in self.leader.groups[:2]:
+            group.is_running = True
+            group.current_term = 1
+            group.transition_to_leader(verbose=False)
+
+    def send_round(self):
+        concurrent.futures.wait(self.leader.coalescer.send_round())
+
+    def test_groups_are_registered_under_their_own_names(self):
+        functions = self.leader.rpc_functions()
+
+        self.assertIn('coalesced_heartbeat', functions)
+        self.assertIn('group2.append_entries', functions)
+        self.assertNotIn('append_entries', functions)
+
+    def test_heartbeats_of_all_groups_go_in_one_request_per_peer(self):
+        self.send_round()
+
+        self.assertEqual(len(self.peers[2].calls), 1)
+        method, (heartbeats,) = self.peers[2].calls[0]
+        self.assertEqual(method, 'coalesced_heartbeat')
+        self.assertEqual([heartbeat[0] for heartbeat in heartbeats], [0, 1])
+        self.assertEqual([group.leader_id for group in self.follower.groups], [1, 1, None])
+        self.assertEqual(self.follower.groups[0].current_term, 1)
+        self.assertIn(2, self.leader.groups[0].last_ack)
+        self.assertNotIn(3, self.leader.groups[0].last_ack)
+
+    def test_leader_with_a_lower_term_steps_down(self):
+        self.follower.groups[1].current_term = 5
+
+        self.send_round()
+
+        self.assertEqual(self.leader.groups[0].state, RaftState.LEADER)
+        self.assertEqual(self.leader.groups[1].state, RaftState.FOLLOWER)
+
+    def test_leadership_goes_to_the_preferred_leader_once_it_is_up_to_date(self):
+        group = self.leader.groups[1]
+        self.assertEqual(self.leader.preferred_leader(group), 2)
+        group.transfer_leadership = mock.Mock(return_value=2)
+
+        self.assertIsNone(self.leader.hand_over_to_preferred_leader(group))
+
+        group.last_ack[2] = time.time()
+        group.match_index.update(2, group.log.get_last_index())
+        self.assertEqual(self.leader.hand_over_to_preferred_leader(group), 2)
+        group.transfer_leadership.assert_called_once_with(2)
+        self.assertIsNone(self.leader.hand_over_to_preferred_leader(self.leader.groups[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
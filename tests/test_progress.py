@@ -0,0 +1,54 @@
+import unittest
+
+from src.raft_node.progress import Progress, ProgressState
+
+
+class TestProgress(unittest.TestCase):
+    def setUp(self):
+        self.progress = Progress(next_index=11, max_inflight=2)
+
+    def test_probe_sends_one_batch_at_a_time(self):
+        self.progress.sent(5)
+        self.assertFalse(self.progress.can_send())
+        self.assertEqual(self.progress.next_index, 11)
+
+    def test_replicate_advances_next_index_optimistically(self):
+        epoch = self.progress.sent(0)
+        self.progress.acked(epoch, 10, leader_last_index=20, catch_up_threshold=100)
+        self.assertEqual(self.progress.state, ProgressState.REPLICATE)
+
+        self.progress.sent(5)
+        self.progress.sent(5)
+        self.assertEqual(self.progress.next_index, 21)
+        self.assertFalse(self.progress.can_send())
+
+    def test_far_behind_follower_is_catching_up(self):
+        epoch = self.progress.sent(0)
+        self.progress.acked(epoch, 10, leader_last_index=5000, catch_up_threshold=100)
+        self.assertEqual(self.progress.state, ProgressState.CATCH_UP)
+
+    def test_rejection_falls_back_to_probe_and_ignores_stale_answers(self):
+        epoch = self.progress.sent(0)
+        self.progress.acked(epoch, 10, leader_last_index=20, catch_up_threshold=100)
+        first = self.progress.sent(5)
+        self.progress.sent(5)
+
+        self.progress.rejected(first, next_index=13)
+        self.assertEqual(self.progress.state, ProgressState.PROBE)
+        self.assertEqual(self.progress.next_index, 13)
+        self.assertEqual(self.progress.inflight, 0)
+
+        self.progress.acked(first, 20, leader_last_index=20, catch_up_threshold=100)
+        self.assertEqual(self.progress.state, ProgressState.PROBE)
+        self.assertEqual(self.progress.match_index, 20)
+
+    def test_unreachable_resends_from_match_index(self):
+        epoch = self.progress.sent(0)
+        self.progress.acked(epoch, 10, leader_last_index=20, catch_up_threshold=100)
+        epoch = self.progress.sent(10)
+        self.progress.unreachable(epoch)
+        self.assertEqual(self.progress.next_index, 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
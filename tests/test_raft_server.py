@@ -0,0 +1,955 @@
+import concurrent.futures
+import json
+import re
+import threading
+import time
+import unittest
+import xmlrpc.client
+from unittest import mock
+
+from pymongo.errors import DuplicateKeyError
+
+from src.raft_node.compression import Compressor
+from src.raft_node.entry_cache import EntryCache
+from src.raft_node.log import Log
+from src.raft_node.log_storage import MemoryLogStorage
+from src.raft_node.log_writer import LogWriter
+from src.raft_node.raft_server import RaftServer, RaftState
+
+
+def matches(document, query):
+    operators = {
+        '$gt': lambda value, operand: value is not None and value > operand,
+        '$gte': lambda value, operand: value is not None and value >= operand,
+        '$lte': lambda value, operand: value is not None and value <= operand,
+        '$ne': lambda value, operand: value != operand,
+        '$exists': lambda value, operand: (value is not None) == operand,
+        '$regex': lambda value, operand: value is not None and re.search(operand, value) is not None,
+    }
+    for field, condition in query.items():
+        if field == '$or':
+            if not any(matches(document, alternative) for alternative in condition):
+                return False
+            continue
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if not all(operators[op](value, operand) for op, operand in condition.items()):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCursor(list):
+    def sort(self, field, direction=1):
+        return FakeCursor(sorted(self, key=lambda document: document[field], reverse=direction < 0))
+
+    def limit(self, count):
+        return FakeCursor(self[:count])
+
+
+class FakeCollection:
+    """
+    In-memory stand-in for the pymongo collections used by the Log. Documents are
+    also indexed by their 'index' field, so that updating an entry is a lookup.
+    """
+    def __init__(self):
+        self.documents = []
+        self.by_index = {}
+
+    def reindex(self):
+        self.by_index = {d['index']: d for d in self.documents if 'index' in d}
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(dict(d) for d in self.documents if matches(d, query or {}))
+
+    def find_one(self, query, sort=None):
+        found = self.find(query)
+        for field, direction in sort or []:
+            found = found.sort(field, direction)
+        return found[0] if found else None
+
+    def insert_one(self, document):
+        self.insert_many([document])
+
+    def insert_many(self, documents):
+        for document in documents:
+            document = dict(document)
+            if 'index' in document and document['index'] in self.by_index:
+                raise DuplicateKeyError(f"E11000 duplicate key error index: {document['index']}")
+            self.documents.append(document)
+            if 'index' in document:
+                self.by_index[document['index']] = document
+
+    def update_one(self, query, update, upsert=False):
+        if list(query) == ['index'] and not isinstance(query['index'], dict):
+            document = self.by_index.get(query['index'])
+            if document is not None:
+                document.update(update['$set'])
+            return
+        for document in self.documents:
+            if matches(document, query):
+                break
+        else:
+            if not upsert:
+                return
+            document = dict(query)
+            self.documents.append(document)
+        document.update(update.get('$set', {}))
+        for field, value in update.get('$max', {}).items():
+            document[field] = max(document.get(field, value), value)
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            self.replace_one(request._filter, request._doc, request._upsert)
+
+    def update_many(self, query, update):
+        for document in self.documents:
+            if matches(document, query):
+                document.update(update['$set'])
+
+    def replace_one(self, query, document, upsert=False):
+        self.delete_many(query)
+        self.insert_one(document)
+
+    def delete_one(self, query):
+        for document in self.documents:
+            if matches(document, query):
+                self.documents.remove(document)
+                self.reindex()
+                return
+
+    def delete_many(self, query):
+        before = len(self.documents)
+        self.documents = [d for d in self.documents if not matches(d, query)]
+        self.reindex()
+        return mock.Mock(deleted_count=before - len(self.documents))
+
+
+class FakeLog(Log):
+    """
+    The Log on an in-memory storage, with the state machine RPCs replaced by in-memory fakes.
+    """
+    def __init__(self, *args, storage=None, **kwargs):
+        self.server_id = 1
+        self.storage = storage or MemoryLogStorage()
+        self.snapshot_chunk_size = 16
+        self.window_entries = 1000
+        self.prefetch_entries = 100
+        self.cache = EntryCache(1048576)
+        self.writer = LogWriter(self.storage)
+        self.compressor = Compressor()
+        self.applied = []
+        self.restored = None
+        self.snapshot_index = 0
+        self.snapshot_term = 0
+        self.snapshot_membership = None
+        self.entries = []
+        self.load_entries()
+        self.load_hard_state()
+        self.last_applied = self.load_last_applied()
+        self.applied_bytes_since_snapshot = 0
+
+    def append_to_state_machine(self, _append_entry):
+        self.applied.append(_append_entry)
+
+    def apply_to_state_machine(self, entries):
+        for entry in entries:
+            self.append_to_state_machine(entry.command)
+        return entries[-1].index
+
+    def create_state_machine_snapshot(self):
+        return json.dumps(self.applied)
+
+    def restore_state_machine_snapshot(self, data):
+        self.restored = data
+
+
+class FakePeer:
+    def __init__(self, response=None, delay=0.0):
+        self.response = response
+        self.delay = delay
+
+    def call(self, method, *args):
+        time.sleep(self.delay)
+        return self.response
+
+
+def make_server(number_of_nodes):
+    raft_servers = {i: {'host': 'localhost', 'port': 5000 + i} for i in range(1, number_of_nodes + 1)}
+    with mock.patch('src.raft_node.raft_server.Log', FakeLog):
+        server = RaftServer(1, raft_servers, None, None, None)
+    server.election_timeout = 1.0
+    return server
+
+
+class TestStartElection(unittest.TestCase):
+
+    def test_majority_wins_without_waiting_for_slow_peers(self):
+        server = make_server(5)
+        granted = {'term': 1, 'vote_granted': True}
+        server.clients = {2: FakePeer(granted), 3: FakePeer(granted), 4: FakePeer(None, delay=2),
+                          5: FakePeer(None, delay=2)}
+        server.current_term = 1
+        server.state = RaftState.CANDIDATE
+
+        start = time.time()
+        server.start_election()
+
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(server.state, RaftState.LEADER)
+        self.assertFalse(server.election_in_progress)
+
+    def test_higher_term_steps_down(self):
+        server = make_server(3)
+        server.clients = {2: FakePeer({'term': 7, 'vote_granted': False}), 3: FakePeer(None, delay=2)}
+        server.current_term = 1
+        server.state = RaftState.CANDIDATE
+
+        server.start_election()
+
+        self.assertEqual(server.state, RaftState.FOLLOWER)
+        self.assertEqual(server.current_term, 7)
+
+    def test_lost_election_when_majority_unreachable(self):
+        server = make_server(3)
+        denied = {'term': 1, 'vote_granted': False}
+        server.clients = {2: FakePeer(denied), 3: FakePeer(denied)}
+        server.current_term = 1
+        server.state = RaftState.CANDIDATE
+
+        server.start_election()
+
+        self.assertEqual(server.state, RaftState.FOLLOWER)
+
+    def test_concurrent_vote_requests_grant_one_vote_per_term(self):
+        server = make_server(3)
+        save_hard_state = server.log.save_hard_state
+        server.log.save_hard_state = lambda term, voted_for: (time.sleep(0.05), save_hard_state(term, voted_for))
+        request_vote = server.rpc_functions()['request_vote']
+        responses = []
+
+        threads = [threading.Thread(target=lambda candidate_id=candidate_id: responses.append(
+            request_vote(candidate_id, 6, 0, 0))) for candidate_id in (2, 3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual([response['vote_granted'] for response in responses].count(True), 1)
+        self.assertEqual(server.current_term, 6)
+
+    def test_a_newer_term_clears_the_vote_with_a_single_write(self):
+        server = make_server(3)
+        server.current_term = 2
+        server.voted_for = 1
+
+        with mock.patch.object(server.log, 'save_hard_state', wraps=server.log.save_hard_state) as save_hard_state:
+            self.assertTrue(server.request_vote_rpc(2, 3, 0, 0)['vote_granted'])
+
+        self.assertEqual([call.args for call in save_hard_state.call_args_list], [(3, None), (3, 2)])
+
+    def test_vote_is_kept_across_a_restart(self):
+        server = make_server(3)
+        self.assertTrue(server.request_vote_rpc(2, 3, 0, 0)['vote_granted'])
+
+        raft_servers = {i: {'host': 'localhost', 'port': 5000 + i} for i in range(1, 4)}
+        with mock.patch('src.raft_node.raft_server.Log', lambda *args, **kwargs: FakeLog(storage=server.log.storage)):
+            restarted = RaftServer(1, raft_servers, None, None, None)
+
+        self.assertEqual((restarted.current_term, restarted.voted_for), (3, 2))
+        self.assertFalse(restarted.request_vote_rpc(3, 3, 0, 0)['vote_granted'])
+        self.assertTrue(restarted.request_vote_rpc(3, 4, 0, 0)['vote_granted'])
+
+
+class TestPreVote(unittest.TestCase):
+
+    def test_failed_pre_vote_keeps_term(self):
+        server = make_server(3)
+        denied = {'term': 3, 'vote_granted': False}
+        server.clients = {2: FakePeer(denied), 3: FakePeer(denied)}
+        server.current_term = 3
+        server.pre_vote = True
+
+        server.transition_to_candidate()
+
+        self.assertEqual(server.state, RaftState.FOLLOWER)
+        self.assertEqual(server.current_term, 3)
+        self.assertEqual(server.metrics.to_dict()['elections_avoided'], 1)
+
+    def test_pre_vote_denied_while_leader_is_alive(self):
+        server = make_server(3)
+        server.current_term = 2
+        server.last_leader_contact = time.time()
+
+        response = server.pre_vote_rpc(2, 3, 0, 0)
+
+        self.assertFalse(response['vote_granted'])
+        self.assertEqual(server.current_term, 2)
+
+    def test_pre_vote_granted_after_leader_timeout(self):
+        server = make_server(3)
+        server.current_term = 2
+
+        response = server.pre_vote_rpc(2, 3, 0, 0)
+
+        self.assertTrue(response['vote_granted'])
+        self.assertIsNone(server.voted_for)
+
+
+class TestReadIndex(unittest.TestCase):
+
+    def make_leader(self):
+        server = make_server(3)
+        server.clients = {2: FakePeer({'term': 1, 'success': True, 'index': -1}),
+                          3: FakePeer({'term': 1, 'success': True, 'index': -1})}
+        server.current_term = 1
+        server.transition_to_leader(verbose=False)
+        return server
+
+    def test_no_read_index_before_current_term_commit(self):
+        server = self.make_leader()
+        self.assertIsNone(server.read_index())
+
+    def test_lease_read_does_not_contact_followers(self):
+        server = self.make_leader()
+        server.commit_index = server.log.get_last_index()
+        server.read_mode = 'lease'
+        server.clients = {}
+
+        self.assertEqual(server.read_index(), server.commit_index)
+
+    def test_a_waiting_read_barrier_does_not_hold_up_the_other_rpcs(self):
+        server = self.make_leader()
+        server.commit_index = server.log.get_last_index()
+        server.clients = {2: FakePeer(), 3: FakePeer()}
+        server.max_val_for_timeout = 1
+        functions = server.rpc_functions()
+        reads = []
+        reader = threading.Thread(target=lambda: reads.append(functions['read_index']()))
+        reader.start()
+        time.sleep(0.05)
+
+        started = time.monotonic()
+        response = functions['append_entries'](2, 2, 0, 0, [], 0)
+
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertTrue(response['success'])
+        reader.join(5)
+        self.assertFalse(reads[0]['success'])
+
+    def test_the_rpc_server_is_threaded(self):
+        server = make_server(3)
+
+        with mock.patch('src.raft_node.raft_server.RPCServer') as rpc_server, \
+                mock.patch('src.raft_node.raft_server.RPCClient'), \
+                mock.patch.object(server, 'start_replicator'), mock.patch.object(server.applier, 'start'):
+            server.run()
+
+        rpc_server.assert_called_once_with(host='localhost', port=5001, threaded=True)
+
+    def test_check_quorum_fails_without_acknowledgements(self):
+        server = self.make_leader()
+        self.assertTrue(server.check_quorum())
+        server.last_ack = {2: 0, 3: 0}
+        self.assertFalse(server.check_quorum())
+        self.assertFalse(server.has_lease())
+
+    def test_follower_is_fresh_once_it_has_applied_the_leader_commit_index(self):
+        follower = make_server(3)
+        entries = [{'index': i, 'term': 1, 'command': f"command{i}"} for i in (1, 2)]
+        follower.append_entries_rpc(1, 2, 0, 0, entries, 2)
+
+        self.assertEqual(follower.read_staleness(), (2, float('inf')))
+
+        follower.applier.apply_committed()
+        entries_behind, seconds = follower.read_staleness()
+        self.assertEqual(entries_behind, 0)
+        self.assertLess(seconds, 0.1)
+
+    def test_bounded_read_waits_for_the_state_machine(self):
+        follower = make_server(3)
+        follower.append_entries_rpc(1, 2, 0, 0, [{'index': 1, 'term': 1, 'command': 'write'}], 1)
+        self.assertIsNone(follower.wait_for_bounded_staleness(max_entries=0, timeout=0.05))
+        self.assertEqual(follower.wait_for_bounded_staleness(max_entries=1, timeout=0.05)[0], 1)
+
+        follower.applier.start()
+        self.addCleanup(follower.applier.stop)
+        self.assertEqual(follower.wait_for_bounded_staleness(max_entries=0, max_seconds=0.5, timeout=1)[0], 0)
+
+
+class LoopbackClient:
+    """
+    Calls the RPC functions of another in-process RaftServer, marshalling the arguments with XML-RPC.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.calls = 0
+
+    def call(self, method, *args):
+        self.calls += 1
+        args, _ = xmlrpc.client.loads(xmlrpc.client.dumps(args, allow_none=True))
+        if method == 'append_entries':
+            return self.server.append_entries_rpc(*args)
+        if method == 'install_snapshot':
+            return self.server.install_snapshot_rpc(*args)
+        if method == 'request_vote':
+            return self.server.request_vote_rpc(*args)
+        if method == 'pre_vote':
+            return self.server.pre_vote_rpc(*args)
+        if method == 'timeout_now':
+            return self.server.timeout_now_rpc(*args)
+        return None
+
+
+class TestReplication(unittest.TestCase):
+
+    def make_pair(self, number_of_entries):
+        leader = make_server(2)
+        follower = make_server(2)
+        follower.server_id = 2
+        leader.clients = {2: LoopbackClient(follower)}
+        leader.current_term = 1
+        for i in range(number_of_entries):
+            leader.log.append_entry(1, f"command{i}")
+        leader.transition_to_leader(verbose=False)
+        leader.max_entries_per_message = 100
+        return leader, follower
+
+    def test_lagging_follower_is_caught_up_in_bounded_batches(self):
+        leader, follower = self.make_pair(1000)
+        leader.catch_up_threshold = 0
+        # the follower is empty, the first probe is rejected and the leader streams from the start
+        leader.send_append_entries_to_servers_multicast()
+        leader.send_append_entries_to_servers_multicast()
+        deadline = time.time() + 5
+        while leader.progress[2].match_index < leader.log.get_last_index() and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(follower.log.get_last_index(), leader.log.get_last_index())
+        self.assertEqual([entry.command for entry in follower.log.entries],
+                         [entry.command for entry in leader.log.entries])
+        self.assertEqual(leader.progress[2].match_index, leader.log.get_last_index())
+
+    def test_append_is_replicated_without_waiting_for_the_heartbeat(self):
+        leader, follower = self.make_pair(0)
+        leader.heartbeat_interval = 10
+        leader.is_running = True
+        leader.start_replicator(2)
+        self.addCleanup(leader.replicators[2].stop)
+        deadline = time.time() + 5
+        while leader.progress[2].match_index < leader.log.get_last_index() and time.time() < deadline:
+            time.sleep(0.01)
+
+        started = time.time()
+        index = leader.append_batch_to_leader(['write'])[0]
+        while follower.log.get_last_index() < index and time.time() < deadline:
+            time.sleep(0.001)
+
+        self.assertEqual(follower.log.get_entry(index).command, 'write')
+        self.assertLess(time.time() - started, 1)
+
+    def test_batch_sent_twice_is_not_appended_twice(self):
+        leader, follower = self.make_pair(3)
+        entries = leader.log.get_entries(1, 10, 1000)
+        for _ in range(2):
+            follower.append_entries_rpc(1, 1, 0, 1, [entry.to_dict() for entry in entries], 0)
+
+        self.assertEqual(follower.log.get_last_index(), leader.log.get_last_index())
+
+    def test_follower_stores_a_batch_with_one_write(self):
+        leader, follower = self.make_pair(5)
+        follower.log.append_entry(1, 'command0')
+        entries = [entry.to_dict() for entry in leader.log.get_entries(1, 10, 1000)]
+
+        with mock.patch.object(follower.log.storage, 'append', wraps=follower.log.storage.append) as append:
+            follower.append_entries_rpc(1, 1, 0, 0, entries, 0)
+
+        append.assert_called_once()
+        self.assertEqual([entry.index for entry in append.call_args[0][0]], [2, 3, 4, 5, 6])
+        self.assertEqual([entry.command for entry in follower.log.entries],
+                         [entry.command for entry in leader.log.entries])
+
+    def test_follower_truncates_conflicting_entries(self):
+        leader, follower = self.make_pair(0)
+        follower.log.append_entry(0, 'stale1')
+        follower.log.append_entry(0, 'stale2')
+
+        response = follower.append_entries_rpc(1, 1, 2, 1, [], 0)
+
+        self.assertFalse(response['success'])
+        self.assertEqual(response['index'], 1)
+        self.assertEqual(follower.log.get_last_index(), 1)
+
+
+class TestCommit(unittest.TestCase):
+
+    def make_leader(self, number_of_nodes):
+        leader = make_server(number_of_nodes)
+        leader.current_term = 2
+        leader.transition_to_leader(verbose=False)
+        return leader
+
+    def test_entries_of_earlier_terms_wait_for_an_entry_of_the_current_term(self):
+        leader = make_server(3)
+        leader.log.append_entries(1, ['old1', 'old2'])
+        leader.current_term = 2
+        leader.transition_to_leader(verbose=False)
+        noop_index = leader.log.get_last_index()
+
+        leader.match_index.update(2, 2)
+        leader.commit_leader_entries()
+        self.assertEqual(leader.commit_index, 0)
+
+        leader.match_index.update(2, noop_index)
+        leader.commit_leader_entries()
+        self.assertEqual(leader.commit_index, noop_index)
+        leader.applier.apply_committed()
+        self.assertEqual(leader.log.last_applied, noop_index)
+
+    def test_ack_from_a_quorum_commits_and_applies_right_away(self):
+        leader = self.make_leader(3)
+        follower = make_server(3)
+        follower.server_id = 2
+        leader.clients = {2: LoopbackClient(follower), 3: FakePeer()}
+        leader.progress[3].become_probe(leader.log.get_last_index() + 1)
+        index = leader.append_batch_to_leader(['write'])[0]
+
+        for future in leader.send_append_entries(2, heartbeat=False):
+            future.result()
+        leader.log.writer.wait_for_callbacks()
+
+        self.assertEqual(leader.commit_index, index)
+        leader.applier.apply_committed()
+        self.assertEqual(leader.log.applied[-1], 'write')
+        metrics = leader.metrics.to_dict()
+        self.assertEqual(metrics['commit_latency']['count'], 2)
+        self.assertEqual(metrics['apply_latency']['count'], 2)
+        self.assertEqual(leader.append_times, {})
+
+    def test_write_is_acknowledged_once_applied(self):
+        leader = self.make_leader(3)
+        index = leader.append_batch_to_leader(['write'])[0]
+
+        self.assertEqual(leader.wait_for_index(index, leader.current_term, timeout=0.05), 'TIMEOUT')
+
+        leader.log.writer.wait_for_callbacks()
+        leader.match_index.update(2, index)
+        leader.commit_leader_entries()
+        leader.applier.apply_committed()
+        self.assertEqual(leader.wait_for_index(index, leader.current_term, timeout=0.05), 'APPLIED')
+
+    def test_a_waiting_write_does_not_hold_up_the_other_rpcs(self):
+        follower = make_server(3)
+        functions = follower.rpc_functions()
+        statuses = []
+        waiter = threading.Thread(target=lambda: statuses.append(functions['wait_for_index'](1, 1, 5)))
+        waiter.start()
+        time.sleep(0.05)
+
+        response = functions['append_entries'](1, 2, 0, 0, [{'index': 1, 'term': 1, 'command': 'write'}], 1)
+        follower.applier.apply_committed()
+
+        waiter.join(1)
+        self.assertTrue(response['success'])
+        self.assertEqual(statuses, ['APPLIED'])
+
+    def test_write_overwritten_by_another_leader_is_lost(self):
+        follower = make_server(3)
+        follower.append_entries_rpc(1, 2, 0, 0, [{'index': 1, 'term': 1, 'command': 'old'}], 0)
+
+        follower.append_entries_rpc(2, 3, 0, 0, [{'index': 1, 'term': 2, 'command': 'new'}], 1)
+        follower.applier.apply_committed()
+
+        self.assertEqual(follower.wait_for_index(1, 1, timeout=0.05), 'LOST')
+        self.assertEqual(follower.wait_for_index(1, 2, timeout=0.05), 'APPLIED')
+
+    def test_the_leader_counts_itself_once_its_own_write_is_done(self):
+        leader = self.make_leader(3)
+        follower = make_server(3)
+        follower.server_id = 2
+        leader.clients = {2: LoopbackClient(follower), 3: FakePeer()}
+        leader.progress[3].become_probe(leader.log.get_last_index() + 1)
+        stored = threading.Event()
+        append = leader.log.storage.append
+        leader.log.storage.append = lambda entries: (stored.wait(5), append(entries))
+
+        index = leader.append_batch_to_leader(['write'])[0]
+        for future in leader.send_append_entries(2, heartbeat=False):
+            future.result()
+
+        # replicated while the leader writes it, but a single follower is not a quorum of 3
+        self.assertEqual(follower.log.get_entry(index).command, 'write')
+        self.assertLess(leader.commit_index, index)
+        stored.set()
+        leader.log.writer.wait_for_callbacks()
+        self.assertEqual(leader.commit_index, index)
+
+    def test_writes_are_refused_while_the_apply_queue_is_full(self):
+        leader = self.make_leader(3)
+        leader.applier.max_pending = 2
+        leader.append_batch_to_leader(['write1', 'write2'])
+        leader.log.writer.wait_for_callbacks()
+        leader.match_index.update(2, 3)
+        leader.commit_leader_entries()
+        self.assertEqual(leader.commit_index, 3)
+
+        self.assertFalse(leader.append_entries_to_leader({'commands': ['write3']}))
+        self.assertEqual(leader.metrics.to_dict()['apply_backpressure'], 1)
+
+        leader.applier.apply_committed()
+        self.assertFalse(leader.applier.is_full())
+
+
+class TestLeadershipTransfer(unittest.TestCase):
+
+    def make_pair(self, number_of_entries):
+        leader = make_server(2)
+        follower = make_server(2)
+        follower.server_id = 2
+        leader.clients = {2: LoopbackClient(follower)}
+        follower.clients = {1: LoopbackClient(leader)}
+        leader.current_term = 1
+        follower.current_term = 1
+        leader.log.append_entries(1, [f"command{i}" for i in range(number_of_entries)])
+        leader.transition_to_leader(verbose=False)
+        return leader, follower
+
+    def wait_for_leader(self, server):
+        deadline = time.time() + 5
+        while server.state != RaftState.LEADER and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_up_to_date_follower_takes_over(self):
+        leader, follower = self.make_pair(3)
+        concurrent.futures.wait(leader.send_append_entries(2, heartbeat=False))
+
+        self.assertEqual(leader.transfer_leadership(), 2)
+        self.wait_for_leader(follower)
+
+        self.assertEqual(follower.state, RaftState.LEADER)
+        self.assertEqual(follower.current_term, 2)
+        self.assertEqual(leader.state, RaftState.FOLLOWER)
+        self.assertEqual(leader.current_term, 2)
+        self.assertEqual(leader.metrics.to_dict()['leadership_transfers'], 1)
+
+    def test_lagging_target_is_caught_up_before_timeout_now(self):
+        leader, follower = self.make_pair(250)
+        leader.max_entries_per_message = 100
+
+        self.assertEqual(leader.transfer_leadership(2), 2)
+        self.wait_for_leader(follower)
+
+        self.assertEqual(follower.state, RaftState.LEADER)
+        self.assertEqual([entry.command for entry in follower.log.entries[:len(leader.log.entries)]],
+                         [entry.command for entry in leader.log.entries])
+
+    def test_writes_are_refused_during_a_transfer(self):
+        leader, _ = self.make_pair(0)
+        leader.transfer_target = 2
+
+        self.assertFalse(leader.append_entries_to_leader({'commands': ['write'], 'rep_ids': [1]}))
+        with self.assertRaises(RuntimeError):
+            leader.append_batch_to_leader(['write'])
+
+    def test_leader_refuses_timeout_now(self):
+        leader, _ = self.make_pair(0)
+
+        self.assertFalse(leader.timeout_now_rpc(leader.current_term, 2)['success'])
+        self.assertEqual(leader.state, RaftState.LEADER)
+
+
+def replicate_until_committed(leader, _server_id, index):
+    leader.log.writer.wait_for_callbacks()
+    for _ in range(20):
+        if leader.commit_index >= index:
+            return
+        concurrent.futures.wait(leader.send_append_entries(_server_id))
+
+
+class TestLearners(unittest.TestCase):
+
+    def make_leader_with_follower(self):
+        leader = make_server(2)
+        follower = make_server(2)
+        follower.server_id = 2
+        leader.clients = {2: LoopbackClient(follower)}
+        leader.current_term = 1
+        leader.transition_to_leader(verbose=False)
+        replicate_until_committed(leader, 2, leader.log.get_last_index())
+        return leader, follower
+
+    def add_learner(self, leader, client):
+        with mock.patch('src.raft_node.raft_server.RPCClient', return_value=client):
+            index = leader.add_node(3, 'localhost', 5003)
+            replicate_until_committed(leader, 2, index)
+
+    def test_learner_does_not_hold_back_the_commit_index(self):
+        leader, _ = self.make_leader_with_follower()
+        self.add_learner(leader, FakePeer())
+        index = leader.append_batch_to_leader(['write'])[0]
+
+        concurrent.futures.wait(leader.send_append_entries(2, heartbeat=False))
+        leader.log.writer.wait_for_callbacks()
+
+        self.assertEqual(leader.voters(), [1, 2])
+        self.assertEqual(leader.commit_index, index)
+        self.assertIn(3, leader.learners)
+
+    def test_learner_is_promoted_once_it_has_caught_up(self):
+        leader, follower = self.make_leader_with_follower()
+        leader.log.append_entries(1, [f"command{i}" for i in range(300)])
+        leader.learner_promotion_lag = 10
+        leader.max_entries_per_message = 100
+        learner = make_server(3)
+        learner.server_id = 3
+        self.add_learner(leader, LoopbackClient(learner))
+
+        # the empty learner first rejects the probe, it is not promoted while it replays the log
+        concurrent.futures.wait(leader.send_append_entries(3))
+        self.assertIn(3, leader.learners)
+        for _ in range(10):
+            concurrent.futures.wait(leader.send_append_entries(3))
+
+        self.assertNotIn(3, leader.learners)
+        self.assertEqual(leader.voters(), [1, 2, 3])
+        self.assertEqual(leader.match_index.get(3), learner.log.get_last_index())
+        self.assertEqual(leader.metrics.to_dict()['learner_promotions'], 1)
+        # the promotion is a configuration entry, the follower learns it from the log
+        with mock.patch('src.raft_node.raft_server.RPCClient'):
+            concurrent.futures.wait(leader.send_append_entries(2))
+        self.assertEqual(follower.voters(), [1, 2, 3])
+
+    def test_learner_is_not_asked_for_its_vote(self):
+        leader, _ = self.make_leader_with_follower()
+        learner = mock.Mock()
+        self.add_learner(leader, learner)
+        learner.reset_mock()
+        leader.clients[2] = FakePeer({'term': leader.current_term, 'vote_granted': True})
+
+        self.assertTrue(leader.collect_votes('request_vote', leader.current_term))
+        learner.call.assert_not_called()
+
+
+class TestMembership(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('src.raft_node.raft_server.RPCClient')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.leader = make_server(2)
+        self.follower = make_server(2)
+        self.follower.server_id = 2
+        self.leader.clients = {2: LoopbackClient(self.follower)}
+        self.leader.current_term = 1
+        self.leader.transition_to_leader(verbose=False)
+        replicate_until_committed(self.leader, 2, self.leader.log.get_last_index())
+
+    def test_configuration_entry_takes_effect_when_appended(self):
+        index = self.leader.add_node(3, 'localhost', 5003, learner=False, kv_port=7003)
+
+        self.assertEqual(self.leader.voters(), [1, 2, 3])
+        self.assertEqual(self.leader.membership.version, index)
+        self.assertEqual(self.leader.commit_index, index - 1)
+
+        concurrent.futures.wait(self.leader.send_append_entries(2))
+        self.leader.log.writer.wait_for_callbacks()
+
+        self.assertEqual(self.leader.commit_index, index)
+        self.assertEqual(self.follower.voters(), [1, 2, 3])
+        self.assertEqual(self.follower.membership.servers[3]['kv_port'], 7003)
+        self.assertIn(3, self.follower.clients)
+
+    def test_next_change_waits_for_the_previous_one_to_commit(self):
+        self.leader.add_node(3, 'localhost', 5003, learner=False)
+
+        with self.assertRaises(RuntimeError):
+            self.leader.delete_node(2)
+        self.assertFalse(self.leader.append_entries_to_leader({'membership': {'servers': {}, 'learners': []}}))
+
+    def test_truncated_configuration_entry_is_rolled_back(self):
+        index = self.leader.add_node(3, 'localhost', 5003, learner=False)
+        concurrent.futures.wait(self.leader.send_append_entries(2))
+        self.assertIn(3, self.follower.membership.servers)
+
+        # a leader of a newer term never saw the configuration entry
+        self.follower.append_entries_rpc(2, 1, index - 1, 1, [{'index': index, 'term': 2, 'command': 'other',
+                                                                'is_committed': False}], 0)
+
+        self.assertNotIn(3, self.follower.membership.servers)
+        self.assertNotIn(3, self.follower.clients)
+        self.assertEqual(self.follower.membership.version, 0)
+
+    def test_restart_and_snapshot_keep_the_configuration(self):
+        index = self.leader.add_node(3, 'localhost', 5003, learner=True)
+        replicate_until_committed(self.leader, 2, index)
+        self.leader.append_batch_to_leader(['write'])
+        replicate_until_committed(self.leader, 2, index + 1)
+        self.leader.applier.apply_committed()
+        self.leader.snapshot_threshold_entries = 1
+        self.leader.take_snapshot_if_needed()
+        self.assertEqual(self.leader.log.snapshot_index, index + 1)
+
+        log = self.leader.log
+        log.entries = []
+        log.snapshot_index = 0
+        log.load_entries()
+        with mock.patch('src.raft_node.raft_server.Log', return_value=log):
+            restarted = RaftServer(1, {1: {'host': 'localhost', 'port': 5001},
+                                       2: {'host': 'localhost', 'port': 5002}}, None, None, None)
+
+        self.assertEqual(sorted(restarted.raft_servers), [1, 2, 3])
+        self.assertEqual(restarted.learners, {3})
+
+    def test_changes_and_snapshots_go_on_while_the_leader_writes(self):
+        # the leader's writes commit their entries under the lock a membership change and a snapshot hold
+        append = self.leader.log.storage.append
+        self.leader.log.storage.append = lambda entries: (time.sleep(0.02), append(entries))
+        stop = threading.Event()
+
+        def write():
+            while not stop.is_set():
+                self.leader.append_batch_to_leader(['write'])
+                time.sleep(0.001)
+
+        def change_and_snapshot():
+            index = self.leader.add_node(3, 'localhost', 5003)
+            replicate_until_committed(self.leader, 2, index)
+            self.leader.applier.apply_committed()
+            self.leader.snapshot_threshold_entries = 1
+            self.leader.take_snapshot_if_needed()
+
+        writer = threading.Thread(target=write, daemon=True)
+        writer.start()
+        changer = threading.Thread(target=change_and_snapshot, daemon=True)
+        changer.start()
+        changer.join(10)
+        stop.set()
+        writer.join(10)
+
+        self.assertFalse(changer.is_alive())
+        self.assertIn(3, self.leader.learners)
+        self.assertGreater(self.leader.log.snapshot_index, 0)
+
+    def test_removed_leader_steps_down_once_the_change_is_committed(self):
+        index = self.leader.delete_node(1)
+
+        self.assertEqual(self.leader.state, RaftState.LEADER)
+        concurrent.futures.wait(self.leader.send_append_entries(2))
+
+        self.assertEqual(self.leader.commit_index, index)
+        self.assertEqual(self.leader.state, RaftState.FOLLOWER)
+        self.assertEqual(self.follower.voters(), [2])
+
+
+class TestConflictBacktracking(unittest.TestCase):
+
+    def test_term_boundaries_follow_appends_and_truncation(self):
+        log = make_server(2).log
+        log.append_entries(1, ['a', 'b'])
+        log.append_entries(3, ['c', 'd', 'e'])
+        log.append_entry(4, 'f')
+
+        self.assertEqual(log.first_index_of_term(3), 3)
+        self.assertEqual(log.last_index_of_term(3), 5)
+        self.assertEqual(log.last_index_of_term(4), 6)
+        self.assertIsNone(log.first_index_of_term(2))
+
+        log.delete_entries_after(3)
+        self.assertEqual(log.last_index_of_term(3), 3)
+        self.assertIsNone(log.first_index_of_term(4))
+
+    def test_divergent_follower_converges_in_a_few_rounds(self):
+        leader = make_server(2)
+        follower = make_server(2)
+        follower.server_id = 2
+        leader.clients = {2: LoopbackClient(follower)}
+        leader.max_entries_per_message = 20000
+        leader.max_bytes_per_message = 10 * 1024 * 1024
+        common = [f"common{i}" for i in range(100)]
+        leader.log.append_entries(1, common)
+        leader.log.append_entries(3, [f"leader{i}" for i in range(10000)])
+        follower.log.append_entries(1, common)
+        follower.log.append_entries(2, [f"old{i}" for i in range(5000)])
+        follower.log.append_entries(4, [f"stale{i}" for i in range(5000)])
+        leader.current_term = 5
+        leader.transition_to_leader(verbose=False)
+
+        rounds = 0
+        while leader.progress[2].match_index < leader.log.get_last_index() and rounds < 100:
+            leader.send_append_entries_to_servers_multicast()
+            rounds += 1
+
+        # one probe skips term 4, one skips term 2 and one sends the entries
+        self.assertLessEqual(rounds, 3, f"converged after {rounds} rounds")
+        self.assertEqual([entry.command for entry in follower.log.entries],
+                         [entry.command for entry in leader.log.entries])
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def make_leader_with_applied_entries(self, number_of_entries):
+        leader = make_server(2)
+        leader.current_term = 1
+        leader.transition_to_leader(verbose=False)
+        for i in range(number_of_entries):
+            leader.log.append_entry(1, f"command{i}")
+        leader.commit_index = leader.log.get_last_index()
+        leader.log.commit_entries(0, leader.commit_index)
+        leader.applier.submit(leader.commit_index)
+        leader.applier.apply_committed()
+        return leader
+
+    def test_snapshot_compacts_the_applied_prefix(self):
+        leader = self.make_leader_with_applied_entries(20)
+        leader.snapshot_threshold_entries = 10
+        leader.log.append_entry(1, 'not yet applied')
+
+        leader.take_snapshot_if_needed()
+
+        self.assertEqual(leader.log.snapshot_index, 21)
+        self.assertEqual(leader.log.get_last_index(), 22)
+        self.assertEqual(len(leader.log.entries), 1)
+        self.assertEqual(leader.log.get_term(21), 1)
+        self.assertEqual(len(leader.log.storage.entries), 1)
+        self.assertEqual(json.loads(leader.log.load_snapshot())[-1], 'command19')
+
+    def test_restart_loads_snapshot_and_tail(self):
+        leader = self.make_leader_with_applied_entries(20)
+        leader.snapshot_threshold_entries = 10
+        leader.take_snapshot_if_needed()
+        leader.log.append_entry(1, 'tail')
+
+        log = leader.log
+        log.entries = []
+        log.snapshot_index = 0
+        log.load_entries()
+
+        self.assertEqual(log.snapshot_index, 21)
+        self.assertEqual(log.get_last_index(), 22)
+        self.assertEqual(log.get_entry(22).command, 'tail')
+
+    def test_follower_behind_compaction_point_installs_snapshot(self):
+        leader = self.make_leader_with_applied_entries(20)
+        leader.snapshot_threshold_entries = 10
+        leader.take_snapshot_if_needed()
+        leader.log.append_entry(1, 'tail')
+        follower = make_server(2)
+        follower.server_id = 2
+        client = LoopbackClient(follower)
+        leader.clients = {2: client}
+        leader.reset_progress()
+        leader.progress[2].become_probe(1)
+
+        for _ in range(3):
+            leader.send_append_entries_to_servers_multicast()
+
+        self.assertEqual(follower.log.snapshot_index, 21)
+        self.assertEqual(follower.log.restored, leader.log.load_snapshot())
+        self.assertEqual(follower.log.get_last_index(), leader.log.get_last_index())
+        self.assertEqual(follower.log.get_entry(22).command, 'tail')
+        self.assertEqual(leader.progress[2].match_index, leader.log.get_last_index())
+
+
+if __name__ == '__main__':
+    unittest.main()
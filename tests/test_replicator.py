@@ -0,0 +1,85 @@
+import threading
+import time
+import unittest
+
+from src.raft_node.replicator import Replicator
+
+
+class TestReplicator(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.building = threading.Event()
+        self.replicator = None
+
+    def tearDown(self):
+        if self.replicator is not None:
+            self.replicator.stop()
+
+    def send(self, server_id, heartbeat):
+        self.calls.append((server_id, heartbeat, time.monotonic()))
+        return True
+
+    def test_sends_heartbeats_on_the_timer(self):
+        self.replicator = Replicator(2, self.send, heartbeat_interval=0.05)
+        self.replicator.start()
+        time.sleep(0.28)
+
+        self.assertGreaterEqual(len(self.calls), 4)
+        self.assertLessEqual(len(self.calls), 7)
+        self.assertTrue(all(server_id == 2 and heartbeat for server_id, heartbeat, _ in self.calls))
+
+    def test_notify_sends_without_waiting_for_the_heartbeat(self):
+        self.replicator = Replicator(2, self.send, heartbeat_interval=10)
+        self.replicator.start()
+        time.sleep(0.05)
+        self.calls.clear()
+
+        notified_at = time.monotonic()
+        self.replicator.notify()
+        time.sleep(0.05)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertFalse(self.calls[0][1])
+        self.assertLess(self.calls[0][2] - notified_at, 0.05)
+
+    def test_notifications_during_a_send_are_coalesced(self):
+        def slow_send(server_id, heartbeat):
+            self.calls.append((server_id, heartbeat, time.monotonic()))
+            self.building.set()
+            time.sleep(0.1)
+            return True
+
+        self.replicator = Replicator(2, slow_send, heartbeat_interval=10)
+        self.replicator.start()
+        self.building.wait(1)
+        for _ in range(20):
+            self.replicator.notify()
+        time.sleep(0.3)
+
+        # the initial heartbeat, then one send for all twenty notifications
+        self.assertEqual(len(self.calls), 2)
+
+    def test_without_heartbeat_interval_only_requested_heartbeats_are_sent(self):
+        self.replicator = Replicator(2, self.send, heartbeat_interval=None)
+        self.replicator.start()
+        time.sleep(0.1)
+        self.assertEqual(self.calls, [])
+
+        self.replicator.notify()
+        self.replicator.notify(heartbeat=True)
+        time.sleep(0.1)
+
+        self.assertIn(True, [heartbeat for _, heartbeat, _ in self.calls])
+        self.assertLessEqual(len(self.calls), 2)
+
+    def test_stop_ends_the_loop(self):
+        self.replicator = Replicator(2, self.send, heartbeat_interval=0.01)
+        self.replicator.start()
+        self.replicator.stop()
+        self.replicator.thread.join(1)
+
+        self.assertFalse(self.replicator.thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from src.raft_node.staleness import StalenessTracker
+
+
+class TestStalenessTracker(unittest.TestCase):
+    def setUp(self):
+        self.tracker = StalenessTracker()
+
+    def test_unknown_before_the_leader_is_heard_from(self):
+        self.assertEqual(self.tracker.staleness(0, 10.0), (float('inf'), float('inf')))
+
+    def test_fresh_as_of_the_last_contact_whose_commit_index_is_applied(self):
+        self.tracker.leader_contact(5, 1.0)
+        self.tracker.leader_contact(5, 2.0)
+        self.tracker.leader_contact(8, 3.0)
+
+        self.assertEqual(self.tracker.staleness(4, 4.0), (4, float('inf')))
+        self.assertEqual(self.tracker.staleness(5, 4.0), (3, 2.0))
+        self.assertEqual(self.tracker.staleness(8, 4.0), (0, 1.0))
+
+    def test_a_new_leader_behind_on_the_commit_index_does_not_refresh_the_follower(self):
+        self.tracker.leader_contact(8, 1.0)
+        # the new leader has not learnt that 8 was committed yet
+        self.tracker.leader_contact(6, 2.0)
+
+        self.assertEqual(self.tracker.staleness(6, 3.0), (2, float('inf')))
+        self.assertEqual(self.tracker.staleness(8, 3.0), (0, 1.0))
+
+    def test_dropped_contacts_only_overestimate_the_staleness(self):
+        tracker = StalenessTracker(max_samples=2)
+        for commit_index in range(1, 5):
+            tracker.leader_contact(commit_index, float(commit_index))
+
+        self.assertEqual(tracker.staleness(2, 5.0), (2, float('inf')))
+        self.assertEqual(tracker.staleness(3, 5.0), (1, 2.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
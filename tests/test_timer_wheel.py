@@ -0,0 +1,56 @@
+import asyncio
+import unittest
+
+from src.raft_node.timer_wheel import TimerWheel
+
+
+class TestTimerWheel(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.wheel = TimerWheel(tick=0.005, slots=16)
+        self.loop = asyncio.get_running_loop()
+        self.fired = {}
+
+    async def asyncTearDown(self):
+        self.wheel.stop()
+
+    def fire(self, name):
+        self.fired[name] = self.loop.time()
+
+    async def test_timer_fires_within_one_tick_of_its_deadline(self):
+        scheduled_at = self.loop.time()
+        self.wheel.schedule(0.05, self.fire, 'a')
+        await asyncio.sleep(0.1)
+
+        self.assertGreaterEqual(self.fired['a'] - scheduled_at, 0.05)
+        self.assertLess(self.fired['a'] - scheduled_at, 0.05 + 0.02)
+
+    async def test_timer_beyond_one_turn_waits_for_its_round(self):
+        scheduled_at = self.loop.time()
+        # 16 slots of 5 ms are one turn of 80 ms
+        self.wheel.schedule(0.15, self.fire, 'late')
+        self.wheel.schedule(0.01, self.fire, 'early')
+        await asyncio.sleep(0.1)
+        self.assertIn('early', self.fired)
+        self.assertNotIn('late', self.fired)
+
+        await asyncio.sleep(0.1)
+        self.assertGreaterEqual(self.fired['late'] - scheduled_at, 0.15)
+
+    async def test_cancelled_timer_does_not_fire(self):
+        timer = self.wheel.schedule(0.02, self.fire, 'a')
+        timer.cancel()
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(self.fired, {})
+        self.assertEqual(self.wheel.active, 0)
+
+    async def test_many_timers_are_driven_by_one_task(self):
+        for i in range(1000):
+            self.wheel.schedule(0.01 + (i % 10) * 0.005, self.fire, i)
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(len(self.fired), 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()